@@ -0,0 +1,292 @@
+'''Offline benchmarks for Consumer, Redoer and Exporter.
+
+Runs each service's go() in-process against stand-ins for Senzing, SQS, S3 and
+(by default) the export tracker database -- see fakes.py -- and measures
+throughput and p50/p99 latency. Results are written as JSON, which can be
+compared against an earlier run to catch performance regressions:
+
+    python3 bench/bench.py --out results.json
+    python3 bench/bench.py --compare results.json
+
+Each scenario runs in a subprocess of its own (the middleware modules keep
+module-level state and read their configuration at import time).'''
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+MIDDLEWARE_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'middleware')
+
+# Scenario name -> (service, environment variables for the service).
+SCENARIOS = {
+    'consumer':                  ('consumer', {}),
+    'consumer-batch10':          ('consumer', {'SQS_BATCH_SIZE': '10'}),
+    'consumer-batch10-workers4': ('consumer', {'SQS_BATCH_SIZE': '10', 'CONSUMER_WORKERS': '4'}),
+    'redoer':                    ('redoer', {}),
+    'redoer-workers4':           ('redoer', {'REDOER_WORKERS': '4'}),
+    'exporter-full':             ('exporter', {'EXPORT_MODE': 'full'}),
+    'exporter-full-gzip':        ('exporter', {'EXPORT_MODE': 'full', 'EXPORT_COMPRESSION': 'gzip'}),
+    'exporter-full-checkpoint':  ('exporter', {'EXPORT_MODE': 'full', 'EXPORT_CHECKPOINT': '1'}),
+    # One shard (of four) of a sharded full export.
+    'exporter-full-shard':       ('exporter', {'EXPORT_MODE': 'full', 'EXPORT_SHARDS': '4',
+                                               'EXPORT_SHARD_INDEX': '0', 'EXPORT_RUN_ID': 'bench',
+                                               'EXPORT_FETCH_WORKERS': '4'}),
+    'exporter-delta':            ('exporter', {'EXPORT_MODE': 'delta'}),
+    'exporter-delta-fetch4':     ('exporter', {'EXPORT_MODE': 'delta', 'EXPORT_FETCH_WORKERS': '4'}),
+}
+
+# Workload knobs, passed through to the scenario subprocesses.
+KNOBS = {
+    'messages':       (int, 2000, 'SQS messages for consumer scenarios'),
+    'redos':          (int, 2000, 'redo records for redoer scenarios'),
+    'entities':       (int, 20000, 'entities for exporter scenarios'),
+    'fanout':         (int, 2, 'affected entities per add_record / process_redo_record'),
+    'sz_latency_ms':  (float, 2.0, 'mean latency of a fake Senzing call'),
+    'sqs_latency_ms': (float, 5.0, 'mean latency of a fake SQS call'),
+    's3_latency_ms':  (float, 20.0, 'mean latency of a fake S3 upload_part call'),
+    'db_latency_ms':  (float, 1.0, 'mean latency of a fake export tracker call'),
+}
+
+#-------------------------------------------------------------------------------
+# Scenario subprocess
+
+def _summarize(items, start, end, latencies, ok=True, extra=None):
+    import fakes
+    seconds = (end - start) if (start is not None and end is not None) else None
+    return {
+        'ok': ok,
+        'items': items,
+        'seconds': seconds,
+        'throughput_per_sec': (items / seconds) if seconds else None,
+        'latency_ms': {k: (v * 1000 if v is not None else None)
+                       for k, v in fakes.percentiles(latencies).items()},
+        'extra': extra or {}}
+
+def _install_db(args):
+    import fakes
+    if args.postgres:
+        import db
+        return db
+    db = fakes.FakeDb(args.db_latency_ms)
+    sys.modules['db'] = db
+    return db
+
+def _run_until_done(go):
+    import fakes
+    try:
+        go()
+    except fakes.BenchDone:
+        pass
+
+def run_consumer(args, engine):
+    import fakes
+    db = _install_db(args)
+    bodies = [json.dumps({
+        'DATA_SOURCE': 'BENCH',
+        'RECORD_ID': str(n),
+        'NAME_FULL': f'Bench Person {n}',
+        'ADDR_FULL': f'{n} Main St, Springfield',
+        'PHONE_NUMBER': f'555-{n % 10000:04d}'}) for n in range(args.messages)]
+    sqs = fakes.FakeSQS(bodies, args.sqs_latency_ms)
+    import consumer
+    consumer.init = lambda: sqs
+    _run_until_done(consumer.go)
+    return _summarize(
+        len(sqs.latencies), sqs.first_receive, sqs.last_delete, sqs.latencies,
+        ok=len(sqs.latencies) == args.messages,
+        extra={'sqs_calls': dict(sqs.num_calls),
+               'db_calls': dict(getattr(db, 'num_calls', {}))})
+
+def run_redoer(args, engine):
+    db = _install_db(args)
+    import redoer
+    _run_until_done(redoer.go)
+    return _summarize(
+        len(engine.redo_latencies), engine.first_call, engine.last_done, engine.redo_latencies,
+        ok=len(engine.redo_latencies) == args.redos,
+        extra={'db_calls': dict(getattr(db, 'num_calls', {}))})
+
+def run_exporter(args, engine):
+    import fakes
+    db = _install_db(args)
+    s3 = fakes.FakeS3(args.s3_latency_ms)
+    entity_ids = list(range(1, args.entities + 1))
+    shards = int(os.environ.get('EXPORT_SHARDS', 1))
+    if os.environ.get('EXPORT_MODE', 'delta') == 'delta' or shards > 1:
+        # (Sharded full exports take their entity IDs from the tracker, too.)
+        db.add_entity_ids(entity_ids)
+    if shards > 1:
+        entity_ids = [x for x in entity_ids if x % shards == int(os.environ['EXPORT_SHARD_INDEX'])]
+    import exporter
+    exporter.make_s3_client = lambda: s3
+    start = time.perf_counter()
+    exporter.go()
+    end = time.perf_counter()
+    # Time between successive fetches: per-entity overhead of the export loop,
+    # including any stalls waiting on uploads.
+    t = sorted(engine.fetch_times)
+    gaps = [b - a for a, b in zip(t, t[1:])]
+    return _summarize(
+        engine.num_fetched, start, end, gaps,
+        ok=bool(s3.completed) and not s3.aborted and engine.num_fetched == len(entity_ids),
+        extra={'bytes_uploaded': s3.bytes_uploaded(),
+               'parts': sum(len(u['Parts']) for u in s3.uploads.values()),
+               'part_upload_ms': {k: (v * 1000 if v is not None else None)
+                                  for k, v in fakes.percentiles(s3.part_latencies).items()},
+               'db_calls': dict(getattr(db, 'num_calls', {}))})
+
+RUNNERS = {'consumer': run_consumer, 'redoer': run_redoer, 'exporter': run_exporter}
+
+def run_scenario(name, args):
+    '''Runs in the scenario subprocess; writes the result to args.result_file.'''
+    service, _ = SCENARIOS[name]
+    for k, v in {
+            'Q_URL': 'bench-queue',
+            'S3_BUCKET_NAME': 'bench-bucket',
+            'SENZING_ENGINE_CONFIGURATION_JSON': '{}',
+            'RUNTIME_ENV': 'bench',
+            'LOG_LEVEL': 'WARNING'}.items():
+        os.environ.setdefault(k, v)
+    sys.path.insert(0, MIDDLEWARE_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    import fakes
+    engine = fakes.FakeSzEngine(
+        latency_ms=args.sz_latency_ms,
+        fanout=args.fanout,
+        num_entities=args.entities,
+        num_redos=args.redos if service == 'redoer' else 0)
+    fakes.install_fake_senzing_core(engine)
+    result = RUNNERS[service](args, engine)
+    with open(args.result_file, 'w') as f:
+        json.dump(result, f)
+    # Skip interpreter shutdown: the services leave daemon threads (and an
+    # OTel exporter) behind, none of which matter here.
+    os._exit(0)
+
+#-------------------------------------------------------------------------------
+# Driver
+
+def _git_rev():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                              text=True, cwd=BENCH_DIR).stdout.strip() or None
+    except Exception:
+        return None
+
+def launch(name, args):
+    '''Runs scenario name in a subprocess; returns its result.'''
+    service, env_vars = SCENARIOS[name]
+    with tempfile.TemporaryDirectory() as tmp:
+        result_file = os.path.join(tmp, 'result.json')
+        cmd = [sys.executable, os.path.abspath(__file__), '--run', name, '--result-file', result_file]
+        for k in KNOBS: cmd += ['--' + k.replace('_', '-'), str(getattr(args, k))]
+        if args.postgres: cmd.append('--postgres')
+        env = dict(os.environ, **env_vars)
+        try:
+            proc = subprocess.run(cmd, env=env, capture_output=True, text=True, timeout=args.timeout)
+            failed = proc.returncode != 0 or not os.path.exists(result_file)
+        except subprocess.TimeoutExpired as e:
+            proc, failed = e, True
+        if failed:
+            print(f'{name}: FAILED', file=sys.stderr)
+            print((proc.stderr or '')[-4000:] if isinstance(proc.stderr, str) else '', file=sys.stderr)
+            result = {'ok': False, 'items': 0, 'seconds': None, 'throughput_per_sec': None,
+                      'latency_ms': {'p50': None, 'p99': None, 'max': None}, 'extra': {}}
+        else:
+            with open(result_file) as f:
+                result = json.load(f)
+    return {'scenario': name, 'service': service, 'env': env_vars, **result}
+
+def _fmt(x, spec='.1f'):
+    return '-' if x is None else format(x, spec)
+
+def _pct_change(new, old):
+    if new is None or not old: return None
+    return (new - old) / old
+
+def compare(results, baseline, threshold):
+    '''Prints results next to baseline; returns the names of scenarios that
+    regressed by more than threshold (throughput down, or p99 latency up).'''
+    base = {r['scenario']: r for r in baseline['results']}
+    regressed = []
+    for r in results:
+        b = base.get(r['scenario'])
+        if not b: continue
+        d_tput = _pct_change(r['throughput_per_sec'], b['throughput_per_sec'])
+        d_p99 = _pct_change(r['latency_ms']['p99'], b['latency_ms']['p99'])
+        flag = ''
+        if not r['ok'] or (d_tput is not None and d_tput < -threshold) \
+                or (d_p99 is not None and d_p99 > threshold):
+            flag = '  <-- REGRESSION'
+            regressed.append(r['scenario'])
+        print(f'{r["scenario"]:28} throughput {_fmt(d_tput, "+.1%"):>8}   p99 {_fmt(d_p99, "+.1%"):>8}{flag}')
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--only', nargs='*', choices=sorted(SCENARIOS),
+                        help='scenarios to run (default: all)')
+    parser.add_argument('--out', help='where to write the results JSON '
+                        + '(default: bench-results-<timestamp>.json)')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='results JSON of an earlier run to compare against; '
+                        + 'exits non-zero on regression')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='relative change counted as a regression (default: 0.10)')
+    parser.add_argument('--timeout', type=int, default=600,
+                        help='seconds allowed per scenario (default: 600)')
+    parser.add_argument('--postgres', action='store_true',
+                        help='use the real export tracker database (PG* environment '
+                        + 'variables) instead of the in-memory stand-in')
+    for k, (typ, default, desc) in KNOBS.items():
+        parser.add_argument('--' + k.replace('_', '-'), type=typ, default=default,
+                            help=f'{desc} (default: {default})')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_scenario(args.run, args)
+        return
+
+    results = []
+    for name in (args.only or SCENARIOS):
+        r = launch(name, args)
+        results.append(r)
+        print(f'{name:28} {"ok" if r["ok"] else "FAILED":6} '
+              + f'{_fmt(r["throughput_per_sec"]):>9}/s   '
+              + f'p50 {_fmt(r["latency_ms"]["p50"], ".2f"):>8} ms   '
+              + f'p99 {_fmt(r["latency_ms"]["p99"], ".2f"):>8} ms')
+
+    out = {
+        'meta': {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'git_rev': _git_rev(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'knobs': {k: getattr(args, k) for k in KNOBS},
+            'postgres': args.postgres},
+        'results': results}
+    out_path = args.out or datetime.datetime.now().strftime('bench-results-%Y%m%dT%H%M%S.json')
+    with open(out_path, 'w') as f:
+        json.dump(out, f, indent=2)
+    print(f'Results written to {out_path}')
+
+    failed = [r['scenario'] for r in results if not r['ok']]
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f'Compared to {args.compare} ({baseline["meta"].get("git_rev")}):')
+        failed = sorted(set(failed) | set(compare(results, baseline, args.threshold)))
+    if failed:
+        print('Failed or regressed: ' + ', '.join(failed))
+        sys.exit(1)
+
+if __name__ == '__main__': main()
@@ -0,0 +1,530 @@
+'''In-process stand-ins for Senzing, SQS, S3 and the export tracker database,
+used by bench.py to run the middleware services without any infrastructure.
+
+Each fake records what the benchmark needs to know (timings, counts) and
+raises BenchDone once its part of the workload has been fully processed,
+which is how the (otherwise never-ending) consumer and redoer loops are
+stopped.'''
+
+import collections
+import contextlib
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+import types
+
+class BenchDone(BaseException):
+    '''Raised from inside a fake once the workload is done. (A BaseException,
+    so that it isn't swallowed by the services' `except Exception` handlers.)'''
+    pass
+
+def _sleep_ms(mean_ms, jitter=0.5):
+    if mean_ms > 0:
+        time.sleep(mean_ms * random.uniform(1 - jitter, 1 + jitter) / 1000)
+
+def percentiles(samples, pcts=(50, 99)):
+    '''Nearest-rank percentiles of samples, plus the max.'''
+    if not samples: return {f'p{p}': None for p in pcts} | {'max': None}
+    s = sorted(samples)
+    out = {f'p{p}': s[min(len(s) - 1, max(0, int(round(p / 100 * len(s))) - 1))] for p in pcts}
+    out['max'] = s[-1]
+    return out
+
+#-------------------------------------------------------------------------------
+# Senzing
+
+class FakeSzEngine:
+    '''Stands in for SzEngine. Every call sleeps for about latency_ms;
+    add_record and process_redo_record report fanout affected entities,
+    drawn from num_entities entity IDs.'''
+
+    def __init__(self, latency_ms=2.0, fanout=2, num_entities=10000,
+                 records_per_entity=3, num_redos=0):
+        self.latency_ms = latency_ms
+        self.fanout = fanout
+        self.num_entities = num_entities
+        self.records_per_entity = records_per_entity
+        self._lock = threading.Lock()
+        self._redo_q = collections.deque(
+            json.dumps({'REDO': n, 'DATA_SOURCE': 'BENCH', 'RECORD_ID': str(n)})
+            for n in range(num_redos))
+        self.num_redos = num_redos
+        self.redo_started = {}   # redo record -> time of get_redo_record
+        self.redo_latencies = []
+        self.first_call = None
+        self.last_done = None
+        self.num_added = 0
+        self.num_fetched = 0
+        self.fetch_times = []
+        self._exports = {}
+        self._handles = itertools.count(1)
+
+    def _start(self):
+        now = time.perf_counter()
+        with self._lock:
+            if self.first_call is None: self.first_call = now
+        return now
+
+    def _with_info(self, data_source, record_id):
+        ids = random.sample(range(1, self.num_entities + 1), min(self.fanout, self.num_entities))
+        return json.dumps({
+            'DATA_SOURCE': data_source,
+            'RECORD_ID': record_id,
+            'AFFECTED_ENTITIES': [{'ENTITY_ID': x} for x in ids],
+            'INTERESTING_ENTITIES': {'ENTITIES': []}})
+
+    def entity_doc(self, entity_id):
+        return json.dumps({
+            'RESOLVED_ENTITY': {
+                'ENTITY_ID': entity_id,
+                'ENTITY_NAME': f'Bench Entity {entity_id}',
+                'RECORD_SUMMARY': [{'DATA_SOURCE': 'BENCH', 'RECORD_COUNT': self.records_per_entity}],
+                'RECORDS': [{
+                    'DATA_SOURCE': 'BENCH',
+                    'RECORD_ID': f'{entity_id}-{n}',
+                    'INTERNAL_ID': entity_id * 100 + n,
+                    'MATCH_KEY': '+NAME+ADDRESS' if n else '',
+                    'MATCH_LEVEL_CODE': 'RESOLVED' if n else '',
+                    'ERRULE_CODE': 'CNAME_CFF' if n else ''}
+                    for n in range(self.records_per_entity)]},
+            'RELATED_ENTITIES': []})
+
+    def add_record(self, data_source, record_id, record, flags=0):
+        self._start()
+        _sleep_ms(self.latency_ms)
+        with self._lock:
+            self.num_added += 1
+        return self._with_info(data_source, record_id)
+
+    # Redo: raises BenchDone once every seeded redo record has been processed.
+
+    def _check_redo_done(self):
+        with self._lock:
+            if len(self.redo_latencies) >= self.num_redos: raise BenchDone()
+
+    def count_redo_records(self):
+        self._check_redo_done()
+        _sleep_ms(self.latency_ms)
+        with self._lock:
+            return len(self._redo_q)
+
+    def get_redo_record(self):
+        self._check_redo_done()
+        now = self._start()
+        _sleep_ms(self.latency_ms)
+        with self._lock:
+            if not self._redo_q: return ''
+            rcd = self._redo_q.popleft()
+            self.redo_started[rcd] = now
+            return rcd
+
+    def process_redo_record(self, redo_record, flags=0):
+        _sleep_ms(self.latency_ms)
+        rcd = json.loads(redo_record)
+        resp = self._with_info(rcd['DATA_SOURCE'], rcd['RECORD_ID'])
+        now = time.perf_counter()
+        with self._lock:
+            self.redo_latencies.append(now - self.redo_started.pop(redo_record))
+            self.last_done = now
+        return resp
+
+    # Export
+
+    def _record_fetch(self):
+        now = self._start()
+        with self._lock:
+            self.num_fetched += 1
+            self.fetch_times.append(now)
+
+    def get_entity_by_entity_id(self, entity_id, flags=0):
+        self._record_fetch()
+        _sleep_ms(self.latency_ms)
+        return self.entity_doc(entity_id)
+
+    def export_json_entity_report(self, flags=0):
+        handle = next(self._handles)
+        self._exports[handle] = iter(range(1, self.num_entities + 1))
+        return handle
+
+    def fetch_next(self, handle):
+        entity_id = next(self._exports[handle], None)
+        if entity_id is None: return ''
+        self._record_fetch()
+        # Exports are streamed by Senzing, so fetch_next is much cheaper than
+        # a get_entity_by_entity_id round trip.
+        _sleep_ms(self.latency_ms / 10)
+        return self.entity_doc(entity_id) + '\n'
+
+    def close_export_report(self, handle):
+        self._exports.pop(handle, None)
+
+class FakeSzConfig:
+    def __init__(self, data_sources):
+        self.data_sources = set(data_sources)
+
+    def get_data_source_registry(self):
+        return json.dumps({'DATA_SOURCES': [
+            {'DSRC_ID': n, 'DSRC_CODE': ds} for n, ds in enumerate(sorted(self.data_sources), 1)]})
+
+    def register_data_source(self, data_source_code):
+        # Like Senzing, keep codes in upper case.
+        self.data_sources.add(data_source_code.upper())
+
+    def export(self):
+        return json.dumps(sorted(self.data_sources))
+
+class FakeSzConfigManager:
+    def __init__(self, factory):
+        self.factory = factory
+
+    def get_default_config_id(self):
+        return self.factory.config_id
+
+    def create_config_from_config_id(self, config_id):
+        return FakeSzConfig(self.factory.configs[config_id])
+
+    def set_default_config(self, config_definition, config_comment):
+        with self.factory.lock:
+            self.factory.config_id += 1
+            self.factory.configs[self.factory.config_id] = set(json.loads(config_definition))
+            return self.factory.config_id
+
+class FakeSzFactory:
+    '''Stands in for senzing_core.SzAbstractFactoryCore; all factories share
+    one engine (as they share one Senzing process in real life).'''
+    engine = None
+    lock = threading.Lock()
+    config_id = 1
+    configs = {1: {'TEST', 'SEARCH', 'BENCH'}}
+
+    def __init__(self, instance_name=None, settings=None, *args, **kwargs):
+        pass
+
+    def create_engine(self):
+        return FakeSzFactory.engine
+
+    def create_configmanager(self):
+        return FakeSzConfigManager(FakeSzFactory)
+
+    def reinitialize(self, config_id):
+        pass
+
+def install_fake_senzing_core(engine):
+    '''Makes `import senzing_core` return a stand-in whose factory hands out
+    engine. (The real `senzing` package -- the SDK's abstract classes,
+    exceptions and flags -- is still required.)'''
+    FakeSzFactory.engine = engine
+    mod = types.ModuleType('senzing_core')
+    mod.SzAbstractFactoryCore = FakeSzFactory
+    sys.modules['senzing_core'] = mod
+
+#-------------------------------------------------------------------------------
+# SQS
+
+class FakeSQS:
+    '''Stands in for an SQS client on a single queue preloaded with bodies.
+    Honors visibility timeouts. receive_message raises BenchDone once every
+    message has been deleted.'''
+
+    def __init__(self, bodies, latency_ms=5.0):
+        self.latency_ms = latency_ms
+        self._lock = threading.Lock()
+        self._visible = collections.deque((str(n), body) for n, body in enumerate(bodies))
+        self._in_flight = {}   # receipt handle -> (msg id, body, visible again at)
+        self._handles = itertools.count()
+        self.num_msgs = len(self._visible)
+        self.received_at = {}  # msg id -> time first received
+        self.latencies = []
+        self.first_receive = None
+        self.last_delete = None
+        self.num_calls = collections.Counter()
+
+    def _requeue_expired(self, now):
+        for rh, (msg_id, body, until) in list(self._in_flight.items()):
+            if until <= now:
+                del self._in_flight[rh]
+                self._visible.append((msg_id, body))
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=0,
+                        VisibilityTimeout=30, **kwargs):
+        _sleep_ms(self.latency_ms)
+        now = time.perf_counter()
+        with self._lock:
+            self.num_calls['receive_message'] += 1
+            self._requeue_expired(time.monotonic())
+            if not self._visible and not self._in_flight: raise BenchDone()
+            if self.first_receive is None: self.first_receive = now
+            msgs = []
+            while self._visible and len(msgs) < MaxNumberOfMessages:
+                msg_id, body = self._visible.popleft()
+                rh = f'{msg_id}-{next(self._handles)}'
+                self._in_flight[rh] = (msg_id, body, time.monotonic() + VisibilityTimeout)
+                self.received_at.setdefault(msg_id, now)
+                msgs.append({'MessageId': msg_id, 'ReceiptHandle': rh, 'Body': body})
+        if not msgs:
+            # Stand-in for a long poll that comes back empty.
+            time.sleep(0.01)
+            return {}
+        return {'Messages': msgs}
+
+    def _delete(self, rh, now):
+        msg_id = self._in_flight.pop(rh)[0]
+        self.latencies.append(now - self.received_at[msg_id])
+        self.last_delete = now
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        _sleep_ms(self.latency_ms)
+        now = time.perf_counter()
+        with self._lock:
+            self.num_calls['delete_message'] += 1
+            self._delete(ReceiptHandle, now)
+        return {}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        _sleep_ms(self.latency_ms)
+        now = time.perf_counter()
+        with self._lock:
+            self.num_calls['delete_message_batch'] += 1
+            for entry in Entries: self._delete(entry['ReceiptHandle'], now)
+        return {'Successful': [{'Id': e['Id']} for e in Entries], 'Failed': []}
+
+    def _change_visibility(self, rh, timeout):
+        if rh not in self._in_flight: return
+        msg_id, body, _ = self._in_flight[rh]
+        if timeout == 0:
+            del self._in_flight[rh]
+            self._visible.append((msg_id, body))
+        else:
+            self._in_flight[rh] = (msg_id, body, time.monotonic() + timeout)
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+        _sleep_ms(self.latency_ms)
+        with self._lock:
+            self.num_calls['change_message_visibility'] += 1
+            self._change_visibility(ReceiptHandle, VisibilityTimeout)
+        return {}
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        _sleep_ms(self.latency_ms)
+        with self._lock:
+            self.num_calls['change_message_visibility_batch'] += 1
+            for e in Entries: self._change_visibility(e['ReceiptHandle'], e['VisibilityTimeout'])
+        return {'Successful': [{'Id': e['Id']} for e in Entries], 'Failed': []}
+
+#-------------------------------------------------------------------------------
+# S3
+
+class FakeS3:
+    '''Stands in for an S3 client; multipart uploads are consumed (and
+    measured) but not kept.'''
+
+    def __init__(self, latency_ms=20.0, mb_per_sec=100.0):
+        self.latency_ms = latency_ms
+        self.mb_per_sec = mb_per_sec
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.uploads = {}      # upload ID -> {'Key', 'Parts': {part number: size}}
+        self.completed = []    # keys
+        self.aborted = []      # keys
+        self.objects = {}      # key -> body, for put_object
+        self.part_latencies = []
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        with self._lock:
+            upload_id = str(next(self._ids))
+            self.uploads[upload_id] = {'Key': Key, 'Parts': {}}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        start = time.perf_counter()
+        size = len(Body.read())
+        _sleep_ms(self.latency_ms + size / (self.mb_per_sec * 1024 ** 2) * 1000)
+        with self._lock:
+            self.uploads[UploadId]['Parts'][PartNumber] = size
+            self.part_latencies.append(time.perf_counter() - start)
+        return {'ETag': f'"{UploadId}-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, MultipartUpload, UploadId):
+        with self._lock:
+            parts = [p['PartNumber'] for p in MultipartUpload['Parts']]
+            if parts != sorted(self.uploads[UploadId]['Parts']):
+                raise ValueError(f'Part list mismatch for {Key}')
+            self.completed.append(Key)
+        return {'Key': Key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        with self._lock:
+            self.aborted.append(Key)
+            self.uploads.pop(UploadId, None)
+        return {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        _sleep_ms(self.latency_ms)
+        with self._lock:
+            self.objects[Key] = Body
+        return {}
+
+    def list_parts(self, Bucket, Key, UploadId, MaxParts=1000):
+        with self._lock:
+            if UploadId not in self.uploads: raise KeyError(f'NoSuchUpload: {UploadId}')
+            parts = sorted(self.uploads[UploadId]['Parts'].items())[:MaxParts]
+        return {'Parts': [{'PartNumber': n, 'Size': size} for n, size in parts]}
+
+    def bytes_uploaded(self):
+        with self._lock:
+            return sum(sum(u['Parts'].values()) for u in self.uploads.values())
+
+#-------------------------------------------------------------------------------
+# Export tracker database
+
+class FakeDb(types.ModuleType):
+    '''In-memory stand-in for the db module (the export tracker API), for
+    running without Postgres. Each call sleeps for about latency_ms, a
+    database round trip. (Write-behind buffering of entity IDs is not
+    supported here; use a real Postgres for that.)'''
+
+    EXPORT_STATUS_TODO = 1
+    EXPORT_STATUS_IN_PROGRESS = 2
+    EXPORT_STATUS_DONE = 3
+    EXPORT_STATUS_SKIPPED = 4
+    TRACKER_BUFFER_MAX_IDS = 0
+    TRACKER_BUFFER_MAX_AGE_SECONDS = 5
+    DATA_SOURCE_LOCK_KEY = 0
+    EntityIdBuffer = None
+
+    def __init__(self, latency_ms=1.0):
+        super().__init__('db')
+        self.latency_ms = latency_ms
+        self._lock = threading.RLock()
+        self.status = {}   # entity ID -> export status
+        self.owner = {}    # entity ID -> claim owner
+        self.touched = {}  # entity ID -> time (monotonic) it last became TODO
+        self.checkpoints = {}  # checkpoint ID -> export checkpoint
+        self.shards = {}       # (run ID, shard index) -> finished shard
+        self.content_hashes = {}  # entity ID -> content hash as last exported
+        self.fetched_hashes = {}  # entity ID -> content hash of the claimed export
+        self.num_calls = collections.Counter()
+
+    def _call(self, name):
+        _sleep_ms(self.latency_ms)
+        self.num_calls[name] += 1
+
+    def add_entity_ids(self, entity_ids, source=None):
+        with self._lock:
+            self._call('add_entity_ids')
+            for x in entity_ids:
+                if self.status.get(x) != self.EXPORT_STATUS_TODO:
+                    self.touched[x] = time.monotonic()
+                self.status[x] = self.EXPORT_STATUS_TODO
+                self.owner.pop(x, None)
+
+    def add_entity_id(self, entity_id):
+        self.add_entity_ids([entity_id])
+
+    def claim_chunk(self, owner, chunk_size, lease_seconds, after_entity_id=0):
+        with self._lock:
+            self._call('claim_chunk')
+            ids = sorted(x for x, s in self.status.items()
+                         if s == self.EXPORT_STATUS_TODO and x > after_entity_id)[:chunk_size]
+            for x in ids:
+                self.status[x] = self.EXPORT_STATUS_IN_PROGRESS
+                self.owner[x] = owner
+                self.fetched_hashes.pop(x, None)
+            return ids
+
+    def renew_claims(self, owner, lease_seconds):
+        with self._lock:
+            self._call('renew_claims')
+
+    def shift_claimed_to_done(self, owner, export_id=None):
+        with self._lock:
+            self._call('shift_claimed_to_done')
+            for x, o in list(self.owner.items()):
+                if o == owner:
+                    self.status[x] = self.EXPORT_STATUS_DONE
+                    del self.owner[x]
+                    if x in self.fetched_hashes:
+                        self.content_hashes[x] = self.fetched_hashes.pop(x)
+
+    def release_claimed(self, owner):
+        with self._lock:
+            self._call('release_claimed')
+            for x, o in list(self.owner.items()):
+                if o == owner:
+                    self.status[x] = self.EXPORT_STATUS_TODO
+                    del self.owner[x]
+                    self.fetched_hashes.pop(x, None)
+
+    def get_content_hashes(self, entity_ids):
+        with self._lock:
+            self._call('get_content_hashes')
+            return {x: self.content_hashes[x] for x in entity_ids if x in self.content_hashes}
+
+    def set_fetched_hashes(self, owner, hashes):
+        with self._lock:
+            self._call('set_fetched_hashes')
+            for x, h in hashes:
+                if self.owner.get(x) == owner: self.fetched_hashes[x] = h
+
+    def get_tallies(self):
+        with self._lock:
+            self._call('get_tallies')
+            c = collections.Counter(self.status.values())
+            return {'TODO': c[1], 'IN PROGRESS': c[2], 'DONE': c[3], 'SKIPPED': c[4]}
+
+    def get_todo_stats(self):
+        with self._lock:
+            self._call('get_todo_stats')
+            todo = [x for x, s in self.status.items() if s == self.EXPORT_STATUS_TODO]
+            if not todo: return 0, None
+            return len(todo), time.monotonic() - min(self.touched[x] for x in todo)
+
+    def get_export_checkpoint(self, checkpoint_id):
+        with self._lock:
+            self._call('get_export_checkpoint')
+            cp = self.checkpoints.get(checkpoint_id)
+            return dict(cp, parts=list(cp['parts'])) if cp else None
+
+    def save_export_checkpoint(self, checkpoint_id, object_key, upload_id, compression,
+                               parts, entities_written, last_entity_id=None):
+        with self._lock:
+            self._call('save_export_checkpoint')
+            self.checkpoints[checkpoint_id] = {
+                'checkpoint_id': checkpoint_id, 'object_key': object_key,
+                'upload_id': upload_id, 'compression': compression, 'parts': list(parts),
+                'entities_written': entities_written, 'last_entity_id': last_entity_id}
+
+    def delete_export_checkpoint(self, checkpoint_id):
+        with self._lock:
+            self._call('delete_export_checkpoint')
+            self.checkpoints.pop(checkpoint_id, None)
+
+    def get_shard_entity_ids(self, shard_index, shard_count, after_entity_id, limit):
+        with self._lock:
+            self._call('get_shard_entity_ids')
+            return sorted(x for x in self.status
+                          if x > after_entity_id and x % shard_count == shard_index)[:limit]
+
+    def count_shard_entity_ids(self, shard_index, shard_count):
+        with self._lock:
+            self._call('count_shard_entity_ids')
+            return sum(1 for x in self.status if x % shard_count == shard_index)
+
+    def record_export_shard(self, run_id, shard_index, shard_count, object_keys, entities_written,
+                            entities_expected):
+        with self._lock:
+            self._call('record_export_shard')
+            self.shards[(run_id, shard_index)] = {
+                'shard_index': shard_index, 'shard_count': shard_count,
+                'object_keys': list(object_keys), 'entities_written': entities_written,
+                'entities_expected': entities_expected}
+            return [v for k, v in sorted(self.shards.items()) if k[0] == run_id]
+
+    @contextlib.contextmanager
+    def advisory_lock(self, key, poll_seconds=0.1):
+        with self._lock:
+            self._call('advisory_lock')
+            yield
@@ -25,7 +25,7 @@ try:
 
   # Save affected entity IDs into export tracker table
   affected = util.parse_affected_entities_resp(resp)
-  for entity_id in affected: db.add_entity_id(entity_id)
+  db.add_entity_ids(affected, source='add_1_record')
 
   # Get the entity it resolved to
   response = sz_engine.get_entity_by_record_id("TEST", "1")
@@ -39,12 +39,18 @@ except Exception as e:
 
 rslt = None
 try:
-    curs.execute('select * from export_tracker')    
+    curs.execute('select * from pending_entity')
     rslt = curs.fetchall()
     if rslt == [] or len(rslt):
-        print('o export_tracker table exists OK')
+        print('o pending_entity table exists OK')
     else:
-        print('o ERROR: export_tracker table does not exist')
+        print('o ERROR: pending_entity table does not exist')
+except Exception as e:
+    print(str(e))
+
+try:
+    curs.execute('select max(version) from schema_migrations')
+    print(f'o schema version: {curs.fetchone()[0]}')
 except Exception as e:
     print(str(e))
 
@@ -54,8 +60,8 @@ if len(sys.argv) > 1 and sys.argv[1] == 'dump':
     print(rslt)
     print(f'Total: {len(rslt)}')
     export_status = sys.argv[2] if len(sys.argv) > 2 else 1 # 1 == EXPORT_STATUS_TODO
-    curs.execute('select distinct(entity_id) from export_tracker where export_status = %s',
-        export_status)
+    curs.execute('select entity_id from pending_entity where export_status = %s',
+        [export_status])
     out = list(map(lambda x: x[0], curs.fetchall()))
     print(type(out))
     print(out)
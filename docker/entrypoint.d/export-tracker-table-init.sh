@@ -6,3 +6,19 @@ else
     echo "Initializing export tracker table."
     psql -d G2 -f /create-export-tracker-table.sql
 fi
+
+# Apply any export tracker schema migrations that haven't been applied yet.
+# Each migration file records its own version in schema_migrations, and runs
+# in a single transaction.
+for f in /export-tracker-migration-*.sql; do
+    [ -e "$f" ] || continue
+    version=$(basename "$f" .sql | sed 's/.*-0*//')
+    applied=$(psql -d sqs_entity_resolution -tAc \
+        "select 1 from schema_migrations where version = $version" 2>/dev/null)
+    if [ "$applied" = "1" ]; then
+        echo "Export tracker migration $version has already been applied."
+    else
+        echo "Applying export tracker migration $version."
+        psql -d sqs_entity_resolution -v ON_ERROR_STOP=1 -1 -f "$f" || exit 1
+    fi
+done
@@ -0,0 +1,16 @@
+-- Migration 001: schema version bookkeeping, plus partial indexes on
+-- export_tracker so status changes no longer scan every DONE row.
+
+CREATE TABLE IF NOT EXISTS public.schema_migrations
+(
+    version integer PRIMARY KEY,
+    applied_at timestamp without time zone NOT NULL default current_timestamp
+);
+
+CREATE INDEX IF NOT EXISTS export_tracker_todo_idx
+    ON public.export_tracker (entity_id) WHERE export_status = 1;
+
+CREATE INDEX IF NOT EXISTS export_tracker_in_progress_idx
+    ON public.export_tracker (entity_id) WHERE export_status = 2;
+
+INSERT INTO public.schema_migrations (version) VALUES (1);
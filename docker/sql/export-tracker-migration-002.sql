@@ -0,0 +1,30 @@
+-- Migration 002: pending_entity, one row per entity ID.
+-- Consumer/Redoer upsert into this table (a re-touched entity just goes back
+-- to TODO), so it grows with the number of entities rather than the number of
+-- times they are touched. Partial indexes keep TODO / IN PROGRESS lookups
+-- independent of the number of DONE rows.
+
+CREATE TABLE IF NOT EXISTS public.pending_entity
+(
+    entity_id bigint PRIMARY KEY,
+    export_status smallint NOT NULL DEFAULT 1,
+    ts timestamp without time zone NOT NULL default current_timestamp,
+    export_id character varying
+);
+
+CREATE INDEX IF NOT EXISTS pending_entity_todo_idx
+    ON public.pending_entity (entity_id) WHERE export_status = 1;
+
+CREATE INDEX IF NOT EXISTS pending_entity_in_progress_idx
+    ON public.pending_entity (entity_id) WHERE export_status = 2;
+
+-- Carry over every entity ID in export_tracker: work not yet exported stays
+-- TODO / IN PROGRESS, and entities that were only ever exported stay DONE (a
+-- sharded full export lists its entity IDs from this table).
+INSERT INTO public.pending_entity (entity_id, export_status, ts)
+    SELECT entity_id, min(export_status), max(ts)
+    FROM public.export_tracker
+    GROUP BY entity_id
+ON CONFLICT (entity_id) DO NOTHING;
+
+INSERT INTO public.schema_migrations (version) VALUES (2);
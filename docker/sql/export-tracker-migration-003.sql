@@ -0,0 +1,11 @@
+-- Migration 003: leases on pending_entity, so delta export work can be
+-- claimed in chunks by several exporters at once, and work claimed by an
+-- exporter that died is picked up again once its lease expires.
+
+ALTER TABLE public.pending_entity ADD COLUMN IF NOT EXISTS claim_owner character varying;
+ALTER TABLE public.pending_entity ADD COLUMN IF NOT EXISTS lease_expires timestamp without time zone;
+
+CREATE INDEX IF NOT EXISTS pending_entity_claim_owner_idx
+    ON public.pending_entity (claim_owner) WHERE export_status = 2;
+
+INSERT INTO public.schema_migrations (version) VALUES (3);
@@ -0,0 +1,18 @@
+-- Migration 004: export_checkpoint, the progress of a full export that's still
+-- under way (one row per checkpoint ID), so that a restarted Exporter can
+-- continue the same S3 multipart upload rather than starting over. A row is
+-- deleted once its export has completed.
+
+CREATE TABLE IF NOT EXISTS public.export_checkpoint
+(
+    checkpoint_id character varying PRIMARY KEY,
+    object_key character varying NOT NULL,
+    upload_id character varying NOT NULL,
+    compression character varying NOT NULL,
+    parts jsonb NOT NULL DEFAULT '[]',
+    entities_written bigint NOT NULL DEFAULT 0,
+    last_entity_id bigint,
+    ts timestamp without time zone NOT NULL default current_timestamp
+);
+
+INSERT INTO public.schema_migrations (version) VALUES (4);
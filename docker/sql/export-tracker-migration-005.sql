@@ -0,0 +1,18 @@
+-- Migration 005: export_shard, one row per finished shard of a sharded full
+-- export, so that whichever shard finishes last can write the run's manifest.
+-- entities_expected is how many entity IDs the shard had in pending_entity
+-- when it started.
+
+CREATE TABLE IF NOT EXISTS public.export_shard
+(
+    run_id character varying NOT NULL,
+    shard_index integer NOT NULL,
+    shard_count integer NOT NULL,
+    object_keys jsonb NOT NULL DEFAULT '[]',
+    entities_written bigint NOT NULL DEFAULT 0,
+    entities_expected bigint NOT NULL DEFAULT 0,
+    ts timestamp without time zone NOT NULL default current_timestamp,
+    PRIMARY KEY (run_id, shard_index)
+);
+
+INSERT INTO public.schema_migrations (version) VALUES (5);
@@ -0,0 +1,10 @@
+-- Migration 006: content hashes on pending_entity, so delta exports can leave
+-- out entities whose document hasn't changed since it was last exported.
+-- content_hash is the hash of the document as last exported; fetched_hash
+-- that of the document being exported by the run holding the claim, which
+-- becomes content_hash once that run's claims are shifted to DONE.
+
+ALTER TABLE public.pending_entity ADD COLUMN IF NOT EXISTS content_hash bytea;
+ALTER TABLE public.pending_entity ADD COLUMN IF NOT EXISTS fetched_hash bytea;
+
+INSERT INTO public.schema_migrations (version) VALUES (6);
@@ -1,6 +1,9 @@
+import collections
 import json
 import os
+import queue
 import signal
+import threading
 import time
 import sys
 import boto3
@@ -14,6 +17,7 @@ from timeout_handling import *
 import otel
 import util
 import db
+import jsonlib
 
 try:
     log.info('Importing senzing_core library . . .')
@@ -29,6 +33,23 @@ SZ_CONFIG = json.loads(os.environ['SENZING_ENGINE_CONFIGURATION_JSON'])
 RUNTIME_ENV = os.environ.get('RUNTIME_ENV', 'unknown') # For OTel
 
 POLL_SECONDS = 20                   # 20 seconds is SQS max
+SQS_MAX_BATCH = 10                  # 10 messages is SQS max per batch call
+SQS_MAX_VISIBILITY_SECONDS = 43200  # 12 hours is SQS max
+
+# How many messages to request per receive_message call. Messages beyond the
+# one currently being processed wait in a local prefetch buffer; deletes are
+# then acknowledged in batches via delete_message_batch.
+SQS_BATCH_SIZE = min(max(int(os.environ.get('SQS_BATCH_SIZE', 1)), 1), SQS_MAX_BATCH)
+
+# Number of worker threads calling add_record concurrently on a shared
+# Senzing engine. 1 means the original single-threaded loop.
+CONSUMER_WORKERS = max(int(os.environ.get('CONSUMER_WORKERS', 1)), 1)
+
+# When non-zero, msgs are received with this (short) visibility timeout and a
+# background heartbeat keeps extending it for as long as each msg is held
+# (buffered or being processed). 0 means msgs get a fixed visibility timeout
+# based on SZ_CALL_TIMEOUT_SECONDS instead.
+VISIBILITY_HEARTBEAT_SECONDS = int(os.environ.get('VISIBILITY_HEARTBEAT_SECONDS', 0))
 
 #-------------------------------------------------------------------------------
 
@@ -63,37 +84,113 @@ def init():
     except Exception as e:
         log.error(AWS_TAG + fmterr(e))
 
-def get_msgs(sqs, q_url):
+# SQS messages that have been received but not yet emitted by get_msgs.
+_prefetched = collections.deque()
+
+# Receipt handles of msgs currently held by this process (visibility heartbeat
+# mode only).
+_held = set()
+_held_lock = threading.Lock()
+
+def _track(receipt_handles):
+    if VISIBILITY_HEARTBEAT_SECONDS:
+        with _held_lock: _held.update(receipt_handles)
+
+def _untrack(receipt_handles):
+    if VISIBILITY_HEARTBEAT_SECONDS:
+        with _held_lock: _held.difference_update(receipt_handles)
+
+def get_msgs(sqs, q_url, stages, before_receive=None):
     '''Generator function; emits a single SQS msg at a time.
+    Up to SQS_BATCH_SIZE msgs are retrieved per receive_message call; those not
+    yet emitted are held in the _prefetched buffer. Time spent waiting on
+    receive_message is recorded in stages (an otel.StageTimings).
+    before_receive, if given, is called before every receive_message call
+    (e.g., to delete msgs that have already been processed).
     Pertinent keys in an SQS message include:
     - MessageId
     - ReceiptHandle -- you'll need this to delete the msg later
     - Body -- here, should be the JSONL record as a string
     '''
+    # Buffered msgs wait behind the ones received along with them, so without
+    # a heartbeat the (in)visibility window has to cover the whole batch.
+    if VISIBILITY_HEARTBEAT_SECONDS:
+        visibility_timeout = VISIBILITY_HEARTBEAT_SECONDS
+    else:
+        visibility_timeout = min(SZ_CALL_TIMEOUT_SECONDS * SQS_BATCH_SIZE,
+                                 SQS_MAX_VISIBILITY_SECONDS)
     while 1:
+        if _prefetched:
+            yield _prefetched.popleft()
+            continue
+        if before_receive:
+            try:
+                before_receive()
+            except Exception as e:
+                log.error(fmterr(e))
         try:
-            log.debug(AWS_TAG + 'Polling SQS for the next message')
-            resp = sqs.receive_message(QueueUrl=q_url, MaxNumberOfMessages=1,
-                                       WaitTimeSeconds=POLL_SECONDS,
-                                       VisibilityTimeout=SZ_CALL_TIMEOUT_SECONDS)
-            if 'Messages' in resp and len(resp['Messages']) == 1:
-                yield resp['Messages'][0]
+            log.debug(AWS_TAG + 'Polling SQS for the next message(s)')
+            with stages.time('sqs_receive'):
+                resp = sqs.receive_message(QueueUrl=q_url,
+                                           MaxNumberOfMessages=SQS_BATCH_SIZE,
+                                           WaitTimeSeconds=POLL_SECONDS,
+                                           VisibilityTimeout=visibility_timeout)
+            if 'Messages' in resp:
+                _track([m['ReceiptHandle'] for m in resp['Messages']])
+                _prefetched.extend(resp['Messages'])
+                log.debug(AWS_TAG + 'Received %d message(s)', len(resp['Messages']))
         except Exception as e:
             log.error(f'{AWS_TAG} {type(e).__module__}.{type(e).__qualname__} :: {fmterr(e)}')
-   
+
 def del_msg(sqs, q_url, receipt_handle):
+    _untrack([receipt_handle])
     try:
-        log.debug(AWS_TAG + 'Deleting message having ReceiptHandle: ' + receipt_handle)
+        log.debug(AWS_TAG + 'Deleting message having ReceiptHandle: %s', receipt_handle,
+                  extra={'receipt_handle': receipt_handle})
         return sqs.delete_message(QueueUrl=q_url, ReceiptHandle=receipt_handle)
     except Exception as e:
         log.error(AWS_TAG + DLQ_TAG + 'SQS delete failure for ReceiptHandle: ' +
-                  ReceiptHandle + ' Additional info: ' + fmterr(e))
+                  receipt_handle + ' Additional info: ' + fmterr(e))
+
+def del_msgs(sqs, q_url, receipt_handles):
+    '''Deletes msgs using as few delete_message_batch calls as possible.
+    Entries that fail on the AWS side (SenderFault is false) are retried once
+    individually via del_msg; entries that fail because of the request itself
+    (e.g., an expired receipt handle) are not retried.
+    Returns a list of the receipt handles that could not be deleted.'''
+    _untrack(receipt_handles)
+    failed = []
+    for i in range(0, len(receipt_handles), SQS_MAX_BATCH):
+        chunk = receipt_handles[i:i + SQS_MAX_BATCH]
+        if len(chunk) == 1:
+            if del_msg(sqs, q_url, chunk[0]) is None: failed.append(chunk[0])
+            continue
+        try:
+            log.debug(AWS_TAG + 'Deleting batch of %d messages', len(chunk))
+            resp = sqs.delete_message_batch(
+                QueueUrl=q_url,
+                Entries=[{'Id': str(n), 'ReceiptHandle': rh} for n, rh in enumerate(chunk)])
+        except Exception as e:
+            log.error(AWS_TAG + 'SQS delete_message_batch failure; falling back to '
+                      + 'single deletes. Additional info: ' + fmterr(e))
+            failed.extend([rh for rh in chunk if del_msg(sqs, q_url, rh) is None])
+            continue
+        for entry in resp.get('Failed', []):
+            rh = chunk[int(entry['Id'])]
+            if not entry.get('SenderFault') and del_msg(sqs, q_url, rh) is not None:
+                continue
+            log.error(AWS_TAG + DLQ_TAG + 'SQS batch delete failure for ReceiptHandle: '
+                      + rh + f' Code: {entry.get("Code")} Message: {entry.get("Message")}')
+            failed.append(rh)
+    return failed
 
 def make_msg_visible(sqs, q_url, receipt_handle):
     '''Setting visibility timeout to 0 on an SQS message makes it visible again,
     making it available (again) for consuming.'''
+    _untrack([receipt_handle])
     try:
-        log.debug(AWS_TAG + 'Restoring message visibility for ReceiptHandle: ' + receipt_handle)
+        log.debug(AWS_TAG + 'Restoring message visibility for ReceiptHandle: %s', receipt_handle,
+                  extra={'receipt_handle': receipt_handle})
         sqs.change_message_visibility(
             QueueUrl=q_url,
             ReceiptHandle=receipt_handle,
@@ -101,29 +198,119 @@ def make_msg_visible(sqs, q_url, receipt_handle):
     except Exception as e:
         log.error(AWS_TAG + fmterr(e))
 
+def change_msgs_visibility(sqs, q_url, receipt_handles, visibility_timeout):
+    '''Sets the visibility timeout of several msgs, using as few
+    change_message_visibility_batch calls as possible.'''
+    for i in range(0, len(receipt_handles), SQS_MAX_BATCH):
+        chunk = receipt_handles[i:i + SQS_MAX_BATCH]
+        try:
+            log.debug(AWS_TAG + 'Setting visibility timeout to %d sec. for batch of %d messages',
+                      visibility_timeout, len(chunk))
+            resp = sqs.change_message_visibility_batch(
+                QueueUrl=q_url,
+                Entries=[{'Id': str(n), 'ReceiptHandle': rh, 'VisibilityTimeout': visibility_timeout}
+                         for n, rh in enumerate(chunk)])
+            for entry in resp.get('Failed', []):
+                log.error(AWS_TAG + 'Failed to change visibility for ReceiptHandle: '
+                          + chunk[int(entry['Id'])] + f' Code: {entry.get("Code")}')
+        except Exception as e:
+            log.error(AWS_TAG + fmterr(e))
+
+def make_msgs_visible(sqs, q_url, receipt_handles):
+    '''Batch version of make_msg_visible; used to hand buffered msgs back to
+    the queue right away rather than waiting out their visibility timeout.'''
+    _untrack(receipt_handles)
+    change_msgs_visibility(sqs, q_url, receipt_handles, 0)
+
+def visibility_heartbeat(sqs, q_url):
+    '''Runs in a background thread (VISIBILITY_HEARTBEAT_SECONDS mode).
+    Periodically pushes the visibility timeout of every held msg out by another
+    VISIBILITY_HEARTBEAT_SECONDS, well before it would otherwise lapse. If this
+    process dies, its msgs reappear in the queue within one window.'''
+    while 1:
+        time.sleep(VISIBILITY_HEARTBEAT_SECONDS / 3)
+        with _held_lock:
+            receipt_handles = list(_held)
+        if len(receipt_handles) == 1:
+            try:
+                sqs.change_message_visibility(
+                    QueueUrl=q_url,
+                    ReceiptHandle=receipt_handles[0],
+                    VisibilityTimeout=VISIBILITY_HEARTBEAT_SECONDS)
+            except Exception as e:
+                log.error(AWS_TAG + fmterr(e))
+        elif receipt_handles:
+            change_msgs_visibility(sqs, q_url, receipt_handles, VISIBILITY_HEARTBEAT_SECONDS)
+
 #-------------------------------------------------------------------------------
 
-def register_data_source(data_source_name):
-    '''References:
+# Data sources registered in the Senzing config, as far as this process knows:
+# loaded at startup, and added to whenever this process registers (or finds)
+# a new one. Senzing keeps data source codes in upper case, so they're kept
+# (and looked up) in upper case here too.
+_known_data_sources = set()
+_register_lock = threading.Lock()
+
+def get_registered_data_sources(sz_config):
+    '''Returns the set of data source codes (upper case) registered in sz_config.'''
+    registry = json.loads(sz_config.get_data_source_registry())
+    return {ds['DSRC_CODE'].upper() for ds in registry.get('DATA_SOURCES', [])}
+
+def load_data_sources(sz_factory):
+    '''Loads the data sources registered in the current default config.'''
+    try:
+        sz_config_mgr = sz_factory.create_configmanager()
+        sz_config = sz_config_mgr.create_config_from_config_id(
+            sz_config_mgr.get_default_config_id())
+        names = get_registered_data_sources(sz_config)
+        with _register_lock:
+            _known_data_sources.update(names)
+        log.info(SZ_TAG + f'Loaded {len(names)} registered data sources: {sorted(names)}')
+    except sz.SzError as err:
+        log.error(SZ_TAG + fmterr(err))
+
+def register_data_source(sz_factory, data_source_name):
+    '''Makes sure data_source_name is registered in the default Senzing
+    config, and that this process' engine is using that config.
+
+    Only one thread per process does this at a time, and across processes
+    the config is only modified while holding a Postgres advisory lock; so
+    however many consumers see a new data source at once, it gets registered
+    (and the config rewritten) exactly once. Those that lose the race just
+    find it already there and reinitialize onto the new config.
+
+    References:
         - https://github.com/senzing-garage/knowledge-base/blob/main/lists/environment-variables.md#senzing_tools_datasources
         - https://github.com/senzing-garage/knowledge-base/blob/4c397efacdb0d2feecd89fa0f00ec10f99320d0c/proposals/working-with-config/mjd.md?plain=1#L98
     '''
-    def f():
-        sz_factory = sz_core.SzAbstractFactoryCore("ERS", SZ_CONFIG)
-        sz_config_mgr = sz_factory.create_configmanager()
-        default_config_id = sz_config_mgr.get_default_config_id()
-        sz_config = sz_config_mgr.create_config_from_config_id(default_config_id)
-        sz_config.register_data_source(data_source_name)
-        sz_config_mgr.set_default_config(sz_config.export(), 'default')
-        sz_factory.reinitialize(default_config_id)
     try:
-        log.info(SZ_TAG + 'Registering new data_source: ' + data_source_name)
-        # For reasons unknown to me, this has to be done 2x before it sticks.
-        f()
-        f()
-        log.info(SZ_TAG + 'Successfully registered data_source: ' + data_source_name)
+        with _register_lock:
+            # Another worker in this process may have just taken care of it.
+            if data_source_name.upper() in _known_data_sources: return
+            with db.advisory_lock(db.DATA_SOURCE_LOCK_KEY):
+                sz_config_mgr = sz_factory.create_configmanager()
+                config_id = sz_config_mgr.get_default_config_id()
+                sz_config = sz_config_mgr.create_config_from_config_id(config_id)
+                names = get_registered_data_sources(sz_config)
+                if data_source_name.upper() in names:
+                    log.info(SZ_TAG + f'Data source {data_source_name} was registered elsewhere.')
+                else:
+                    log.info(SZ_TAG + 'Registering new data_source: ' + data_source_name)
+                    sz_config.register_data_source(data_source_name)
+                    # set_default_config returns the ID of the new config;
+                    # reinitializing with the old ID (as opposed to this one)
+                    # is why registering used to need doing twice.
+                    config_id = sz_config_mgr.set_default_config(
+                        sz_config.export(), f'Registered data source {data_source_name}')
+                    names.add(data_source_name.upper())
+                    log.info(SZ_TAG + 'Successfully registered data_source: ' + data_source_name)
+                sz_factory.reinitialize(config_id)
+                log.info(SZ_TAG + f'Reinitialized with config ID {config_id}.')
+            _known_data_sources.update(names)
     except sz.SzError as err:
         log.error(SZ_TAG + fmterr(err))
+    except Exception as e:
+        log.error(fmterr(e))
 
 #-------------------------------------------------------------------------------
 
@@ -133,30 +320,88 @@ def go():
     # SQS client
     sqs = init()
 
-    # Spin up msgs generator
-    log.info('Spinning up messages generator')
-    msgs = get_msgs(sqs, Q_URL)
-
-    receipt_handle = None
+    # In worker-pool mode, msgs are handed from the receive loop (main thread)
+    # to the workers via this queue.
+    work_q = queue.Queue(maxsize=CONSUMER_WORKERS) if CONSUMER_WORKERS > 1 else None
+
+    # Receipt handles of successfully processed msgs awaiting deletion.
+    # (Re-entrant lock, since clean_up can interrupt the main thread while
+    # it holds the lock.)
+    pending_acks = []
+    acks_lock = threading.RLock()
+
+    def flush_acks():
+        with acks_lock:
+            batch = pending_acks[:]
+            pending_acks.clear()
+        if batch:
+            with stages.time('sqs_ack'):
+                del_msgs(sqs, Q_URL, batch)
+
+    def idle():
+        '''True if no received msgs are waiting to be processed.'''
+        return not _prefetched and (work_q is None or work_q.empty())
+
+    def ack(receipt_handle):
+        '''Queues msg for deletion; acknowledges once a full batch is pending,
+        or once there is nothing left locally. Whatever is still pending is
+        also flushed by get_msgs before each receive_message call, so a batch
+        whose last msg fails still gets its successes deleted.'''
+        with acks_lock:
+            pending_acks.append(receipt_handle)
+            flush = len(pending_acks) >= SQS_BATCH_SIZE or idle()
+        if flush:
+            flush_acks()
+
+    def ack_flushed(receipt_handles):
+        '''on_flushed callback of the entity ID buffer: msgs are only
+        acknowledged once their affected entity IDs have been committed.'''
+        with acks_lock:
+            pending_acks.extend(receipt_handles)
+        flush_acks()
+
+    # Optional write-behind buffer for affected entity IDs.
+    id_buffer = None
+    if db.TRACKER_BUFFER_MAX_IDS:
+        log.info(f'Buffering affected entity IDs (up to {db.TRACKER_BUFFER_MAX_IDS} IDs '
+                 + f'or {db.TRACKER_BUFFER_MAX_AGE_SECONDS} sec.).')
+        id_buffer = db.EntityIdBuffer(on_flushed=ack_flushed, source='consumer').start()
 
     def clean_up(signum, frm):
         log.info('***************************')
         log.info('SIGINT or SIGTERM received.')
         log.info('***************************')
+        if id_buffer: id_buffer.flush()
+        flush_acks()
+        unprocessed = [m['ReceiptHandle'] for m in _prefetched]
+        _prefetched.clear()
+        while work_q is not None and not work_q.empty():
+            unprocessed.append(work_q.get_nowait()['ReceiptHandle'])
+        if unprocessed:
+            log.info(AWS_TAG + f'Releasing {len(unprocessed)} unprocessed buffered message(s)')
+            make_msgs_visible(sqs, Q_URL, unprocessed)
         sys.exit(0)
     signal.signal(signal.SIGINT, clean_up)
     signal.signal(signal.SIGTERM, clean_up)
 
+    if VISIBILITY_HEARTBEAT_SECONDS:
+        log.info(f'Starting SQS visibility heartbeat ({VISIBILITY_HEARTBEAT_SECONDS} sec. window).')
+        threading.Thread(target=visibility_heartbeat, args=(sqs, Q_URL),
+                         name='visibility-heartbeat', daemon=True).start()
+
     # Senzing init tasks.
     sz_eng = None
+    sz_factory = None
     try:
         sz_factory = sz_core.SzAbstractFactoryCore("ERS", SZ_CONFIG)
 
         # Init senzing engine object.
         # Senzing engine object cannot be passed around between functions,
         # else it will be eagerly cleaned up / destroyed and no longer usable. 
+        # (The engine is thread-safe; in worker-pool mode, all workers share it.)
         sz_eng = sz_factory.create_engine()
         log.info(SZ_TAG + 'Senzing engine object instantiated.')
+        load_data_sources(sz_factory)
     except sz.SzError as sz_err:
         log.error(SZ_TAG + fmterr(sz_err))
     except Exception as e:
@@ -165,82 +410,148 @@ def go():
     # OTel setup #
     log.info('Starting OTel setup.')
     meter = otel.init('consumer')
-    otel_msgs_counter = meter.create_counter('consumer.messages.count')
-    otel_durations = meter.create_histogram('consumer.messages.duration')
+    otel_msgs_counter = otel.counter(meter, 'consumer.messages.count')
+    otel_durations = otel.histogram(meter, 'consumer.messages.duration')
+    otel_attrs = otel.status_attributes('consumer', RUNTIME_ENV)
+    init_timeout_metrics(meter, 'consumer', RUNTIME_ENV)
+    stages = otel.StageTimings(meter, 'consumer', RUNTIME_ENV)
     log.info('Finished OTel setup.')
     # end OTel setup #
 
-    while 1:
-        try:
-            # Get next message.
-            msg = next(msgs)
-            receipt_handle, body = msg['ReceiptHandle'], msg['Body']
-            log.debug('SQS message retrieved, having ReceiptHandle: '
-                     + receipt_handle)
-            rcd = json.loads(body)
-
-            start = time.perf_counter()
-            success_status = otel.UNKNOWN # if this shows up in the logs, there's a logic error
+    # Spin up msgs generator
+    log.info('Spinning up messages generator')
+    msgs = get_msgs(sqs, Q_URL, stages, before_receive=flush_acks)
 
-            try:
-                # Process and send to Senzing.
-                start_alarm_timer(SZ_CALL_TIMEOUT_SECONDS)
-                resp = sz_eng.add_record(rcd['DATA_SOURCE'], rcd['RECORD_ID'], body,
+    def add_record(data_source, record_id, body, receipt_handle):
+        # A call that's still stuck in a worker thread past its deadline
+        # stops being heartbeated, so its msg is freed up for redelivery.
+        timer = start_call_timer(SZ_CALL_TIMEOUT_SECONDS,
+                                 on_expire=lambda: _untrack([receipt_handle]))
+        try:
+            with stages.time('sz_call'):
+                return sz_eng.add_record(data_source, record_id, body,
                                          sz.SzEngineFlags.SZ_WITH_INFO)
-                cancel_alarm_timer()
-                log.debug(SZ_TAG + 'Successful add_record having ReceiptHandle: '
-                         + receipt_handle)
+        finally:
+            cancel_call_timer(timer)
+
+    def handle_msg(msg):
+        '''Processes a single SQS msg; returns True if the msg should be
+        deleted from the queue (by the caller, unless the entity ID buffer is
+        in use, in which case it's deleted once its IDs are flushed). Safe to
+        call from any worker thread (all state, including the OTel status, is
+        local to the call).'''
+        receipt_handle, body = msg['ReceiptHandle'], msg['Body']
+        log.debug('SQS message retrieved, having ReceiptHandle: %s', receipt_handle,
+                  extra={'receipt_handle': receipt_handle})
+
+        start = time.perf_counter()
+        success_status = otel.UNKNOWN # if this shows up in the logs, there's a logic error
 
-                # Save affected entity IDs to tracker table for exporting later.
+        try:
+            # Only DATA_SOURCE and RECORD_ID are needed here; the body itself is
+            # passed to Senzing as-is.
+            with stages.time('json_parse'):
+                data_source, record_id = jsonlib.get_str_fields(body, ('DATA_SOURCE', 'RECORD_ID'))
+
+            # Process and send to Senzing.
+            # A new data source is registered up front, and the record is then
+            # retried in place if Senzing still doesn't know the data source
+            # (e.g., it was just registered by another process).
+            if data_source.upper() not in _known_data_sources:
+                register_data_source(sz_factory, data_source)
+            try:
+                resp = add_record(data_source, record_id, body, receipt_handle)
+            except sz.SzUnknownDataSourceError as sz_uds_err:
+                log.warning(SZ_TAG + fmterr(sz_uds_err))
+                with _register_lock:
+                    _known_data_sources.discard(data_source.upper())
+                register_data_source(sz_factory, data_source)
+                resp = add_record(data_source, record_id, body, receipt_handle)
+            log.debug(SZ_TAG + 'Successful add_record having ReceiptHandle: %s', receipt_handle,
+                      extra={'receipt_handle': receipt_handle, 'data_source': data_source,
+                             'record_id': record_id})
+
+            # Save affected entity IDs to tracker table for exporting later.
+            with stages.time('response_parse'):
                 affected = util.parse_affected_entities_resp(resp)
-                log.debug(SZ_TAG + 'Affected entities: ' + str(affected))
-                for entity_id in affected: db.add_entity_id(entity_id)
+            log.debug(SZ_TAG + 'Affected entities: %s', affected,
+                      extra={'receipt_handle': receipt_handle, 'entity_count': len(affected)})
+            with stages.time('tracker_write'):
+                if id_buffer:
+                    id_buffer.add(affected, token=receipt_handle)
+                else:
+                    db.add_entity_ids(affected, source='consumer')
+
+            success_status = otel.SUCCESS
+
+        except KeyError as ke:
+            log.error(fmterr(ke))
+            make_msg_visible(sqs, Q_URL, receipt_handle)
+            success_status = otel.FAILURE
+        except sz.SzUnknownDataSourceError as sz_uds_err:
+            log.error(SZ_TAG + fmterr(sz_uds_err))
+            # Registering the data source didn't take; toss back message for now.
+            make_msg_visible(sqs, Q_URL, receipt_handle)
+            success_status = otel.FAILURE
+        except LongRunningCallTimeoutEx as lrex:
+            log.error(build_sz_timeout_msg(
+                type(lrex).__module__,
+                type(lrex).__qualname__,
+                SZ_CALL_TIMEOUT_SECONDS,
+                receipt_handle))
+            success_status = otel.FAILURE
+        except sz.SzError as sz_err:
+            log.error(SZ_TAG + DLQ_TAG + fmterr(sz_err))
+            # "Toss back" this message to be re-consumed; we rely on AWS
+            # config to move out-of-order messages into the DLQ at some point.
+            make_msg_visible(sqs, Q_URL, receipt_handle)
+            success_status = otel.FAILURE
+        except Exception as e:
+            log.error(fmterr(e))
+            success_status = otel.FAILURE
 
-                success_status = otel.SUCCESS
+        finally:
+            if success_status != otel.SUCCESS:
+                _untrack([receipt_handle])
+            finish = time.perf_counter()
+            otel_msgs_counter.add(1, otel_attrs[success_status])
+            otel_durations.record(finish - start, otel_attrs[success_status])
 
-            except KeyError as ke:
-                log.error(fmterr(ke))
-                make_msg_visible(sqs, Q_URL, receipt_handle)
-                success_status = otel.FAILURE
-            except sz.SzUnknownDataSourceError as sz_uds_err:
-                log.error(SZ_TAG + fmterr(sz_uds_err))
-                # Encountered a new data source name; register it.
-                register_data_source(rcd['DATA_SOURCE'])
-                # Toss back message for now.
-                make_msg_visible(sqs, Q_URL, receipt_handle)
-                success_status = otel.FAILURE
-            except LongRunningCallTimeoutEx as lrex:
-                log.error(build_sz_timeout_msg(
-                    type(lrex).__module__,
-                    type(lrex).__qualname__,
-                    SZ_CALL_TIMEOUT_SECONDS,
-                    receipt_handle))
-                success_status = otel.FAILURE
-            except sz.SzError as sz_err:
-                log.error(SZ_TAG + DLQ_TAG + fmterr(sz_err))
-                # "Toss back" this message to be re-consumed; we rely on AWS
-                # config to move out-of-order messages into the DLQ at some point.
-                make_msg_visible(sqs, Q_URL, receipt_handle)
-                success_status = otel.FAILURE
+        return success_status == otel.SUCCESS
+
+    if work_q is None:
+        while 1:
+            try:
+                # Get next message.
+                msg = next(msgs)
+                # Lastly, delete msg if no errors.
+                if handle_msg(msg) and not id_buffer: ack(msg['ReceiptHandle'])
             except Exception as e:
                 log.error(fmterr(e))
-                success_status = otel.FAILURE
-
-            # Lastly, delete msg if no errors.
-            else:
-                del_msg(sqs, Q_URL, receipt_handle)
 
+    def worker():
+        while 1:
+            msg = work_q.get()
+            try:
+                if handle_msg(msg):
+                    if not id_buffer: ack(msg['ReceiptHandle'])
+                # A failed msg may have been the last one queued, in which case
+                # nothing else would flush the acks of the ones before it.
+                elif idle():
+                    flush_acks()
+            except Exception as e:
+                log.error(fmterr(e))
             finally:
-                finish = time.perf_counter()
-                otel_msgs_counter.add(1,
-                    {'status': success_status,
-                    'service': 'consumer',
-                    'environment': RUNTIME_ENV})
-                otel_durations.record(finish - start,
-                    {'status':  success_status,
-                     'service': 'consumer',
-                     'environment': RUNTIME_ENV})
+                work_q.task_done()
 
+    log.info(f'Starting {CONSUMER_WORKERS} consumer worker threads.')
+    for n in range(CONSUMER_WORKERS):
+        threading.Thread(target=worker, name=f'consumer-worker-{n}', daemon=True).start()
+
+    # Shared receive loop; blocks whenever all workers are busy.
+    while 1:
+        try:
+            work_q.put(next(msgs))
         except Exception as e:
             log.error(fmterr(e))
 
@@ -1,4 +1,9 @@
+import contextlib
+import threading
+import time
+
 import psycopg2
+import psycopg2.extras
 
 from loglib import *
 log = retrieve_logger()
@@ -15,121 +20,513 @@ _params = {
     'host': os.environ['PGHOST'],
     'port':'5432'}
 
-# ASSUMPTION here is that db.py is being used in a single-threaded manner
-# and the usage patterns are those of the middleware modules (consumer,
-# redoer, exporter). In other scenarios, it might not be advised to use
-# *module-level* connection and/or cursor objects.
+# Write-behind buffering of affected entity IDs (see EntityIdBuffer).
+# TRACKER_BUFFER_MAX_IDS of 0 disables it; IDs are then written immediately.
+TRACKER_BUFFER_MAX_IDS = int(os.environ.get('TRACKER_BUFFER_MAX_IDS', 0))
+TRACKER_BUFFER_MAX_AGE_SECONDS = float(os.environ.get('TRACKER_BUFFER_MAX_AGE_SECONDS', 5))
+
+# ASSUMPTION here is that the usage patterns are those of the middleware
+# modules (consumer, redoer, exporter). In other scenarios, it might not be
+# advised to use *module-level* connection and/or cursor objects.
+# Consumer can run several worker threads, and Exporter calls in from its
+# upload threads; every function below holds _lock while it uses the shared
+# connection, so that one thread's commit/rollback can't land in the middle of
+# another thread's statement.
 
 _conn = psycopg2.connect(**_params)
 _curs = _conn.cursor()
+_lock = threading.RLock()
+
+# Entity IDs are tracked in the pending_entity table: one row per entity ID,
+# keyed by entity_id (see docker/sql/export-tracker-migration-002.sql).
+# Adding an entity ID that's already there just puts it back to TODO, so the
+# table does not grow with each touch. Its ts is only reset when that changes
+# its status, so that a TODO row's ts is when it became TODO (see
+# get_todo_stats) however often it's touched since. Partial indexes on the
+# TODO and IN PROGRESS states keep the status shifts below from scanning DONE
+# rows. (The original, append-only export_tracker table is no longer written
+# to.)
+
+_UPSERT_SQL = (
+    'insert into pending_entity (entity_id, export_status) values %s '
+    + 'on conflict (entity_id) do update '
+    + 'set export_status = excluded.export_status, '
+    + 'ts = case when pending_entity.export_status = excluded.export_status '
+    + 'then pending_entity.ts else current_timestamp end, '
+    + 'claim_owner = null, lease_expires = null')
 
 def add_entity_id(entity_id):
-    '''Inserts an entity_id into export_tracker with initial status of
+    '''Upserts an entity_id into pending_entity with a status of
     EXPORT_STATUS_TODO. (Each row also gets a timestamp, added automatically by the db.)'''
     if type(entity_id) is not int: raise TypeError
-    log.debug(f'Entity ID: {entity_id}')
-    try:
-        _curs.execute(
-            'insert into export_tracker (entity_id, export_status) values (%s, %s)',
-            [entity_id, EXPORT_STATUS_TODO])
-        _conn.commit()
-    except Exception as e:
-        _conn.rollback()
-        log.error(fmterr(e))
-        raise e
-
-def shift_todo_to_in_progress_and_retrieve():
-    '''This function does two things:
-    1. For all rows with status of EXPORT_STATUS_TODO, updates them
-       to be EXPORT_STATUS_IN_PROGRESS.
-    2. Returns a *distinct* (no duplicates) list of those entity IDs.'''
-    out = []
-    log.debug('shift_todo_to_in_progress_and_retrieve called.')
-    try:
-        _curs.execute(
-            'update export_tracker set export_status = %s where export_status = %s',
-            [EXPORT_STATUS_IN_PROGRESS, EXPORT_STATUS_TODO])
-        log.debug('db update ran ok.')
-        _curs.execute(
-            'select distinct(entity_id) from export_tracker where export_status = %s',
-            [EXPORT_STATUS_IN_PROGRESS])
-        out = list(map(lambda x: x[0], _curs.fetchall()))
-        #print(out)
-        log.debug('db select distinct ran ok.')
-        _conn.commit()
-        log.debug('db commit ran ok.')
-        return out
-    except Exception as e:
-        _conn.rollback()
-        log.error(fmterr(e))
-        raise e
-
-def shift_in_progress_to_done(export_id=None):
-    '''For all rows with status of EXPORT_STATUS_IN_PROGRESS, updates them
-    to be EXPORT_STATUS_DONE (and, optionally, updates their export_id value).
-    Suggestion: export_id can be used to save the name of the output file that
-    was exported.'''
-    log.debug('shift_in_progress_to_done called.')
+    log.debug('Entity ID: %s', entity_id, extra={'entity_id': entity_id})
+    add_entity_ids([entity_id])
+
+def add_entity_ids(entity_ids, source=None):
+    '''Bulk version of add_entity_id: upserts all of entity_ids into
+    pending_entity (status EXPORT_STATUS_TODO) with a single multi-row INSERT
+    and a single COMMIT. `source` (e.g., 'consumer') is only used for logging.'''
+    if not entity_ids: return
+    if any(type(entity_id) is not int for entity_id in entity_ids): raise TypeError
+    log.debug('Entity IDs (%s): %s', source, entity_ids, extra={'entity_count': len(entity_ids)})
+    # An upsert can't touch the same row twice in one statement; sorting also
+    # keeps row lock order consistent between concurrent writers.
+    entity_ids = sorted(set(entity_ids))
+    with _lock:
+        try:
+            psycopg2.extras.execute_values(
+                _curs,
+                _UPSERT_SQL,
+                [(entity_id, EXPORT_STATUS_TODO) for entity_id in entity_ids],
+                page_size=len(entity_ids))
+            _conn.commit()
+        except Exception as e:
+            _conn.rollback()
+            log.error(fmterr(e))
+            raise e
+
+def renew_claims(owner, lease_seconds):
+    '''Renews the leases on everything owner has claimed, to lease_seconds
+    from now.'''
+    log.debug('renew_claims called.')
+    with _lock:
+        try:
+            _curs.execute(
+                "update pending_entity set lease_expires = current_timestamp + %s * interval '1 second' "
+                + 'where export_status = %s and claim_owner = %s',
+                [lease_seconds, EXPORT_STATUS_IN_PROGRESS, owner])
+            _conn.commit()
+        except Exception as e:
+            _conn.rollback()
+            log.error(fmterr(e))
+            raise e
+
+def claim_chunk(owner, chunk_size, lease_seconds, after_entity_id=0):
+    '''Claims up to chunk_size entity IDs greater than after_entity_id for
+    owner (e.g., one exporter run) and returns them. Claimable rows are those
+    with status TODO, plus rows IN PROGRESS whose lease has expired (their
+    previous owner died mid-run). Claimed rows are moved to IN PROGRESS with a
+    lease of lease_seconds; rows locked by a concurrent claim are skipped
+    rather than waited on, so several owners can claim at once. Each call also
+    renews the leases on everything owner has already claimed.
+
+    Passing the last entity ID of the previous chunk as after_entity_id keeps
+    an owner from claiming an entity ID again after it has been put back to
+    TODO (by add_entity_ids) mid-run; it's left for the next run instead.'''
+    log.debug('claim_chunk called.')
+    with _lock:
+        try:
+            _curs.execute(
+                "update pending_entity set lease_expires = current_timestamp + %s * interval '1 second' "
+                + 'where export_status = %s and claim_owner = %s',
+                [lease_seconds, EXPORT_STATUS_IN_PROGRESS, owner])
+            _curs.execute(
+                '''update pending_entity
+                set export_status = %s, claim_owner = %s, fetched_hash = null,
+                    lease_expires = current_timestamp + %s * interval '1 second'
+                where entity_id in (
+                    select entity_id from pending_entity
+                    where entity_id > %s
+                      and (export_status = %s
+                       or (export_status = %s and (lease_expires is null or lease_expires < current_timestamp)))
+                    order by entity_id
+                    limit %s
+                    for update skip locked)
+                returning entity_id''',
+                [EXPORT_STATUS_IN_PROGRESS, owner, lease_seconds, after_entity_id,
+                 EXPORT_STATUS_TODO, EXPORT_STATUS_IN_PROGRESS, chunk_size])
+            out = sorted(map(lambda x: x[0], _curs.fetchall()))
+            log.debug('db claim ran ok.')
+            _conn.commit()
+            log.debug('db commit ran ok.')
+            return out
+        except Exception as e:
+            _conn.rollback()
+            log.error(fmterr(e))
+            raise e
+
+def shift_claimed_to_done(owner, export_id=None):
+    '''Updates the rows owner has claimed (still IN PROGRESS) to be
+    EXPORT_STATUS_DONE, releasing the claim (and, optionally, updates their
+    export_id value). Suggestion: export_id can be used to save the name of
+    the output file that was exported.
+    Entities touched again during the export were put back to TODO by
+    add_entity_ids, so they are left alone here and go out in the next one.'''
+    log.debug('shift_claimed_to_done called.')
     if export_id and type(export_id) is not str: raise TypeError
-    try:
-        if export_id:
-            _curs.execute('update export_tracker set export_id = %s where export_status = %s',
-                [export_id, EXPORT_STATUS_IN_PROGRESS])
-            log.debug('db update export_id ran ok.')
-        _curs.execute(
-            'update export_tracker set export_status = %s where export_status = %s',
-            [EXPORT_STATUS_DONE, EXPORT_STATUS_IN_PROGRESS])
-        log.debug('db update export_status ran ok.')
-        _conn.commit()
-        log.debug('db commit ran ok.')
-    except Exception as e:
-        _conn.rollback()
-        log.error(fmterr(e))
-        raise e
-
-def rewind_in_progress_to_todo():
-    log.debug('rewind_in_progress_to_todo called.')
-    try:
-        _curs.execute(
-            'update export_tracker set export_status = %s where export_status = %s',
-            [EXPORT_STATUS_TODO, EXPORT_STATUS_IN_PROGRESS])
-        log.debug('db update export_status ran ok.')
-        _conn.commit()
-        log.debug('db commit ran ok.')
-    except Exception as e:
-        _conn.rollback()
-        log.error(fmterr(e))
-        raise e
+    with _lock:
+        try:
+            _curs.execute(
+                'update pending_entity set export_status = %s, export_id = coalesce(%s, export_id), '
+                + 'content_hash = coalesce(fetched_hash, content_hash), fetched_hash = null, '
+                + 'claim_owner = null, lease_expires = null '
+                + 'where export_status = %s and claim_owner = %s',
+                [EXPORT_STATUS_DONE, export_id, EXPORT_STATUS_IN_PROGRESS, owner])
+            log.debug('db update export_status ran ok.')
+            _conn.commit()
+            log.debug('db commit ran ok.')
+        except Exception as e:
+            _conn.rollback()
+            log.error(fmterr(e))
+            raise e
+
+def get_content_hashes(entity_ids):
+    '''Returns a map of entity ID -> content hash (bytes) as last exported,
+    for those of entity_ids that have one.'''
+    log.debug('get_content_hashes called.')
+    with _lock:
+        try:
+            _curs.execute(
+                'select entity_id, content_hash from pending_entity '
+                + 'where entity_id = any(%s) and content_hash is not null',
+                [list(entity_ids)])
+            out = {entity_id: bytes(h) for entity_id, h in _curs.fetchall()}
+            _conn.commit()
+            return out
+        except Exception as e:
+            _conn.rollback()
+            log.error(fmterr(e))
+            raise e
+
+def set_fetched_hashes(owner, hashes):
+    '''Saves the content hashes (a list of (entity ID, bytes) pairs) of
+    documents being exported by owner, for the rows it has claimed; they
+    become the rows' content_hash when shifted to DONE by
+    shift_claimed_to_done.'''
+    log.debug('set_fetched_hashes called.')
+    if not hashes: return
+    with _lock:
+        try:
+            psycopg2.extras.execute_values(
+                _curs,
+                'update pending_entity p set fetched_hash = v.h '
+                + 'from (values %s) as v (entity_id, h, owner) '
+                + 'where p.entity_id = v.entity_id and p.claim_owner = v.owner',
+                [(entity_id, h, owner) for entity_id, h in hashes],
+                template='(%s::bigint, %s::bytea, %s::varchar)',
+                page_size=len(hashes))
+            _conn.commit()
+        except Exception as e:
+            _conn.rollback()
+            log.error(fmterr(e))
+            raise e
+
+def release_claimed(owner):
+    '''Puts the rows owner has claimed (still IN PROGRESS) back to
+    EXPORT_STATUS_TODO, releasing the claim.'''
+    log.debug('release_claimed called.')
+    with _lock:
+        try:
+            _curs.execute(
+                'update pending_entity set export_status = %s, claim_owner = null, lease_expires = null, '
+                + 'fetched_hash = null '
+                + 'where export_status = %s and claim_owner = %s',
+                [EXPORT_STATUS_TODO, EXPORT_STATUS_IN_PROGRESS, owner])
+            log.debug('db update export_status ran ok.')
+            _conn.commit()
+            log.debug('db commit ran ok.')
+        except Exception as e:
+            _conn.rollback()
+            log.error(fmterr(e))
+            raise e
 
 def get_tallies():
     log.debug('get_tallies called.')
-    try:
-        _curs.execute('''select count(case when export_status=1 then 1 end) as todo_count,
-            count(case when export_status=2 then 1 end) as in_progress_count,
-            count(case when export_status=3 then 1 end) as done_count,
-            count(case when export_status=4 then 1 end) as skipped_count
-            from export_tracker''')
-        out = _curs.fetchall()[0]
-        _conn.commit()
-        log.debug('db commit ran ok.')
-        return {'TODO': out[0], 'IN PROGRESS': out[1], 'DONE': out[2], 'SKIPPED': out[3]}
-    except Exception as e:
-        _conn.rollback()
-        log.error(fmterr(e))
-        raise e
+    with _lock:
+        try:
+            _curs.execute('''select count(case when export_status=1 then 1 end) as todo_count,
+                count(case when export_status=2 then 1 end) as in_progress_count,
+                count(case when export_status=3 then 1 end) as done_count,
+                count(case when export_status=4 then 1 end) as skipped_count
+                from pending_entity''')
+            out = _curs.fetchall()[0]
+            _conn.commit()
+            log.debug('db commit ran ok.')
+            return {'TODO': out[0], 'IN PROGRESS': out[1], 'DONE': out[2], 'SKIPPED': out[3]}
+        except Exception as e:
+            _conn.rollback()
+            log.error(fmterr(e))
+            raise e
+
+def get_todo_stats():
+    '''Returns the number of TODO rows, and the age in seconds of the oldest
+    (None if there are none).'''
+    log.debug('get_todo_stats called.')
+    with _lock:
+        try:
+            _curs.execute(
+                'select count(*), extract(epoch from localtimestamp - min(ts)) '
+                + 'from pending_entity where export_status = %s',
+                [EXPORT_STATUS_TODO])
+            count, age = _curs.fetchone()
+            _conn.commit()
+            return count, (float(age) if age is not None else None)
+        except Exception as e:
+            _conn.rollback()
+            log.error(fmterr(e))
+            raise e
 
 def shift_todo_to_skipped():
     '''Set all TODO rows to have a status of SKIPPED.
     This, in essence, zeroes out the table.'''
     log.debug('shift_todo_to_skipped called.')
+    with _lock:
+        try:
+            _curs.execute(
+                'update pending_entity set export_status = %s where export_status = %s',
+                [EXPORT_STATUS_SKIPPED, EXPORT_STATUS_TODO])
+            log.debug('db update export_status ran ok.')
+            _conn.commit()
+            log.debug('db commit ran ok.')
+        except Exception as e:
+            _conn.rollback()
+            log.error(fmterr(e))
+            raise e
+
+#-------------------------------------------------------------------------------
+
+# Full export checkpoints (see docker/sql/export-tracker-migration-004.sql):
+# one row per checkpoint ID, holding the multipart upload of an export that
+# hasn't completed yet, the parts of it known to be uploaded, and how far
+# into the Senzing export those parts go.
+
+_CHECKPOINT_COLUMNS = ('checkpoint_id', 'object_key', 'upload_id', 'compression',
+                       'parts', 'entities_written', 'last_entity_id')
+
+def get_export_checkpoint(checkpoint_id):
+    '''Returns the checkpoint saved under checkpoint_id as a dict (parts being
+    a list of {'PartNumber', 'ETag'} maps), or None.'''
+    log.debug('get_export_checkpoint called.')
+    with _lock:
+        try:
+            _curs.execute(
+                'select ' + ', '.join(_CHECKPOINT_COLUMNS) + ' from export_checkpoint '
+                + 'where checkpoint_id = %s',
+                [checkpoint_id])
+            row = _curs.fetchone()
+            _conn.commit()
+            return dict(zip(_CHECKPOINT_COLUMNS, row)) if row else None
+        except Exception as e:
+            _conn.rollback()
+            log.error(fmterr(e))
+            raise e
+
+def save_export_checkpoint(checkpoint_id, object_key, upload_id, compression,
+                           parts, entities_written, last_entity_id=None):
+    '''Creates or replaces the checkpoint saved under checkpoint_id.'''
+    log.debug('save_export_checkpoint called.')
+    with _lock:
+        try:
+            _curs.execute(
+                'insert into export_checkpoint (' + ', '.join(_CHECKPOINT_COLUMNS) + ') '
+                + 'values (%s, %s, %s, %s, %s, %s, %s) '
+                + 'on conflict (checkpoint_id) do update '
+                + 'set object_key = excluded.object_key, upload_id = excluded.upload_id, '
+                + 'compression = excluded.compression, parts = excluded.parts, '
+                + 'entities_written = excluded.entities_written, '
+                + 'last_entity_id = excluded.last_entity_id, ts = current_timestamp',
+                [checkpoint_id, object_key, upload_id, compression,
+                 psycopg2.extras.Json(parts), entities_written, last_entity_id])
+            _conn.commit()
+        except Exception as e:
+            _conn.rollback()
+            log.error(fmterr(e))
+            raise e
+
+def delete_export_checkpoint(checkpoint_id):
+    log.debug('delete_export_checkpoint called.')
+    with _lock:
+        try:
+            _curs.execute('delete from export_checkpoint where checkpoint_id = %s',
+                          [checkpoint_id])
+            _conn.commit()
+        except Exception as e:
+            _conn.rollback()
+            log.error(fmterr(e))
+            raise e
+
+# Sharded full exports (see docker/sql/export-tracker-migration-005.sql).
+# Every entity ID that Consumer or Redoer has touched is in pending_entity,
+# whatever its export status, so it doubles as the list of entity IDs to
+# split between shards.
+
+def get_shard_entity_ids(shard_index, shard_count, after_entity_id, limit):
+    '''Returns (in order) up to limit entity IDs greater than after_entity_id
+    that belong to shard shard_index of shard_count, i.e., for which
+    entity_id % shard_count == shard_index.'''
+    log.debug('get_shard_entity_ids called.')
+    with _lock:
+        try:
+            _curs.execute(
+                'select entity_id from pending_entity '
+                + 'where entity_id > %s and entity_id %% %s = %s '
+                + 'order by entity_id limit %s',
+                [after_entity_id, shard_count, shard_index, limit])
+            out = list(map(lambda x: x[0], _curs.fetchall()))
+            _conn.commit()
+            return out
+        except Exception as e:
+            _conn.rollback()
+            log.error(fmterr(e))
+            raise e
+
+def count_shard_entity_ids(shard_index, shard_count):
+    '''Returns how many entity IDs currently belong to shard shard_index of
+    shard_count (see get_shard_entity_ids).'''
+    log.debug('count_shard_entity_ids called.')
+    with _lock:
+        try:
+            _curs.execute(
+                'select count(*) from pending_entity where entity_id %% %s = %s',
+                [shard_count, shard_index])
+            out = _curs.fetchone()[0]
+            _conn.commit()
+            return out
+        except Exception as e:
+            _conn.rollback()
+            log.error(fmterr(e))
+            raise e
+
+_SHARD_COLUMNS = ('shard_index', 'shard_count', 'object_keys', 'entities_written',
+                  'entities_expected')
+
+def record_export_shard(run_id, shard_index, shard_count, object_keys, entities_written,
+                        entities_expected):
+    '''Records that shard shard_index of run run_id has been exported (to
+    object_keys), with entities_written of the entities_expected it started
+    out with; returns the finished shards of the run so far, as a list of
+    dicts ordered by shard_index.'''
+    log.debug('record_export_shard called.')
+    with _lock:
+        try:
+            _curs.execute(
+                'insert into export_shard '
+                + '(run_id, shard_index, shard_count, object_keys, entities_written, '
+                + 'entities_expected) values (%s, %s, %s, %s, %s, %s) '
+                + 'on conflict (run_id, shard_index) do update '
+                + 'set shard_count = excluded.shard_count, object_keys = excluded.object_keys, '
+                + 'entities_written = excluded.entities_written, '
+                + 'entities_expected = excluded.entities_expected, ts = current_timestamp',
+                [run_id, shard_index, shard_count, psycopg2.extras.Json(object_keys),
+                 entities_written, entities_expected])
+            _conn.commit()
+            _curs.execute(
+                'select ' + ', '.join(_SHARD_COLUMNS) + ' from export_shard '
+                + 'where run_id = %s order by shard_index',
+                [run_id])
+            out = [dict(zip(_SHARD_COLUMNS, row)) for row in _curs.fetchall()]
+            _conn.commit()
+            return out
+        except Exception as e:
+            _conn.rollback()
+            log.error(fmterr(e))
+            raise e
+
+#-------------------------------------------------------------------------------
+
+# Arbitrary (application-wide) advisory lock key, serializing Senzing config
+# changes -- i.e., data source registration -- across consumer processes.
+DATA_SOURCE_LOCK_KEY = 7162001
+
+@contextlib.contextmanager
+def advisory_lock(key, poll_seconds=0.1):
+    '''Context manager; holds the Postgres advisory lock on key for the
+    duration of the with-block, waiting for any other session (i.e., other
+    process) holding it. The lock is session-level, so it's also released if
+    this process dies. Waiting is done by polling, so as not to tie up the
+    shared connection.'''
+    while 1:
+        with _lock:
+            try:
+                _curs.execute('select pg_try_advisory_lock(%s)', (key,))
+                got_it = _curs.fetchone()[0]
+                _conn.commit()
+            except Exception as e:
+                _conn.rollback()
+                log.error(fmterr(e))
+                raise e
+        if got_it: break
+        time.sleep(poll_seconds)
+    log.debug('Acquired advisory lock %s.', key)
     try:
-        _curs.execute(
-            'update export_tracker set export_status = %s where export_status = %s',
-            [EXPORT_STATUS_SKIPPED, EXPORT_STATUS_TODO])
-        log.debug('db update export_status ran ok.')
-        _conn.commit()
-        log.debug('db commit ran ok.')
-    except Exception as e:
-        _conn.rollback()
-        log.error(fmterr(e))
-        raise e
+        yield
+    finally:
+        with _lock:
+            try:
+                _curs.execute('select pg_advisory_unlock(%s)', (key,))
+                _conn.commit()
+                log.debug('Released advisory lock %s.', key)
+            except Exception as e:
+                _conn.rollback()
+                log.error(fmterr(e))
+
+class EntityIdBuffer:
+    '''Write-behind buffer for affected entity IDs.
+    IDs are collected in a set (so an entity touched many times within one
+    flush window is only upserted once) and flushed via
+    add_entity_ids once max_ids distinct IDs are pending or the oldest pending
+    ID is max_age_seconds old, whichever comes first.
+    Each add can carry a token (e.g., an SQS receipt handle); once the IDs have
+    been committed, on_flushed is called with the tokens of everything that
+    was flushed, so callers can defer acknowledging work until then.
+    If a flush fails, its IDs and tokens stay pending and are retried.'''
+
+    def __init__(self, max_ids=TRACKER_BUFFER_MAX_IDS,
+                 max_age_seconds=TRACKER_BUFFER_MAX_AGE_SECONDS,
+                 on_flushed=None, source=None):
+        self.max_ids = max_ids
+        self.max_age_seconds = max_age_seconds
+        self.on_flushed = on_flushed
+        self.source = source
+        self._ids = set()
+        self._tokens = []
+        self._oldest = None
+        # Re-entrant, since a signal handler may flush while the main thread
+        # is mid-flush.
+        self._lock = threading.RLock()
+        # Serializes flushes, so tokens are handed to on_flushed in order.
+        self._flush_lock = threading.RLock()
+
+    def start(self):
+        '''Starts a background thread that flushes on age.'''
+        threading.Thread(target=self._run, name='entity-id-buffer', daemon=True).start()
+        return self
+
+    def add(self, entity_ids, token=None):
+        with self._lock:
+            if self._oldest is None: self._oldest = time.monotonic()
+            self._ids.update(entity_ids)
+            if token is not None: self._tokens.append(token)
+            full = len(self._ids) >= self.max_ids
+        if full: self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if self._oldest is None: return
+                ids, tokens = self._ids, self._tokens
+                self._ids, self._tokens, self._oldest = set(), [], None
+            try:
+                add_entity_ids(sorted(ids), source=self.source)
+                log.debug('Flushed %d distinct entity IDs for %d item(s).', len(ids), len(tokens),
+                          extra={'entity_count': len(ids)})
+            except Exception as e:
+                log.error('Entity ID buffer flush failed; will retry. ' + fmterr(e))
+                with self._lock:
+                    self._ids.update(ids)
+                    self._tokens[:0] = tokens
+                    if self._oldest is None: self._oldest = time.monotonic()
+                return
+            if self.on_flushed and tokens:
+                self.on_flushed(tokens)
+
+    def _run(self):
+        while 1:
+            time.sleep(self.max_age_seconds / 4)
+            try:
+                with self._lock:
+                    due = (self._oldest is not None
+                           and time.monotonic() - self._oldest >= self.max_age_seconds)
+                if due: self.flush()
+            except Exception as e:
+                log.error(fmterr(e))
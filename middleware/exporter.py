@@ -1,9 +1,16 @@
+import collections
+import concurrent.futures
 import datetime
+import hashlib
 import json
-import io
 import os
+import signal
+import socket
+import subprocess
+import threading
 import time
 import sys
+import zlib
 import boto3
 import senzing as sz
 
@@ -12,6 +19,8 @@ log = retrieve_logger()
 
 import otel
 import db
+import jsonlib
+import multipart
 
 try:
     log.info('Importing senzing_core library . . .')
@@ -37,6 +46,41 @@ RUNTIME_ENV = os.environ.get('RUNTIME_ENV', 'unknown') # For OTel
 FULL_EXPORT_FLAGS = sz.SzEngineFlags.SZ_ENTITY_BRIEF_DEFAULT_FLAGS | sz.SzEngineFlags.SZ_EXPORT_INCLUDE_ALL_ENTITIES
 DELTA_EXPORT_FLAGS = sz.SzEngineFlags.SZ_ENTITY_BRIEF_DEFAULT_FLAGS
 
+EXPORT_FORMAT = os.environ.get('EXPORT_FORMAT', 'jsonl').lower()
+log.info(f"Export format is: {EXPORT_FORMAT}")
+if EXPORT_FORMAT not in ('jsonl', 'parquet'):
+    log.error(f'Unsupported EXPORT_FORMAT: {EXPORT_FORMAT}')
+    sys.exit(1)
+if EXPORT_FORMAT == 'parquet':
+    try:
+        import parquet_export
+    except Exception as e:
+        log.error('EXPORT_FORMAT is parquet, but importing pyarrow library failed.')
+        log.error(fmterr(e))
+        sys.exit(1)
+PARQUET_CONTENT_TYPE = 'application/vnd.apache.parquet'
+# Number of entities per Parquet row group (i.e., held in memory at a time).
+EXPORT_PARQUET_ROW_GROUP_SIZE = int(os.environ.get('EXPORT_PARQUET_ROW_GROUP_SIZE', 50000))
+
+EXPORT_COMPRESSION = os.environ.get('EXPORT_COMPRESSION', 'none').lower()
+log.info(f"Export compression is: {EXPORT_COMPRESSION}")
+# Content-Encoding and file extension for each compression option. (With
+# Parquet output, EXPORT_COMPRESSION is used as the Parquet codec instead.)
+COMPRESSION_INFO = {
+    'none': (None, ''),
+    'gzip': ('gzip', '.gz'),
+    'zstd': ('zstd', '.zst')}
+if EXPORT_COMPRESSION not in COMPRESSION_INFO:
+    log.error(f'Unsupported EXPORT_COMPRESSION: {EXPORT_COMPRESSION}')
+    sys.exit(1)
+if EXPORT_COMPRESSION == 'zstd' and EXPORT_FORMAT == 'jsonl':
+    try:
+        import zstandard
+    except Exception as e:
+        log.error('EXPORT_COMPRESSION is zstd, but importing zstandard library failed.')
+        log.error(fmterr(e))
+        sys.exit(1)
+
 EXPORT_MODE = os.environ.get('EXPORT_MODE', 'delta').lower()
 log.info(f"Export mode is: {EXPORT_MODE}")
 DELTA_MODE = None
@@ -45,10 +89,91 @@ if EXPORT_MODE == 'delta':
 else:
     DELTA_MODE = False
 
+# Daemon mode (delta mode only): rather than exporting once and exiting, keep
+# the one Senzing engine and run a delta export whenever there's enough to
+# export -- EXPORT_DAEMON_MIN_ENTITIES entity IDs TODO, or the oldest TODO
+# entity ID being EXPORT_DAEMON_MAX_AGE_SECONDS old -- but at most every
+# EXPORT_DAEMON_MIN_INTERVAL_SECONDS, and at least every
+# EXPORT_DAEMON_MAX_INTERVAL_SECONDS (when anything is TODO). The export
+# tracker is checked every EXPORT_DAEMON_POLL_SECONDS.
+EXPORT_DAEMON = int(os.environ.get('EXPORT_DAEMON', 0))
+EXPORT_DAEMON_MIN_ENTITIES = int(os.environ.get('EXPORT_DAEMON_MIN_ENTITIES', 1000))
+EXPORT_DAEMON_MAX_AGE_SECONDS = int(os.environ.get('EXPORT_DAEMON_MAX_AGE_SECONDS', 300))
+EXPORT_DAEMON_MIN_INTERVAL_SECONDS = max(int(os.environ.get('EXPORT_DAEMON_MIN_INTERVAL_SECONDS', 60)), 1)
+EXPORT_DAEMON_MAX_INTERVAL_SECONDS = int(os.environ.get('EXPORT_DAEMON_MAX_INTERVAL_SECONDS', 3600))
+EXPORT_DAEMON_POLL_SECONDS = int(os.environ.get('EXPORT_DAEMON_POLL_SECONDS', 10))
+if EXPORT_DAEMON and not DELTA_MODE:
+    log.warning('EXPORT_DAEMON only applies to delta mode; ignoring.')
+    EXPORT_DAEMON = 0
+
+# Full mode can be split into EXPORT_SHARDS shards by entity ID (entity_id %
+# EXPORT_SHARDS), each exported to its own object by its own process or task
+# (EXPORT_SHARD_INDEX, from 0). All the shards of one export share an
+# EXPORT_RUN_ID; whichever finishes last writes the run's manifest. Without
+# EXPORT_SHARD_INDEX, the Exporter runs every shard itself, as child processes.
+EXPORT_SHARDS = max(int(os.environ.get('EXPORT_SHARDS', 1)), 1)
+EXPORT_SHARD_INDEX = os.environ.get('EXPORT_SHARD_INDEX')
+EXPORT_RUN_ID = os.environ.get('EXPORT_RUN_ID')
+if EXPORT_SHARDS > 1 and DELTA_MODE:
+    log.warning('EXPORT_SHARDS only applies to full exports; ignoring.')
+    EXPORT_SHARDS = 1
+SHARDED = EXPORT_SHARDS > 1
+if SHARDED and EXPORT_SHARD_INDEX is not None:
+    EXPORT_SHARD_INDEX = int(EXPORT_SHARD_INDEX)
+    if not 0 <= EXPORT_SHARD_INDEX < EXPORT_SHARDS:
+        log.error(f'EXPORT_SHARD_INDEX must be from 0 to {EXPORT_SHARDS - 1}.')
+        sys.exit(1)
+    if not EXPORT_RUN_ID:
+        log.error('EXPORT_RUN_ID environment variable required with EXPORT_SHARD_INDEX.')
+        sys.exit(1)
+
+# Full mode: save the export's progress (parts uploaded, entities written) to
+# the export_checkpoint table as it goes, so that if it fails, the next run
+# picks up the same multipart upload where it left off. JSONL output only.
+EXPORT_CHECKPOINT = int(os.environ.get('EXPORT_CHECKPOINT', 0))
+if EXPORT_CHECKPOINT and (DELTA_MODE or SHARDED or EXPORT_FORMAT != 'jsonl'):
+    log.warning('EXPORT_CHECKPOINT only applies to unsharded full exports with JSONL output; ignoring.')
+    EXPORT_CHECKPOINT = 0
+
 # The output file is accumulated chunk by chunk from Senzing; this is how
 # many bytes we put together before sending those combined chunks as a 'part'
-# to S3 via multipart S3 upload.
+# to S3 via multipart S3 upload. It's the smallest part size: for large
+# exports, parts are made bigger so the object fits in S3's 10,000 parts (see
+# multipart.PartSizer), based on the expected number of entities (by default,
+# from the export tracker) times the bytes per entity seen so far.
 BYTES_PER_PART = (1024 ** 2) * 10
+EXPORT_ESTIMATED_ENTITIES = int(os.environ.get('EXPORT_ESTIMATED_ENTITIES', 0))
+# Bytes per entity assumed until the first part has been written.
+EXPORT_ESTIMATED_BYTES_PER_ENTITY = int(os.environ.get('EXPORT_ESTIMATED_BYTES_PER_ENTITY', 2048))
+
+# Delta mode claims work from the export tracker in chunks, each held under a
+# lease; if this exporter dies, its claimed entity IDs are picked up by a later
+# run once the lease has expired. Several delta exporters can run at once.
+EXPORT_CLAIM_CHUNK_SIZE = int(os.environ.get('EXPORT_CLAIM_CHUNK_SIZE', 10000))
+EXPORT_LEASE_SECONDS = int(os.environ.get('EXPORT_LEASE_SECONDS', 900))
+# A run claims at most as many entity IDs as were TODO or IN PROGRESS when it
+# started (and at most EXPORT_MAX_ENTITIES_PER_RUN, if set), so that it
+# finishes even while Consumer/Redoer keep adding entity IDs; the rest are
+# left for the next run.
+EXPORT_MAX_ENTITIES_PER_RUN = int(os.environ.get('EXPORT_MAX_ENTITIES_PER_RUN', 0))
+
+# Delta mode leaves out entities whose document is the same as when they were
+# last exported (compared by hash; see ContentHashes). They're still marked
+# DONE. Set to 0 to export every claimed entity.
+EXPORT_SKIP_UNCHANGED = int(os.environ.get('EXPORT_SKIP_UNCHANGED', 1))
+
+# Delta mode: number of threads calling get_entity_by_entity_id concurrently.
+EXPORT_FETCH_WORKERS = max(int(os.environ.get('EXPORT_FETCH_WORKERS', 1)), 1)
+# With more than one fetch worker, entities are written in claim (entity ID)
+# order by default; set to 0 to write them in whatever order they come back.
+EXPORT_FETCH_ORDERED = int(os.environ.get('EXPORT_FETCH_ORDERED', 1))
+# Upper bound on fetches in flight (and results held) at any one time.
+EXPORT_FETCH_MAX_IN_FLIGHT = EXPORT_FETCH_WORKERS * 4
+
+# Number of background threads uploading parts to S3 while fetching carries on
+# (0 means parts are uploaded inline, stopping the fetch while they upload).
+# Up to this many filled parts can also wait in memory for a free thread.
+EXPORT_UPLOAD_THREADS = int(os.environ.get('EXPORT_UPLOAD_THREADS', 2))
 
 #-------------------------------------------------------------------------------
 
@@ -66,17 +191,335 @@ def make_s3_client():
     except Exception as e:
         log.error(AWS_TAG + fmterr(e))
 
+def claim_entity_ids(owner, stages, limit, on_claimed=None):
+    '''Generator function; emits entity IDs claimed (via db.claim_chunk) on
+    behalf of owner, one chunk at a time, in entity ID order, until there's
+    nothing left to claim or limit entity IDs have been claimed. An entity ID
+    is claimed at most once. If given, on_claimed(entity_ids) is called with
+    each chunk before it's emitted.'''
+    total = 0
+    after = 0
+    while 1:
+        if total >= limit:
+            log.info('Claimed the most entity IDs for one run (%d); leaving the rest for the next.', total)
+            return
+        with stages.time('tracker_claim'):
+            entity_ids = db.claim_chunk(
+                owner, min(EXPORT_CLAIM_CHUNK_SIZE, limit - total), EXPORT_LEASE_SECONDS, after)
+        if not entity_ids:
+            log.info('No more entity IDs to claim. Total claimed: %d', total)
+            return
+        total += len(entity_ids)
+        after = entity_ids[-1]
+        log.info('Claimed chunk of %d entity IDs (total so far: %d).', len(entity_ids), total)
+        if on_claimed: on_claimed(entity_ids)
+        yield from entity_ids
+
+def shard_entity_ids(stages):
+    '''Generator function; emits the entity IDs of this Exporter's shard (see
+    db.get_shard_entity_ids), reading them a chunk at a time.'''
+    total = 0
+    after = 0
+    while 1:
+        with stages.time('tracker_read'):
+            entity_ids = db.get_shard_entity_ids(
+                EXPORT_SHARD_INDEX, EXPORT_SHARDS, after, EXPORT_CLAIM_CHUNK_SIZE)
+        if not entity_ids:
+            log.info('No more entity IDs in shard %d. Total: %d', EXPORT_SHARD_INDEX, total)
+            return
+        total += len(entity_ids)
+        after = entity_ids[-1]
+        yield from entity_ids
+
+def write_manifest(s3, shards):
+    '''Writes the manifest of a sharded export -- the objects of each of its
+    shards, and how many entities they hold (and were expected to hold) --
+    next to the shards; returns its key. shards is as returned by
+    db.record_export_shard.'''
+    manifest_key = FOLDER_NAME + '/' + EXPORT_RUN_ID + '/manifest.json'
+    manifest = {
+        'run_id': EXPORT_RUN_ID,
+        'export_mode': EXPORT_MODE,
+        'export_format': EXPORT_FORMAT,
+        'export_compression': EXPORT_COMPRESSION,
+        'shard_count': EXPORT_SHARDS,
+        'entities_written': sum(x['entities_written'] for x in shards),
+        'entities_expected': sum(x['entities_expected'] for x in shards),
+        'shards': shards}
+    s3.put_object(
+        Bucket=S3_BUCKET_NAME,
+        Key=manifest_key,
+        ContentType='application/json',
+        Body=json.dumps(manifest, indent=2).encode('utf-8'))
+    return manifest_key
+
+def run_shards():
+    '''Runs each shard of a sharded export in a child process of its own
+    (this module, with EXPORT_SHARD_INDEX and EXPORT_RUN_ID set); returns
+    whether they all succeeded.'''
+    run_id = EXPORT_RUN_ID or datetime.datetime.now(datetime.timezone.utc).strftime(
+        '%Y-%m-%dT%H:%M:%S-UTC')
+    log.info(f'Starting {EXPORT_SHARDS} shard processes for export run {run_id}.')
+    procs = []
+    for n in range(EXPORT_SHARDS):
+        env = dict(os.environ, EXPORT_SHARD_INDEX=str(n), EXPORT_RUN_ID=run_id)
+        procs.append(subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env))
+    failed = [n for n, proc in enumerate(procs) if proc.wait() != 0]
+    if failed:
+        log.error(f'Shard(s) {failed} of export run {run_id} failed.')
+        return False
+    log.info(f'All {EXPORT_SHARDS} shards of export run {run_id} finished.')
+    return True
+
+def estimate_entity_count(tallies):
+    '''Returns the number of entities this export is expected to write
+    (EXPORT_ESTIMATED_ENTITIES if set; otherwise, based on the export tracker
+    tallies), or None.'''
+    if EXPORT_ESTIMATED_ENTITIES:
+        count = EXPORT_ESTIMATED_ENTITIES
+    elif DELTA_MODE:
+        count = tallies['TODO'] + tallies['IN PROGRESS']
+        if EXPORT_MAX_ENTITIES_PER_RUN:
+            count = min(count, EXPORT_MAX_ENTITIES_PER_RUN)
+    else:
+        # Every entity ID Consumer/Redoer have touched (including some that
+        # have since been deleted).
+        count = sum(tallies.values())
+    return (count // EXPORT_SHARDS) or None
+
+class ExportProgress:
+    '''How far along an export is, and how big it's expected to get. Feeds
+    part sizing (see multipart.PartSizer) and the progress gauges.'''
+
+    def __init__(self):
+        self.estimated_entities = None
+        self.entities_written = 0
+
+    def estimated_bytes(self, bytes_so_far):
+        '''Returns the expected size of an output, given that bytes_so_far
+        of it were written for the entities written so far.'''
+        if not self.estimated_entities: return None
+        entities = max(self.estimated_entities, self.entities_written)
+        if self.entities_written and bytes_so_far:
+            return int(bytes_so_far / self.entities_written * entities)
+        return entities * EXPORT_ESTIMATED_BYTES_PER_ENTITY
+
+def export_due(todo_count, oldest_todo_age, since_last):
+    '''(Daemon mode) Returns the reason a delta export is due, or None.
+    since_last is the number of seconds since the last export started (None
+    if there hasn't been one).'''
+    if not todo_count: return None
+    if since_last is not None and since_last < EXPORT_DAEMON_MIN_INTERVAL_SECONDS: return None
+    if todo_count >= EXPORT_DAEMON_MIN_ENTITIES:
+        return f'{todo_count} entity IDs are TODO'
+    if oldest_todo_age is not None and oldest_todo_age >= EXPORT_DAEMON_MAX_AGE_SECONDS:
+        return f'oldest TODO entity ID is {oldest_todo_age:.0f} sec. old'
+    if since_last is None:
+        return 'first export since startup'
+    if since_last >= EXPORT_DAEMON_MAX_INTERVAL_SECONDS:
+        return f'{since_last:.0f} sec. since the last export'
+    return None
+
+def run_daemon(export_once, refresh_sz_config):
+    '''Daemon mode: runs export_once (a delta export, with the one Senzing
+    engine) whenever export_due says so, until SIGINT/SIGTERM. An export under
+    way when the signal comes is allowed to finish first.'''
+    stopping = threading.Event()
+    exporting = False
+
+    def clean_up(signum, frm):
+        log.info('***************************')
+        log.info('SIGINT or SIGTERM received.')
+        log.info('***************************')
+        if not exporting: sys.exit(0)
+        log.info('Will stop once the current export has finished.')
+        stopping.set()
+    signal.signal(signal.SIGINT, clean_up)
+    signal.signal(signal.SIGTERM, clean_up)
+
+    log.info(f'Running as a daemon (at least {EXPORT_DAEMON_MIN_ENTITIES} entity IDs or '
+             + f'{EXPORT_DAEMON_MAX_AGE_SECONDS} sec. old; every {EXPORT_DAEMON_MIN_INTERVAL_SECONDS} '
+             + f'to {EXPORT_DAEMON_MAX_INTERVAL_SECONDS} sec.).')
+    last_start = None
+    while not stopping.is_set():
+        reason = None
+        try:
+            todo_count, oldest_todo_age = db.get_todo_stats()
+            since_last = None if last_start is None else time.monotonic() - last_start
+            reason = export_due(todo_count, oldest_todo_age, since_last)
+        except Exception as e:
+            log.error(fmterr(e))
+        if reason:
+            log.info('Starting delta export: %s.', reason)
+            last_start = time.monotonic()
+            exporting = True
+            try:
+                refresh_sz_config()
+                if not export_once(): log.error('Delta export failed.')
+            except Exception as e:
+                log.error(fmterr(e))
+            exporting = False
+            continue
+        stopping.wait(EXPORT_DAEMON_POLL_SECONDS)
+    log.info('Daemon stopped.')
+
+def split_lines(chunks):
+    '''Generator function; re-cuts the str chunks into lines (each ending
+    with a newline, bar possibly the last).'''
+    rest = ''
+    for chunk in chunks:
+        lines = (rest + chunk).split('\n')
+        rest = lines.pop()
+        for line in lines:
+            if line: yield line + '\n'
+    if rest: yield rest
+
+def content_hash(doc):
+    '''Hash (bytes) of an entity's JSON document.'''
+    return hashlib.blake2b(doc.encode('utf-8'), digest_size=16).digest()
+
+class LeaseRenewer:
+    '''(Delta mode) Renews the leases on owner's claims from a background
+    thread, every third of EXPORT_LEASE_SECONDS, until stopped -- so they
+    can't expire while the last chunk is being fetched or the export is being
+    wrapped up.'''
+
+    def __init__(self, owner):
+        self.owner = owner
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='lease-renewer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(EXPORT_LEASE_SECONDS / 3):
+            try:
+                db.renew_claims(self.owner, EXPORT_LEASE_SECONDS)
+                log.debug('Renewed the leases on claims of %s.', self.owner)
+            except Exception as e:
+                # Try again next time; the lease is still good for a while.
+                log.error('Renewing claim leases failed. ' + fmterr(e))
+
+class ContentHashes:
+    '''(Delta mode) Tells which claimed entities are unchanged, i.e., whose
+    document hashes the same as when the entity was last exported.
+
+    claimed is claim_entity_ids' on_claimed callback; it looks up the last
+    exported hashes of each chunk. The hashes of documents that did change
+    are saved (as the claims' fetched_hash, in chunks) as the export goes;
+    db.shift_claimed_to_done makes them the entities' content_hash, so
+    they're only taken as exported once the export has been.'''
+
+    def __init__(self, owner, stages):
+        self.owner = owner
+        self.stages = stages
+        self.num_unchanged = 0
+        self._last = {}     # entity ID -> hash as last exported
+        self._fetched = []  # (entity ID, hash) pairs not yet saved
+
+    def claimed(self, entity_ids):
+        with self.stages.time('tracker_claim'):
+            self._last.update(db.get_content_hashes(entity_ids))
+
+    def unchanged(self, entity_id, doc):
+        '''Whether doc (None if the entity is gone) is the same as what was
+        last exported for entity_id.'''
+        last = self._last.pop(entity_id, None)
+        if doc is None: return False
+        h = content_hash(doc)
+        if h == last:
+            self.num_unchanged += 1
+            return True
+        self._fetched.append((entity_id, h))
+        if len(self._fetched) >= EXPORT_CLAIM_CHUNK_SIZE: self.flush()
+        return False
+
+    def flush(self):
+        '''Saves the hashes gathered so far.'''
+        if not self._fetched: return
+        with self.stages.time('tracker_write'):
+            db.set_fetched_hashes(self.owner, self._fetched)
+        self._fetched = []
+
+class Checkpointer:
+    '''Keeps the export_checkpoint row for a checkpointed (full) export up to
+    date as its parts finish uploading.
+
+    Parts are cut at entity boundaries, and part_cut is told how many entities
+    a part brings the total to. Parts can finish uploading in any order, so
+    the checkpoint only ever covers the unbroken run of uploaded parts from
+    part 1 -- everything it covers is in S3.'''
+
+    def __init__(self, checkpoint_id, key, upload_id, parts=(), entities_written=0,
+                 last_entity_id=None):
+        self.checkpoint_id = checkpoint_id
+        self.key = key
+        self.upload_id = upload_id
+        self.parts = list(parts)
+        self.entities_written = entities_written
+        self.last_entity_id = last_entity_id
+        self._cuts = {}     # part number -> (entities written, last entity ID)
+        self._etags = {}    # part number -> ETag, for parts past the checkpoint
+        self._lock = threading.Lock()
+
+    def save(self):
+        db.save_export_checkpoint(
+            self.checkpoint_id, self.key, self.upload_id, EXPORT_COMPRESSION,
+            self.parts, self.entities_written, self.last_entity_id)
+
+    def part_cut(self, part_number, entities_written, last_entity_id):
+        with self._lock:
+            self._cuts[part_number] = (entities_written, last_entity_id)
+
+    def part_uploaded(self, part_number, etag):
+        '''PipelinedUploader's on_uploaded callback.'''
+        with self._lock:
+            self._etags[part_number] = etag
+            n = len(self.parts) + 1
+            if n not in self._etags or n not in self._cuts: return
+            while n in self._etags and n in self._cuts:
+                self.parts.append({'PartNumber': n, 'ETag': self._etags.pop(n)})
+                self.entities_written, self.last_entity_id = self._cuts.pop(n)
+                n += 1
+            try:
+                self.save()
+                log.debug('Saved export checkpoint: %d part(s), %d entities.',
+                          len(self.parts), self.entities_written,
+                          extra={'export_id': self.key, 'entity_count': self.entities_written})
+            except Exception as e:
+                # The next part to finish will try again.
+                log.error('Saving export checkpoint failed. ' + fmterr(e))
+
 def build_output_filename(tag='exporter-output'):
     '''Returns a str, e.g.,
-        '2025-10-07T23:15:54-UTC-exporter-output.json'
+        '2025-10-07T23:15:54-UTC-exporter-output-delta.json'
+    (with a '.gz' or '.zst' suffix when EXPORT_COMPRESSION is set), or
+        '2025-10-07T23:15:54-UTC-exporter-output-delta.parquet'
     '''
-    kind = 'json' # Technically JSONL, but we're attempting to follow precedent here.
+    if EXPORT_FORMAT == 'parquet':
+        kind = 'parquet' # Compression is internal to the Parquet file.
+    else:
+        kind = 'json' # Technically JSONL, but we're attempting to follow precedent here.
+        kind += COMPRESSION_INFO[EXPORT_COMPRESSION][1]
     return (
         datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S-UTC")
         + '-' + tag
         + '-' + EXPORT_MODE
         + '.' + kind)
 
+def make_compressor():
+    '''Returns a streaming compressor (with `compress` and `flush` methods) for
+    EXPORT_COMPRESSION, or None. The whole export goes through one compressor,
+    so the concatenated parts form a single valid gzip/zstd stream.'''
+    if EXPORT_COMPRESSION == 'gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 31) # 31: gzip header/trailer
+    if EXPORT_COMPRESSION == 'zstd':
+        return zstandard.ZstdCompressor().compressobj()
+    return None
+
 def go():
     '''
     Exports Senzing JSON entity report data into a buffer, then
@@ -94,183 +537,446 @@ def go():
     # Note that Senzing engine object cannot be passed around between functions,
     # else it will be eagerly cleaned up / destroyed and no longer usable.
     sz_eng = None
+    sz_config_id = None
     try:
         sz_factory = sz_core.SzAbstractFactoryCore("ERS", SZ_CONFIG)
         sz_eng = sz_factory.create_engine()
         log.info(SZ_TAG + 'Senzing engine object instantiated.')
+        if EXPORT_DAEMON:
+            sz_config_id = sz_factory.create_configmanager().get_default_config_id()
     except sz.SzError as sz_err:
         log.error(SZ_TAG + fmterr(sz_err))
     except Exception as e:
         log.error(fmterr(e))
 
+    def refresh_sz_config():
+        '''(Daemon mode) Re-initializes Senzing if its default config has
+        changed (e.g., Consumer registered a data source) since the engine was
+        created or last re-initialized.'''
+        nonlocal sz_config_id
+        default_config_id = sz_factory.create_configmanager().get_default_config_id()
+        if default_config_id != sz_config_id:
+            sz_factory.reinitialize(default_config_id)
+            sz_config_id = default_config_id
+            log.info(SZ_TAG + f'Re-initialized Senzing with config ID {default_config_id}.')
+
+    def fetch_entity(entity_id):
+        '''Returns the entity's JSON, or None if it has since been deleted.'''
+        log.debug('Fetching info for entity ID %s ...', entity_id, extra={'entity_id': entity_id})
+        try:
+            # Ref: https://garage.senzing.com/sz-sdk-python/senzing.html#senzing.szengine.SzEngine.get_entity_by_entity_id
+            with stages.time('sz_fetch'):
+                return sz_eng.get_entity_by_entity_id(entity_id, DELTA_EXPORT_FLAGS)
+        except sz.SzNotFoundError as sz_not_found_err:
+            log.debug('Entity %s has been deleted. Skipping.', entity_id, extra={'entity_id': entity_id})
+            return None
+
+    def fetch_entities(entity_ids):
+        '''Generator function; emits (entity ID, entity JSON or None) pairs.
+        With EXPORT_FETCH_WORKERS > 1, fetches run on a bounded thread pool
+        (the Senzing engine is thread-safe), with at most
+        EXPORT_FETCH_MAX_IN_FLIGHT outstanding.'''
+        if EXPORT_FETCH_WORKERS == 1:
+            for entity_id in entity_ids:
+                yield entity_id, fetch_entity(entity_id)
+            return
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=EXPORT_FETCH_WORKERS, thread_name_prefix='fetch') as pool:
+            if EXPORT_FETCH_ORDERED:
+                pending = collections.deque()
+                for entity_id in entity_ids:
+                    pending.append((entity_id, pool.submit(fetch_entity, entity_id)))
+                    if len(pending) >= EXPORT_FETCH_MAX_IN_FLIGHT:
+                        entity_id, fut = pending.popleft()
+                        yield entity_id, fut.result()
+                while pending:
+                    entity_id, fut = pending.popleft()
+                    yield entity_id, fut.result()
+            else:
+                pending = {}
+                for entity_id in entity_ids:
+                    pending[pool.submit(fetch_entity, entity_id)] = entity_id
+                    if len(pending) >= EXPORT_FETCH_MAX_IN_FLIGHT:
+                        done, _ = concurrent.futures.wait(
+                            pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                        for fut in done:
+                            yield pending.pop(fut), fut.result()
+                for fut in concurrent.futures.as_completed(pending):
+                    yield pending[fut], fut.result()
+
     # OTel setup #
     log.info('Starting OTel setup.')
     meter = otel.init('exporter')
-    otel_exp_counter = meter.create_counter('exporter.export.count')
-    otel_duration = meter.create_histogram('exporter.export.duration')
+    otel_exp_counter = otel.counter(meter, 'exporter.export.count')
+    otel_duration = otel.histogram(meter, 'exporter.export.duration')
+    otel_unchanged_counter = otel.counter(meter, 'exporter.export.unchanged_entities')
+    otel_attrs = otel.status_attributes('exporter', RUNTIME_ENV)
+    stages = otel.StageTimings(meter, 'exporter', RUNTIME_ENV)
     log.info('Finished OTel setup.')
     # end OTel setup #
 
-    # Retrieve output from sz into buff
-    # sz will export JSONL lines; we add the chars necessary to make
-    # the output as a whole be a single JSON blob.
-    log.info(SZ_TAG + 'Starting export from Senzing.')
-
-    start = time.perf_counter()
-    success_status = otel.FAILURE # initial default state
-
-    # For multipart S3 upload, S3 will hand back to us an etag for each
-    # part we upload to it. We need to accumulate the part IDs (which we
-    # set) and the etags (which S3 gives) and provide it all to S3 at the very
-    # end when wrapping up the upload.
-    # This is a list of maps:
-    part_ids_and_tags = []
-
-    FETCH_COMPLETE = False
-
-    key = FOLDER_NAME + '/' + build_output_filename()
-    upload_id = None
-
-    # Specific to delta mode:
-    db_has_in_progress_rows = False
-    entity_ids = []
-    entity_ids_idx = -1
-    try:
-
-        if DELTA_MODE:
-            log.info('Export tracker table before doing anything: ' + str(db.get_tallies()))
-            log.info('Shifting export-tracker entity IDs from TODO to IN PROGRESS ...')
-            entity_ids = db.shift_todo_to_in_progress_and_retrieve()
-            db_has_in_progress_rows = True
-            log.info('Successfully called db.shift_todo_to_in_progress_and_retrieve(); '
-                     + f'Total count of entity IDs in progress: {len(entity_ids)}')
-            log.info('Export tracker table AFTER shift to IN PROGRESS: ' + str(db.get_tallies()))
-        else:
-            export_handle = sz_eng.export_json_entity_report(FULL_EXPORT_FLAGS)
-            log.info(SZ_TAG + 'Obtained export_json_entity_report handle.')
-
-        mup_resp = s3.create_multipart_upload(
-            Bucket=S3_BUCKET_NAME,
-            ContentType='application/jsonl',
-            Key=key)
-
-        upload_id = mup_resp['UploadId']
-        log.debug(f'Initialized a multipart S3 upload. UploadId: {upload_id}')
-        #print(mup_resp)
-
-        part_id = 0
-
-        # Each loop we put together a "part" of the file and send it to S3.
-        while 1:
-            # init buffer
-            buff = io.BytesIO()
-            # Set up the ID for this particular part.
-            part_id += 1
-            # Inner loop lets us accumulate up to BYTES_PER_PART before
-            # sending off to S3.
-            while 1:
-                chunk = ''
-                if DELTA_MODE:
-                    entity_ids_idx += 1
-                    if entity_ids_idx == len(entity_ids):
-                        FETCH_COMPLETE = True
-                        log.info('All entities have been fetched.')
-                    else:
-                        current_entity_id = entity_ids[entity_ids_idx]
-                        log.debug(f'Fetching info for entity ID {current_entity_id} ...')
-                        try:
-                            # Ref: https://garage.senzing.com/sz-sdk-python/senzing.html#senzing.szengine.SzEngine.get_entity_by_entity_id
-                            #chunk = sz_eng.get_entity_by_entity_id(current_entity_id)
-                            chunk = sz_eng.get_entity_by_entity_id(current_entity_id, DELTA_EXPORT_FLAGS)
-                            buff.write(chunk.encode('utf-8'))
-                            buff.write("\n".encode('utf-8'))
-                            log.debug(f'Wrote data for entity {current_entity_id} to buffer.')
-                        except sz.SzNotFoundError as sz_not_found_err:
-                            log.debug(f'Entity {current_entity_id} has been deleted. Skipping.')
-                else:
+    # Progress gauges (see ExportProgress), for the export under way.
+    current = {'progress': ExportProgress(), 'uploads': []}
+    def writers():
+        return [upload['writer'] for upload in current['uploads']]
+    def estimated_bytes():
+        return sum(current['progress'].estimated_bytes(w.tell()) or 0 for w in writers()) or None
+    gauge_attrs = {'service': 'exporter', 'environment': RUNTIME_ENV}
+    otel.gauge(meter, 'exporter.export.entities_written',
+               lambda: current['progress'].entities_written, gauge_attrs)
+    otel.gauge(meter, 'exporter.export.estimated_entities',
+               lambda: current['progress'].estimated_entities, gauge_attrs)
+    otel.gauge(meter, 'exporter.export.bytes_written',
+               lambda: sum(w.tell() for w in writers()), gauge_attrs, unit='By')
+    otel.gauge(meter, 'exporter.export.estimated_bytes', estimated_bytes, gauge_attrs, unit='By')
+    otel.gauge(meter, 'exporter.export.parts',
+               lambda: sum(w.part_id for w in writers()), gauge_attrs)
+    otel.gauge(meter, 'exporter.export.part_size',
+               lambda: max((w.part_size for w in writers()), default=None), gauge_attrs, unit='By')
+
+    def export_once():
+        '''Runs one export; returns whether it succeeded.'''
+
+        # Retrieve output from sz, and stream it to S3 part by part.
+        log.info(SZ_TAG + 'Starting export from Senzing.')
+
+        start = time.perf_counter()
+        success_status = otel.FAILURE # initial default state
+
+        # For multipart S3 upload, S3 will hand back to us an etag for each
+        # part we upload to it. We need to accumulate the part IDs (which we
+        # set) and the etags (which S3 gives) and provide it all to S3 at the very
+        # end when wrapping up the upload. The uploader takes care of this (parts
+        # can finish uploading out of order).
+        # Each output object gets its own multipart upload (JSONL output is a
+        # single object; Parquet output is two), tracked here.
+        uploads = current['uploads'] = []
+        progress = current['progress'] = ExportProgress()
+
+        # Set for checkpointed exports (EXPORT_CHECKPOINT).
+        checkpointer = None
+        checkpoint_id = f'{FOLDER_NAME}/{EXPORT_MODE}'
+
+        def start_upload(obj_key, content_type, **kwargs):
+            '''Starts a multipart upload; returns the PartWriter to write it with.'''
+            mup_resp = s3.create_multipart_upload(
+                Bucket=S3_BUCKET_NAME,
+                ContentType=content_type,
+                Key=obj_key,
+                **kwargs)
+            upload_id = mup_resp['UploadId']
+            log.debug('Initialized a multipart S3 upload. UploadId: %s', upload_id)
+            return continue_upload(obj_key, upload_id)
+
+        def continue_upload(obj_key, upload_id, parts=(), on_uploaded=None):
+            '''Returns a PartWriter for the multipart upload upload_id, which
+            already has parts (a list of {'PartNumber', 'ETag'} maps).'''
+            uploader = multipart.PipelinedUploader(
+                s3, S3_BUCKET_NAME, obj_key, upload_id, num_threads=EXPORT_UPLOAD_THREADS,
+                stages=stages, parts=parts, on_uploaded=on_uploaded)
+            writer = multipart.PartWriter(
+                uploader, BYTES_PER_PART, first_part=len(parts) + 1,
+                sizer=multipart.PartSizer(BYTES_PER_PART, progress.estimated_bytes))
+            uploads.append({'Key': obj_key, 'UploadId': upload_id,
+                            'uploader': uploader, 'writer': writer})
+            return writer
+
+        def abort_uploads():
+            for upload in uploads:
+                if upload.get('completed'): continue
+                # Waits for parts already being uploaded, so none land after
+                # the upload is aborted.
+                upload['uploader'].abort()
+                if checkpointer:
+                    log.info('Leaving the multipart upload of %s in place; the next run will '
+                             'resume it from the checkpoint (%d entities).',
+                             upload['Key'], checkpointer.entities_written)
+                    continue
+                s3.abort_multipart_upload(
+                    Bucket=S3_BUCKET_NAME,
+                    Key=upload['Key'],
+                    UploadId=upload['UploadId'])
+
+        def discard_checkpoint(cp):
+            '''Aborts the checkpoint's multipart upload and deletes the checkpoint.'''
+            try:
+                s3.abort_multipart_upload(
+                    Bucket=S3_BUCKET_NAME,
+                    Key=cp['object_key'],
+                    UploadId=cp['upload_id'])
+            except Exception as e:
+                log.warning(AWS_TAG + 'Could not abort checkpointed upload. ' + fmterr(e))
+            db.delete_export_checkpoint(checkpoint_id)
+
+        def skip_to_checkpoint(cp, lines):
+            '''Consumes the entities that checkpoint cp already covers from lines;
+            returns whether the export lines up with the checkpoint (i.e., whether
+            the upload can be resumed).'''
+            try:
+                s3.list_parts(
+                    Bucket=S3_BUCKET_NAME,
+                    Key=cp['object_key'],
+                    UploadId=cp['upload_id'],
+                    MaxParts=1)
+            except Exception as e:
+                log.warning(AWS_TAG + 'Checkpointed upload is no longer available. ' + fmterr(e))
+                return False
+            line = None
+            for _, line in zip(range(cp['entities_written']), lines):
+                pass
+            if cp['entities_written'] and (line is None or jsonlib.get_entity_id(line) != cp['last_entity_id']):
+                # Entities have been added or removed since the checkpoint.
+                log.warning('Senzing export no longer matches the checkpoint '
+                            + f'(entity {cp["entities_written"]} was ID {cp["last_entity_id"]}).')
+                return False
+            return True
+
+        def entity_lines():
+            '''Generator function; emits the exported entities, one JSONL line
+            (a JSON document for a single entity) at a time.'''
+            if entities is not None:
+                for current_entity_id, doc in entities:
+                    if hashes and hashes.unchanged(current_entity_id, doc):
+                        log.debug('Entity %s is unchanged; leaving it out.', current_entity_id,
+                                  extra={'entity_id': current_entity_id})
+                        continue
+                    if doc is not None:
+                        log.debug('Fetched data for entity %s.', current_entity_id,
+                                  extra={'entity_id': current_entity_id})
+                        yield doc + '\n'
+            else:
+                while 1:
                     log.debug(SZ_TAG + 'Fetching chunk...')
-                    chunk = sz_eng.fetch_next(export_handle)
+                    with stages.time('sz_fetch'):
+                        chunk = sz_eng.fetch_next(export_handle)
                     if not chunk:
-                        FETCH_COMPLETE = True
                         log.info('Fetch from Senzing complete.')
-                    else:
-                        buff.write(chunk.encode('utf-8'))
-                        log.debug('Wrote chunk to buffer.')
-                # Send this part to S3, and save the etag it gives us back.
-                if buff.getbuffer().nbytes >= BYTES_PER_PART or FETCH_COMPLETE:
-                    log.debug(f'Preparing and uploading part {part_id} to S3.')
-                    # rewind to start of buff
-                    buff.seek(0)
-                    buff.flush()
-                    resp = s3.upload_part(
-                        Bucket=S3_BUCKET_NAME,
-                        Key=key,
-                        UploadId=upload_id,
-                        PartNumber=part_id,
-                        Body=buff.read())
-                    log.debug(f'Sent part {part_id} to S3. ETag: {resp["ETag"]}')
-                    part_ids_and_tags.append({
-                        'PartNumber': part_id,
-                        'ETag': resp['ETag']})
-                    # We start with a new buff obj at next iteration.
-                    buff.close()
-                    break
-            # end inner while
-            if FETCH_COMPLETE:
-                break
-        # end outer while
-
-        if DELTA_MODE:
-            pass
+                        return
+                    yield chunk
+
+        if SHARDED:
+            key = (FOLDER_NAME + '/' + EXPORT_RUN_ID + '/'
+                   + build_output_filename(f'exporter-output-shard-{EXPORT_SHARD_INDEX:04d}'))
         else:
-            sz_eng.close_export_report(export_handle)
-            log.info(SZ_TAG + 'Closed Senzing export handle.')
-        # Wrap up the S3 upload via complete_multipart_upload
-        rslt = s3.complete_multipart_upload(
-            Bucket=S3_BUCKET_NAME,
-            Key=key,
-            MultipartUpload={'Parts':part_ids_and_tags},
-            UploadId=upload_id)
-        log.info('Finished uploading all parts to S3. All done.')
-        log.info(f'Full path in S3: {key}')
-
-        if DELTA_MODE:
-            log.info('Current export tracker table state: ' + str(db.get_tallies()))
-            log.info('Shifting export-tracker entity IDs from IN PROGRESS to DONE ...')
-            db.shift_in_progress_to_done(export_id=key)
-            log.info('Export tracker table AFTER shift to DONE: ' + str(db.get_tallies()))
-
-        success_status = otel.SUCCESS
-
-    except sz.SzError as err:
-        log.error(SZ_TAG + fmterr(err))
-        if upload_id:
-            s3.abort_multipart_upload(
-                Bucket=S3_BUCKET_NAME,
-                Key=key,
-                UploadId=upload_id)
-        if db_has_in_progress_rows:
-            db.rewind_in_progress_to_todo()
-    except Exception as e:
-        log.error(fmterr(e))
-        if upload_id:
-            s3.abort_multipart_upload(
-                Bucket=S3_BUCKET_NAME,
-                Key=key,
-                UploadId=upload_id)
-        if db_has_in_progress_rows:
-            db.rewind_in_progress_to_todo()
-
-    finally:
-        finish = time.perf_counter()
-        otel_exp_counter.add(1,
-            {'status': success_status,
-            'service': 'exporter',
-            'environment': RUNTIME_ENV})
-        otel_duration.record(finish - start,
-            {'status':  success_status,
-             'service': 'exporter',
-             'environment': RUNTIME_ENV})
+            key = FOLDER_NAME + '/' + build_output_filename()
+
+        # Specific to delta mode:
+        db_has_in_progress_rows = False
+        # (Delta mode and sharded full mode) Fetched (entity ID, JSON) pairs.
+        entities = None
+        # (Delta mode) Tells apart unchanged entities, if EXPORT_SKIP_UNCHANGED.
+        hashes = None
+        # (Delta mode) Keeps this run's claims from expiring.
+        lease_renewer = None
+        # Identifies this run's claims in the export tracker.
+        claim_owner = f'{socket.gethostname()}-{os.getpid()}-{ts()}'
+        try:
+
+            if DELTA_MODE:
+                tallies = db.get_tallies()
+                log.info('Export tracker table before doing anything: ' + str(tallies))
+                log.info(f'Claiming export-tracker entity IDs as {claim_owner} '
+                         + f'(chunks of {EXPORT_CLAIM_CHUNK_SIZE}, lease {EXPORT_LEASE_SECONDS} sec.) ...')
+                claim_limit = tallies['TODO'] + tallies['IN PROGRESS']
+                if EXPORT_MAX_ENTITIES_PER_RUN:
+                    claim_limit = min(claim_limit, EXPORT_MAX_ENTITIES_PER_RUN)
+                lease_renewer = LeaseRenewer(claim_owner)
+                if EXPORT_SKIP_UNCHANGED:
+                    hashes = ContentHashes(claim_owner, stages)
+                    entities = fetch_entities(
+                        claim_entity_ids(claim_owner, stages, claim_limit, hashes.claimed))
+                else:
+                    entities = fetch_entities(claim_entity_ids(claim_owner, stages, claim_limit))
+                db_has_in_progress_rows = True
+                lines = entity_lines()
+                if EXPORT_FETCH_WORKERS > 1:
+                    log.info(f'Fetching entities with {EXPORT_FETCH_WORKERS} threads ('
+                             + ('ordered' if EXPORT_FETCH_ORDERED else 'unordered') + ').')
+            elif SHARDED:
+                # Senzing's export can't be split, so shards fetch their entities
+                # one by one, as delta mode does.
+                log.info(f'Exporting shard {EXPORT_SHARD_INDEX} of {EXPORT_SHARDS} '
+                         + f'(run {EXPORT_RUN_ID}) to {key} ...')
+                with stages.time('tracker_read'):
+                    shard_expected = db.count_shard_entity_ids(EXPORT_SHARD_INDEX, EXPORT_SHARDS)
+                entities = fetch_entities(shard_entity_ids(stages))
+                lines = entity_lines()
+                tallies = db.get_tallies()
+            else:
+                tallies = db.get_tallies()
+                export_handle = sz_eng.export_json_entity_report(FULL_EXPORT_FLAGS)
+                log.info(SZ_TAG + 'Obtained export_json_entity_report handle.')
+                lines = entity_lines()
+                if EXPORT_CHECKPOINT:
+                    lines = split_lines(lines)
+                    cp = db.get_export_checkpoint(checkpoint_id)
+                    if cp:
+                        log.info(f'Found checkpoint for {cp["object_key"]}: {len(cp["parts"])} '
+                                 + f'part(s), {cp["entities_written"]} entities.')
+                    if cp and cp['compression'] != EXPORT_COMPRESSION:
+                        log.warning('Checkpoint was made with a different EXPORT_COMPRESSION.')
+                        discard_checkpoint(cp)
+                        cp = None
+                    elif cp and not skip_to_checkpoint(cp, lines):
+                        discard_checkpoint(cp)
+                        cp = None
+                        sz_eng.close_export_report(export_handle)
+                        export_handle = sz_eng.export_json_entity_report(FULL_EXPORT_FLAGS)
+                        lines = split_lines(entity_lines())
+
+            progress.estimated_entities = estimate_entity_count(tallies)
+            if EXPORT_CHECKPOINT and cp and progress.estimated_entities:
+                progress.estimated_entities = max(
+                    progress.estimated_entities - cp['entities_written'], 0) or None
+            log.info(f'Expecting about {progress.estimated_entities} entities.')
+
+            compressor = None
+            parquet_writer = None
+            if EXPORT_FORMAT == 'parquet':
+                base, ext = key.rsplit('.', 1)
+                parquet_writer = parquet_export.ParquetExportWriter(
+                    start_upload(f'{base}-entities.{ext}', PARQUET_CONTENT_TYPE),
+                    start_upload(f'{base}-records.{ext}', PARQUET_CONTENT_TYPE),
+                    compression=EXPORT_COMPRESSION,
+                    row_group_size=EXPORT_PARQUET_ROW_GROUP_SIZE)
+            else:
+                compressor = make_compressor()
+                mup_args = {}
+                if COMPRESSION_INFO[EXPORT_COMPRESSION][0]:
+                    mup_args['ContentEncoding'] = COMPRESSION_INFO[EXPORT_COMPRESSION][0]
+                if EXPORT_CHECKPOINT and cp:
+                    log.info(f'Resuming export of {cp["object_key"]}.')
+                    checkpointer = Checkpointer(
+                        checkpoint_id, cp['object_key'], cp['upload_id'], cp['parts'],
+                        cp['entities_written'], cp['last_entity_id'])
+                    out = continue_upload(cp['object_key'], cp['upload_id'], cp['parts'],
+                                          on_uploaded=checkpointer.part_uploaded)
+                elif EXPORT_CHECKPOINT:
+                    out = start_upload(key, 'application/jsonl', **mup_args)
+                    new_checkpointer = Checkpointer(checkpoint_id, key, uploads[-1]['UploadId'])
+                    new_checkpointer.save()
+                    uploads[-1]['uploader'].on_uploaded = new_checkpointer.part_uploaded
+                    checkpointer = new_checkpointer
+                else:
+                    out = start_upload(key, 'application/jsonl', **mup_args)
+                if checkpointer:
+                    # Parts are cut between entities (see below) instead.
+                    out.auto_cut = False
+                    entities_written = checkpointer.entities_written
+
+            # Filled parts are sent off to S3 by the PartWriter(s) as we go.
+            for line in lines:
+                if parquet_writer:
+                    # A full-export chunk can hold more than one entity.
+                    with stages.time('serialize'):
+                        for doc in line.splitlines():
+                            if doc: parquet_writer.add(doc)
+                    progress.entities_written = parquet_writer.num_entities
+                else:
+                    with stages.time('serialize'):
+                        data = line.encode('utf-8')
+                        if compressor: data = compressor.compress(data)
+                    out.write(data)
+                    # Unless re-cut into lines (checkpointed exports), a
+                    # full-export chunk can hold more than one entity.
+                    progress.entities_written += 1 if checkpointer else line.count('\n')
+                    if checkpointer:
+                        entities_written += 1
+                        if out.full():
+                            # End the compressed stream at the part boundary, so
+                            # that a resumed export can start a new one there.
+                            if compressor:
+                                out.write(compressor.flush())
+                                compressor = make_compressor()
+                            checkpointer.part_cut(out.part_id + 1, entities_written,
+                                                  jsonlib.get_entity_id(line))
+                            out.cut()
+            log.info('All entities have been fetched.')
+            if parquet_writer:
+                parquet_writer.close()
+                log.info(f'Wrote {parquet_writer.num_entities} entities and '
+                         + f'{parquet_writer.num_records} records as Parquet.')
+            elif compressor:
+                out.write(compressor.flush())
+
+            if DELTA_MODE or SHARDED:
+                pass
+            else:
+                sz_eng.close_export_report(export_handle)
+                log.info(SZ_TAG + 'Closed Senzing export handle.')
+
+            for upload in uploads:
+                upload['writer'].close()
+                # Wait for the remaining parts, then wrap up the S3 upload via
+                # complete_multipart_upload
+                part_ids_and_tags = upload['uploader'].finish()
+                rslt = s3.complete_multipart_upload(
+                    Bucket=S3_BUCKET_NAME,
+                    Key=upload['Key'],
+                    MultipartUpload={'Parts':part_ids_and_tags},
+                    UploadId=upload['UploadId'])
+                upload['completed'] = True
+                log.info(f'Full path in S3: {upload["Key"]} ({upload["writer"].tell()} bytes, '
+                         + f'{len(part_ids_and_tags)} parts)')
+            log.info('Finished uploading all parts to S3. All done.')
+            if checkpointer:
+                db.delete_export_checkpoint(checkpoint_id)
+
+            if SHARDED:
+                shards = [x for x in db.record_export_shard(
+                              EXPORT_RUN_ID, EXPORT_SHARD_INDEX, EXPORT_SHARDS,
+                              [upload['Key'] for upload in uploads], progress.entities_written,
+                              shard_expected)
+                          if x['shard_count'] == EXPORT_SHARDS]
+                log.info(f'Shard {EXPORT_SHARD_INDEX} wrote {progress.entities_written} entities; '
+                         + f'{len(shards)} of {EXPORT_SHARDS} shards of run {EXPORT_RUN_ID} are done.')
+                if len(shards) == EXPORT_SHARDS:
+                    # Entities added, merged or removed while the shards ran
+                    # make the two differ; the manifest records both.
+                    written = sum(x['entities_written'] for x in shards)
+                    expected = sum(x['entities_expected'] for x in shards)
+                    if written != expected:
+                        log.warning(f'Shards of run {EXPORT_RUN_ID} wrote {written} entities; '
+                                    + f'{expected} were expected when they started.')
+                    log.info('Wrote manifest: ' + write_manifest(s3, shards))
+
+            if DELTA_MODE:
+                log.info('Current export tracker table state: ' + str(db.get_tallies()))
+                log.info('Shifting claimed export-tracker entity IDs from IN PROGRESS to DONE ...')
+                if hashes:
+                    hashes.flush()
+                    log.info(f'Left out {hashes.num_unchanged} unchanged entities.')
+                    otel_unchanged_counter.add(hashes.num_unchanged, otel_attrs[otel.SUCCESS])
+                with stages.time('tracker_write'):
+                    db.shift_claimed_to_done(claim_owner, export_id=uploads[0]['Key'])
+                log.info('Export tracker table AFTER shift to DONE: ' + str(db.get_tallies()))
+
+            success_status = otel.SUCCESS
+
+        except sz.SzError as err:
+            log.error(SZ_TAG + fmterr(err))
+            abort_uploads()
+            if db_has_in_progress_rows:
+                db.release_claimed(claim_owner)
+        except Exception as e:
+            log.error(fmterr(e))
+            abort_uploads()
+            if db_has_in_progress_rows:
+                db.release_claimed(claim_owner)
+
+        finally:
+            if lease_renewer:
+                lease_renewer.stop()
+            finish = time.perf_counter()
+            otel_exp_counter.add(1, otel_attrs[success_status])
+            otel_duration.record(finish - start, otel_attrs[success_status])
+
+        return success_status == otel.SUCCESS
+
+    if EXPORT_DAEMON:
+        run_daemon(export_once, refresh_sz_config)
+        return True
+    return export_once()
 
 #-------------------------------------------------------------------------------
 
@@ -279,6 +985,10 @@ def main():
     log.info('     EXPORTER')
     log.info('     *STARTED*')
     log.info('====================')
+    if SHARDED and EXPORT_SHARD_INDEX is None:
+        sys.exit(0 if run_shards() else 1)
+    elif SHARDED:
+        sys.exit(0 if go() else 1)
     go()
 
 if __name__ == '__main__': main()
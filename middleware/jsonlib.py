@@ -0,0 +1,91 @@
+import json
+import re
+
+from loglib import *
+log = retrieve_logger()
+
+# Uses orjson when it's installed (it's several times faster than the stdlib
+# json module); otherwise falls back to the stdlib.
+try:
+    import orjson
+    BACKEND = 'orjson'
+except ImportError:
+    orjson = None
+    BACKEND = 'json'
+log.debug(f'JSON backend is: {BACKEND}')
+
+def loads(s):
+    '''Parses a JSON str (or bytes).'''
+    if orjson: return orjson.loads(s)
+    return json.loads(s)
+
+def dumps(obj):
+    '''Returns obj as compact JSON (str).'''
+    if orjson: return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, separators=(',', ':'))
+
+#-------------------------------------------------------------------------------
+# Fast paths: pulling a few fields out of a document without parsing all of it.
+# These only take the shortcut when the answer is unambiguous, and otherwise
+# fall back to a full parse, so they always agree with loads.
+
+_str_field_res = {}
+
+def _str_field_re(key):
+    if key not in _str_field_res:
+        _str_field_res[key] = re.compile(
+            r'(?<!\\)"' + re.escape(key) + r'"\s*:\s*"((?:[^"\\]|\\.)*)"')
+    return _str_field_res[key]
+
+_json_str_re = re.compile(r'"(?:[^"\\]|\\.)*"')
+
+def _top_level_str_field(doc, key):
+    '''Returns the str value of key in the top-level object of doc, or None if
+    that can't be determined without a full parse.'''
+    matches = list(_str_field_re(key).finditer(doc))
+    if len(matches) != 1: return None
+    m = matches[0]
+    # Make sure it belongs to the top-level object, not a nested one. Brackets
+    # inside str values would throw the count off, so give up if there are any.
+    before = doc[:m.start()]
+    depth = (before.count('{') + before.count('[')
+             - before.count('}') - before.count(']'))
+    if depth != 1: return None
+    if any(c in s for s in _json_str_re.findall(before) for c in '{}[]'): return None
+    v = m.group(1)
+    if '\\' in v: v = json.loads('"' + v + '"')
+    return v
+
+def get_str_fields(doc, keys):
+    '''Returns a tuple of the (str) values of keys in the top-level object of
+    the JSON document doc. Raises KeyError if a key is missing.'''
+    out = []
+    for key in keys:
+        v = _top_level_str_field(doc, key)
+        if v is None:
+            d = loads(doc)
+            return tuple(d[k] for k in keys)
+        out.append(v)
+    return tuple(out)
+
+_affected_re = re.compile(r'"AFFECTED_ENTITIES"\s*:\s*\[([^\[\]]*)\]')
+_entity_id_re = re.compile(r'"ENTITY_ID"\s*:\s*(\d+)')
+
+def get_affected_entity_ids(resp):
+    '''Returns the entity IDs (ints) listed under AFFECTED_ENTITIES in a
+    Senzing WITH_INFO response.'''
+    m = _affected_re.findall(resp)
+    if len(m) == 1:
+        ids = _entity_id_re.findall(m[0])
+        if len(ids) == m[0].count('{'):
+            return [int(x) for x in ids]
+    return [x['ENTITY_ID'] for x in loads(resp)['AFFECTED_ENTITIES']]
+
+_entity_id_head_re = re.compile(r'\s*\{\s*"RESOLVED_ENTITY"\s*:\s*\{\s*"ENTITY_ID"\s*:\s*(\d+)\s*[,}]')
+
+def get_entity_id(doc):
+    '''Returns the ENTITY_ID (int) of the resolved entity in a Senzing entity
+    JSON document.'''
+    m = _entity_id_head_re.match(doc)
+    if m: return int(m.group(1))
+    return loads(doc)['RESOLVED_ENTITY']['ENTITY_ID']
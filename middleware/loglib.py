@@ -1,5 +1,9 @@
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
 import sys
 
 AWS_TAG =   '[AWS] '
@@ -10,6 +14,68 @@ _instantiated_loggers = {}
 
 LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
 
+# 'text' (the default) or 'json' (one JSON object per line).
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+
+# When set to 1, logging calls only put the (unformatted) record on a queue; a
+# background thread formats and writes it. Pass values as logging args (e.g.,
+# log.debug('Got %s', x)) rather than pre-building the string, so that nothing
+# is formatted for levels that are off.
+LOG_ASYNC = int(os.environ.get('LOG_ASYNC', 0))
+
+# Structured fields that can be attached to a log record via `extra`, e.g.
+# log.debug('...', extra={'receipt_handle': rh}); they're included in JSON
+# output.
+LOG_FIELDS = ('receipt_handle', 'data_source', 'record_id', 'entity_id',
+              'entity_count', 'export_id')
+
+_TEXT_FORMAT = '[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)s] %(message)s'
+
+class JsonFormatter(logging.Formatter):
+    '''Formats a record as a single-line JSON object.'''
+
+    def format(self, record):
+        out = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'file': record.filename,
+            'line': record.lineno,
+            'msg': record.getMessage()}
+        for field in LOG_FIELDS:
+            if hasattr(record, field): out[field] = getattr(record, field)
+        if record.exc_info:
+            out['exc'] = self.formatException(record.exc_info)
+        return json.dumps(out, default=str)
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    '''QueueHandler that leaves formatting to the listener's thread. (The
+    stock prepare() formats the message in the calling thread.)'''
+
+    def prepare(self, record):
+        return record
+
+_listener = None
+
+def _make_stream_handler():
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(_TEXT_FORMAT))
+    return handler
+
+def _make_handler():
+    global _listener
+    if not LOG_ASYNC:
+        return _make_stream_handler()
+    # All loggers share one queue and one writer thread.
+    if _listener is None:
+        _listener = logging.handlers.QueueListener(queue.SimpleQueue(), _make_stream_handler())
+        _listener.start()
+        # Write out whatever is still queued at exit.
+        atexit.register(_listener.stop)
+    return _DeferredQueueHandler(_listener.queue)
+
 def retrieve_logger(tag='default'):
     global _instantiated_loggers
     if tag in _instantiated_loggers:
@@ -17,12 +83,7 @@ def retrieve_logger(tag='default'):
     else:
         x = logging.getLogger(tag)
         x.setLevel(LOG_LEVEL)
-        handler = logging.StreamHandler()
-        fmt = logging.Formatter(
-            '[%(asctime)s] [%(levelname)s] ' \
-            '[%(filename)s:%(lineno)s] %(message)s')
-        handler.setFormatter(fmt)
-        x.addHandler(handler)
+        x.addHandler(_make_handler())
         _instantiated_loggers[tag] = x
         return x
 
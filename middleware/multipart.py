@@ -0,0 +1,218 @@
+import io
+import queue
+import threading
+import time
+
+from loglib import *
+log = retrieve_logger()
+
+# S3 multipart upload limits.
+# Ref: https://docs.aws.amazon.com/AmazonS3/latest/userguide/qfacts.html
+MAX_PARTS = 10000
+MIN_PART_SIZE = 5 * 1024 ** 2
+MAX_PART_SIZE = 5 * 1024 ** 3
+
+class PartSizer:
+    '''Picks the size of each part of a multipart upload, so that objects of
+    any size fit in S3's 10,000 parts while small ones still use small parts
+    (a part is held in memory while it fills and uploads).
+
+    Parts are min_part_size, unless estimate -- a function of the bytes
+    written so far, returning the number of bytes expected in all, or None --
+    says that would take more than PLANNED_PARTS parts, in which case
+    they're made big enough to fit the rest of the estimate into what's left of
+    PLANNED_PARTS. Past PLANNED_PARTS (i.e., if the estimate was too low), part
+    sizes double every GROW_EVERY parts, which takes 10 MB parts past the 5 TB
+    object size limit.'''
+
+    PLANNED_PARTS = MAX_PARTS // 2
+    GROW_EVERY = 500
+
+    def __init__(self, min_part_size, estimate=None):
+        self.min_part_size = max(min_part_size, MIN_PART_SIZE)
+        self.estimate = estimate
+
+    def size(self, part_number, bytes_so_far):
+        '''Size of part part_number, given bytes_so_far in the parts before it.'''
+        size = self.min_part_size
+        estimated = self.estimate(bytes_so_far) if self.estimate else None
+        if estimated and part_number <= self.PLANNED_PARTS:
+            parts_left = self.PLANNED_PARTS - part_number + 1
+            size = max(size, -(-(estimated - bytes_so_far) // parts_left))
+        elif part_number > self.PLANNED_PARTS:
+            size *= 2 ** ((part_number - self.PLANNED_PARTS - 1) // self.GROW_EVERY + 1)
+        # Round up to whole MiB.
+        size = -(-size // 1024 ** 2) * 1024 ** 2
+        return min(size, MAX_PART_SIZE)
+
+class PipelinedUploader:
+    '''Uploads the parts of an S3 multipart upload from background threads, so
+    the caller can keep filling the next part while earlier ones upload.
+
+    Parts are handed over as (already filled) file-like buffers, which are
+    passed to upload_part as-is -- no extra copies -- and closed once
+    uploaded. At most max_queued parts wait for a free thread; submit blocks
+    beyond that, which bounds memory use. Parts can finish in any order;
+    finish() returns them sorted by part number, ready for
+    complete_multipart_upload.
+
+    With num_threads of 0, submit uploads the part inline.
+    If stages (an otel.StageTimings) is given, upload_part calls are timed as
+    stage upload_part, and time spent blocked handing over parts as stage
+    upload_wait.
+    To continue an upload started earlier (e.g., by a previous run), pass the
+    parts it already has as parts ({'PartNumber', 'ETag'} maps). If given,
+    on_uploaded(part_number, etag) is called (from the uploading thread) as
+    each part finishes.'''
+
+    def __init__(self, s3, bucket, key, upload_id, num_threads=2, max_queued=None,
+                 stages=None, parts=None, on_uploaded=None):
+        self.s3 = s3
+        self.stages = stages
+        self.bucket = bucket
+        self.key = key
+        self.upload_id = upload_id
+        self.on_uploaded = on_uploaded
+        self._etags = {p['PartNumber']: p['ETag'] for p in parts or []}
+        self._lock = threading.Lock()
+        self._error = None
+        self._q = queue.Queue(maxsize=max_queued or max(num_threads, 1))
+        self._threads = [
+            threading.Thread(target=self._run, name=f'uploader-{n}', daemon=True)
+            for n in range(num_threads)]
+        for t in self._threads: t.start()
+
+    def submit(self, part_number, buff):
+        '''Queues buff (rewound here) for upload as part_number. Re-raises the
+        error of any earlier part that failed to upload.'''
+        self._raise_if_failed()
+        buff.seek(0)
+        if self._threads:
+            start = time.perf_counter()
+            self._q.put((part_number, buff))
+            if self.stages: self.stages.record('upload_wait', time.perf_counter() - start)
+        else:
+            self._upload(part_number, buff)
+
+    def finish(self):
+        '''Waits for all queued parts to upload; returns the list of
+        {'PartNumber', 'ETag'} maps, sorted by part number.'''
+        for _ in self._threads: self._q.put(None)
+        for t in self._threads: t.join()
+        self._threads = []
+        self._raise_if_failed()
+        with self._lock:
+            return [{'PartNumber': n, 'ETag': self._etags[n]} for n in sorted(self._etags)]
+
+    def abort(self):
+        '''Drops any parts not yet uploaded, and waits for the threads to
+        finish the uploads already under way -- so that, once it returns, no
+        more parts can land (e.g., after abort_multipart_upload).'''
+        try:
+            while 1:
+                item = self._q.get_nowait()
+                if item is not None: item[1].close()
+        except queue.Empty:
+            pass
+        for _ in self._threads: self._q.put(None)
+        for t in self._threads: t.join()
+        self._threads = []
+
+    def _raise_if_failed(self):
+        if self._error is not None: raise self._error
+
+    def _upload(self, part_number, buff):
+        log.debug('Uploading part %d to S3.', part_number)
+        start = time.perf_counter()
+        resp = self.s3.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=buff)
+        if self.stages: self.stages.record('upload_part', time.perf_counter() - start)
+        buff.close()
+        log.debug('Sent part %d to S3. ETag: %s', part_number, resp['ETag'])
+        with self._lock:
+            self._etags[part_number] = resp['ETag']
+        if self.on_uploaded: self.on_uploaded(part_number, resp['ETag'])
+
+    def _run(self):
+        while 1:
+            item = self._q.get()
+            if item is None: return
+            if self._error is not None: continue
+            try:
+                self._upload(*item)
+            except Exception as e:
+                log.error(AWS_TAG + f'Upload of part {item[0]} failed. ' + fmterr(e))
+                self._error = e
+
+class PartWriter:
+    '''Write-only file-like object that cuts whatever is written to it into
+    parts of (at least) part_size bytes and hands them to a
+    PipelinedUploader as they fill up. close() sends the last part.
+
+    With auto_cut=False, parts are only cut when the caller calls cut() (e.g.,
+    at a record boundary, once full() says so). Part numbers start at
+    first_part. If sizer (a PartSizer) is given, it sets part_size for each
+    part.'''
+
+    def __init__(self, uploader, part_size, auto_cut=True, first_part=1, sizer=None):
+        self.uploader = uploader
+        self.part_size = part_size
+        self.auto_cut = auto_cut
+        self.part_id = first_part - 1
+        self.sizer = sizer
+        self.closed = False
+        self._buff = io.BytesIO()
+        self._total = 0
+        self._resize()
+
+    def write(self, data):
+        n = self._buff.write(data)
+        self._total += n
+        if self.auto_cut and self.full():
+            self._submit()
+        return n
+
+    def full(self):
+        '''Whether the current part has reached part_size.'''
+        return self._buff.tell() >= self.part_size
+
+    def cut(self):
+        '''Sends what's been written since the last cut as the next part (if
+        anything has); returns the part number of the last part sent.'''
+        if self._buff.tell(): self._submit()
+        return self.part_id
+
+    def tell(self):
+        '''Total bytes written so far.'''
+        return self._total
+
+    def _resize(self):
+        if not self.sizer: return
+        size = self.sizer.size(self.part_id + 1, self._total - self._buff.tell())
+        if size != self.part_size:
+            log.debug('Part size is now %.0f MiB (from part %d).', size / 1024 ** 2, self.part_id + 1)
+            self.part_size = size
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed: return
+        # S3 requires at least one part, even if it's empty.
+        if self._buff.tell() or not self.part_id:
+            self._submit()
+        self.closed = True
+
+    def _submit(self):
+        self.part_id += 1
+        log.debug('Queueing part %d for upload to S3.', self.part_id)
+        self.uploader.submit(self.part_id, self._buff)
+        self._buff = io.BytesIO()
+        self._resize()
@@ -4,6 +4,8 @@
 #  https://opentelemetry.io/docs/languages/sdk-configuration/otlp-exporter/
 
 import os
+import threading
+import time
 
 from opentelemetry.sdk.resources import SERVICE_NAME, Resource
 from opentelemetry import metrics
@@ -14,17 +16,45 @@ from opentelemetry.sdk.metrics.export import (
 from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
 
 from opentelemetry.sdk.metrics import Histogram
+from opentelemetry.sdk.metrics.view import View, ExplicitBucketHistogramAggregation
 from opentelemetry.sdk.metrics.export import AggregationTemporality
 # See: https://docs.datadoghq.com/opentelemetry/guide/otlp_delta_temporality/?tab=python
 
 INTERVAL_MS = 30000
 
+# Set to 0 to turn metrics off altogether (init then returns None, and the
+# instruments below are no-ops).
+ENABLE_OTEL_EMITS = int(os.environ.get('ENABLE_OTEL_EMITS', 1))
+
+# Low-overhead mode (the default): increments made through counter() are
+# summed locally and reported to the OTel SDK only when the metric reader
+# collects. Set to 0 to have every increment go straight to the SDK.
+# (Histograms always go straight to the SDK, which keeps bucket counts rather
+# than samples.)
+OTEL_LOCAL_AGGREGATION = int(os.environ.get('OTEL_LOCAL_AGGREGATION', 1))
+
 TEMPORALITY = {
     Histogram: AggregationTemporality.DELTA
 }
 
+# Bucket boundaries (seconds) for the per-stage latency histograms: stages
+# range from sub-millisecond (parsing a message) to many minutes (a stalled
+# Senzing call), so the buckets run roughly logarithmically from 100 us to
+# 30 min. (The SDK's default buckets are meant for milliseconds and top out
+# at 10 s.)
+STAGE_BUCKETS_SECONDS = (
+    0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5,
+    1, 2.5, 5,
+    10, 30, 60,
+    120, 300, 600, 1800)
+
 def init(service_name):
-    '''Perform general OTel setup and return meter obj.'''
+    '''Perform general OTel setup and return meter obj (None if
+    ENABLE_OTEL_EMITS is off).'''
+    if not ENABLE_OTEL_EMITS: return None
     resource = Resource.create(attributes={SERVICE_NAME: service_name})
     if os.getenv('OTEL_USE_OTLP_EXPORTER', 'false').lower() == 'true':
         metric_reader = PeriodicExportingMetricReader(
@@ -34,8 +64,12 @@ def init(service_name):
         metric_reader = PeriodicExportingMetricReader(
             ConsoleMetricExporter(preferred_temporality=TEMPORALITY),
             export_interval_millis=INTERVAL_MS)
+    stage_view = View(
+        instrument_name='*.stage.duration',
+        aggregation=ExplicitBucketHistogramAggregation(STAGE_BUCKETS_SECONDS))
     meter_provider = MeterProvider(resource=resource,
-                                   metric_readers=[metric_reader])
+                                   metric_readers=[metric_reader],
+                                   views=[stage_view])
 
     # Set the global default meter provider:
     metrics.set_meter_provider(meter_provider)
@@ -46,3 +80,118 @@ def init(service_name):
 SUCCESS = 'success'
 FAILURE = 'failure'
 UNKNOWN = 'unknown'
+
+def status_attributes(service_name, runtime_env):
+    '''Returns a map of status -> attribute set for the given service, so
+    that attribute dicts are built once rather than per measurement.'''
+    return {status: {'status': status, 'service': service_name, 'environment': runtime_env}
+            for status in (SUCCESS, FAILURE, UNKNOWN)}
+
+#-------------------------------------------------------------------------------
+# Instruments
+#
+# Use counter() / histogram() rather than meter.create_counter /
+# meter.create_histogram; the returned objects have the same add / record
+# methods. Attribute sets should be built once and reused (see
+# status_attributes): locally summed counters are keyed by the identity of
+# their attribute dict.
+
+class _LocalCounter:
+    '''Counter that keeps its running totals (per attribute set) in-process;
+    an observable counter reports them to the SDK whenever the metric reader
+    collects, so there's nothing to flush on a timer of its own.'''
+
+    __slots__ = ('_lock', '_totals')
+
+    def __init__(self, meter, name, **kwargs):
+        # Re-entrant, since increments can be made from signal handlers
+        # (e.g., the SIGALRM call timeout) that interrupt the main thread.
+        self._lock = threading.RLock()
+        self._totals = {}  # attrs id -> [attrs, total]
+        meter.create_observable_counter(name, callbacks=[self._observe], **kwargs)
+
+    def add(self, amount, attributes=None):
+        key = id(attributes)
+        with self._lock:
+            entry = self._totals.get(key)
+            if entry: entry[1] += amount
+            else: self._totals[key] = [attributes, amount]
+
+    def _observe(self, options):
+        with self._lock:
+            return [metrics.Observation(total, attributes)
+                    for attributes, total in self._totals.values()]
+
+class _NoOpInstrument:
+    def add(self, amount, attributes=None): pass
+    def record(self, amount, attributes=None): pass
+
+_NO_OP = _NoOpInstrument()
+
+def counter(meter, name, **kwargs):
+    if meter is None: return _NO_OP
+    if OTEL_LOCAL_AGGREGATION: return _LocalCounter(meter, name, **kwargs)
+    return meter.create_counter(name, **kwargs)
+
+def histogram(meter, name, **kwargs):
+    if meter is None: return _NO_OP
+    return meter.create_histogram(name, **kwargs)
+
+def gauge(meter, name, get_value, attributes=None, **kwargs):
+    '''Registers an observable gauge reporting get_value() (unless it returns
+    None) whenever metrics are collected. Does nothing with meter None.'''
+    if meter is None: return
+    def callback(options):
+        value = get_value()
+        return [] if value is None else [metrics.Observation(value, attributes)]
+    meter.create_observable_gauge(name, callbacks=[callback], **kwargs)
+
+class StageTimings:
+    '''Per-stage latency surface shared by the services: a single
+    `<service>.stage.duration` histogram (seconds), broken down by a `stage`
+    attribute -- e.g., sqs_receive, json_parse, sz_call, tracker_write,
+    sqs_ack. Attribute sets are built once per stage and reused.
+    With meter None (e.g., OTel emits turned off), recording is a no-op.'''
+
+    def __init__(self, meter, service_name, runtime_env):
+        self.service_name = service_name
+        self.runtime_env = runtime_env
+        self._attrs = {}
+        self._hist = None
+        if meter:
+            self._hist = histogram(
+                meter,
+                service_name + '.stage.duration',
+                unit='s',
+                description='Time spent in each stage of processing')
+
+    def _attrs_for(self, stage):
+        attrs = self._attrs.get(stage)
+        if attrs is None:
+            attrs = self._attrs[stage] = {
+                'stage': stage,
+                'service': self.service_name,
+                'environment': self.runtime_env}
+        return attrs
+
+    def record(self, stage, seconds):
+        if self._hist: self._hist.record(seconds, self._attrs_for(stage))
+
+    def time(self, stage):
+        '''Context manager; records the time spent in the with-block.'''
+        return _StageTimer(self, stage)
+
+class _StageTimer:
+    __slots__ = ('timings', 'stage', 'start')
+
+    def __init__(self, timings, stage):
+        self.timings = timings
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings.record(self.stage, time.perf_counter() - self.start)
+        return False
@@ -0,0 +1,91 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from loglib import *
+log = retrieve_logger()
+
+import jsonlib
+
+# Exporter's Parquet output is two tables: one row per entity, plus a child
+# table with one row per record (keyed by entity_id). The nested parts of an
+# entity that don't have a fixed shape are kept as JSON strings.
+
+ENTITY_SCHEMA = pa.schema([
+    ('entity_id', pa.int64()),
+    ('entity_name', pa.string()),
+    ('record_count', pa.int32()),
+    ('record_summary', pa.string()),    # JSON
+    ('features', pa.string()),          # JSON
+    ('related_entities', pa.string())]) # JSON
+
+RECORD_SCHEMA = pa.schema([
+    ('entity_id', pa.int64()),
+    ('data_source', pa.string()),
+    ('record_id', pa.string()),
+    ('internal_id', pa.int64()),
+    ('match_key', pa.string()),
+    ('match_level_code', pa.string()),
+    ('errule_code', pa.string())])
+
+def _json_or_none(x):
+    return None if x is None else jsonlib.dumps(x)
+
+class ParquetExportWriter:
+    '''Flattens Senzing entity JSON documents into the entity and record
+    tables, writing a row group to each output every row_group_size entities
+    so that only one row group is ever held in memory.
+    entities_out / records_out are writable file-like objects (e.g.,
+    multipart.PartWriter); compression is a Parquet codec name or 'none'.'''
+
+    def __init__(self, entities_out, records_out, compression='none', row_group_size=50000):
+        self.row_group_size = row_group_size
+        self._entities_writer = pq.ParquetWriter(entities_out, ENTITY_SCHEMA, compression=compression)
+        self._records_writer = pq.ParquetWriter(records_out, RECORD_SCHEMA, compression=compression)
+        self._entities = {name: [] for name in ENTITY_SCHEMA.names}
+        self._records = {name: [] for name in RECORD_SCHEMA.names}
+        self._num_pending = 0
+        self.num_entities = 0
+        self.num_records = 0
+
+    def add(self, doc):
+        '''Adds one entity JSON document (as returned by fetch_next or
+        get_entity_by_entity_id).'''
+        d = jsonlib.loads(doc)
+        ent = d.get('RESOLVED_ENTITY', {})
+        entity_id = ent.get('ENTITY_ID')
+        rcds = ent.get('RECORDS', [])
+        self._entities['entity_id'].append(entity_id)
+        self._entities['entity_name'].append(ent.get('ENTITY_NAME'))
+        self._entities['record_count'].append(len(rcds))
+        self._entities['record_summary'].append(_json_or_none(ent.get('RECORD_SUMMARY')))
+        self._entities['features'].append(_json_or_none(ent.get('FEATURES')))
+        self._entities['related_entities'].append(_json_or_none(d.get('RELATED_ENTITIES')))
+        for rcd in rcds:
+            self._records['entity_id'].append(entity_id)
+            self._records['data_source'].append(rcd.get('DATA_SOURCE'))
+            self._records['record_id'].append(rcd.get('RECORD_ID'))
+            self._records['internal_id'].append(rcd.get('INTERNAL_ID'))
+            self._records['match_key'].append(rcd.get('MATCH_KEY'))
+            self._records['match_level_code'].append(rcd.get('MATCH_LEVEL_CODE'))
+            self._records['errule_code'].append(rcd.get('ERRULE_CODE'))
+        self._num_pending += 1
+        if self._num_pending >= self.row_group_size:
+            self._write_row_groups()
+
+    def close(self):
+        '''Writes any remaining rows and the Parquet footers.'''
+        self._write_row_groups()
+        self._entities_writer.close()
+        self._records_writer.close()
+
+    def _write_row_groups(self):
+        if not self._num_pending: return
+        self.num_entities += self._num_pending
+        self.num_records += len(self._records['entity_id'])
+        self._entities_writer.write_table(pa.Table.from_pydict(self._entities, schema=ENTITY_SCHEMA))
+        if self._records['entity_id']:
+            self._records_writer.write_table(pa.Table.from_pydict(self._records, schema=RECORD_SCHEMA))
+        log.debug('Wrote row groups; %d entities, %d records so far.', self.num_entities, self.num_records)
+        for v in self._entities.values(): v.clear()
+        for v in self._records.values(): v.clear()
+        self._num_pending = 0
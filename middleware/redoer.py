@@ -1,5 +1,7 @@
 import json
 import os
+import queue
+import threading
 import time
 import sys
 import boto3
@@ -28,16 +30,28 @@ SZ_CALL_TIMEOUT_SECONDS = int(os.environ.get('SZ_CALL_TIMEOUT_SECONDS', 420))
 SZ_CONFIG = json.loads(os.environ['SENZING_ENGINE_CONFIGURATION_JSON'])
 RUNTIME_ENV = os.environ.get('RUNTIME_ENV', 'unknown') # For OTel
 
-# How long to wait before attempting next Senzing op.
+# When the redo queue is empty or Senzing raises SzRetryableError, the redoer
+# backs off exponentially (with jitter), starting from BACKOFF_BASE_SECONDS;
+# WAIT_SECONDS is the longest it will wait before attempting the next Senzing op.
 WAIT_SECONDS = int(os.environ.get('WAIT_SECONDS', 10))
 log.info(f'WAIT_SECONDS is: {WAIT_SECONDS}')
+BACKOFF_BASE_SECONDS = float(os.environ.get('BACKOFF_BASE_SECONDS', 0.5))
+
+# While redo records keep coming back from get_redo_record ("drain mode"),
+# count_redo_records is only called this often, to keep the queue gauge fresh.
+REDO_COUNT_INTERVAL_SECONDS = int(os.environ.get('REDO_COUNT_INTERVAL_SECONDS', 30))
 
 # How many times to attempt process_redo_record before giving up and moving on
 # (see README).
 MAX_REDO_ATTEMPTS = int(os.environ.get('MAX_REDO_ATTEMPTS', 20))
 
-ENABLE_OTEL_EMITS = int(os.environ.get('ENABLE_OTEL_EMITS', 1))
-log.info(f'ENABLE_OTEL_EMITS is: {ENABLE_OTEL_EMITS}')
+# Number of threads calling process_redo_record concurrently. With more than
+# one, the main thread only fetches redo records and queues them up for the
+# workers.
+REDOER_WORKERS = max(int(os.environ.get('REDOER_WORKERS', 1)), 1)
+log.info(f'REDOER_WORKERS is: {REDOER_WORKERS}')
+
+log.info(f'ENABLE_OTEL_EMITS is: {otel.ENABLE_OTEL_EMITS}')
 
 #-------------------------------------------------------------------------------
 
@@ -60,12 +74,16 @@ def go():
         log.error(fmterr(e))
 
     # OTel setup #
-    if ENABLE_OTEL_EMITS:
-        log.info('Starting OTel setup.')
-        meter = otel.init('redoer')
-        otel_msgs_counter = meter.create_counter('redoer.messages.count')
-        otel_durations = meter.create_histogram('redoer.messages.duration')
+    log.info('Starting OTel setup.')
+    meter = otel.init('redoer') # None if ENABLE_OTEL_EMITS is off
+    otel_msgs_counter = otel.counter(meter, 'redoer.messages.count')
+    otel_durations = otel.histogram(meter, 'redoer.messages.duration')
+    otel_attrs = otel.status_attributes('redoer', RUNTIME_ENV)
+    init_timeout_metrics(meter, 'redoer', RUNTIME_ENV)
+    stages = otel.StageTimings(meter, 'redoer', RUNTIME_ENV)
 
+    otel_queue_count_steward = None
+    if meter:
         def _otel_queue_count_steward(tally):
             '''Coroutine function; this lets us both:
                 - 1) easily pass in updated tally values via `send`
@@ -84,133 +102,193 @@ def go():
         next(otel_queue_count_steward) # prime it.
         meter.create_observable_gauge('redoer.queue.count', [otel_queue_count_steward])
 
-        log.info('Finished OTel setup.')
+    log.info('Finished OTel setup.')
     # end OTel setup #
 
-    log.info('Starting primary loop.')
+    # Affected entity IDs are written as each redo record is processed; they're
+    # not buffered (TRACKER_BUFFER_MAX_IDS doesn't apply). Senzing removes a
+    # redo record as part of process_redo_record, so there's no acknowledgement
+    # to hold back until buffered IDs are flushed -- a crash would lose them.
+    if db.TRACKER_BUFFER_MAX_IDS:
+        log.info('TRACKER_BUFFER_MAX_IDS is set, but Redoer writes entity IDs as it goes; ignoring.')
 
-    # Approach:
-    # - We don't try to both 'get' and 'process' in a single loop; instead we
-    #   'get', then 'continue' to the next loop; the have_rcd flag is used to
-    #   facilitate this.
-    #   - Rationale: the approach is simple and allows for the use of a single while-loop.
-    #     (An alternative would be to have two inner while-loops housed within
-    #     an outer while-loop.)
-    # - Each Senzing call (3 distinct calls) is couched in its own try-except block for
-    #   robustness.
-    tally = None
-    have_rcd = 0
-    rcd = None
-    attempts_left = MAX_REDO_ATTEMPTS
-    while 1:
-        try:
-            if have_rcd:
-                start = time.perf_counter()
-                success_status = otel.FAILURE # initial default value
+    # Guards re-initializing the Senzing config, which any worker may need to do.
+    reinit_lock = threading.Lock()
+
+    def reinit_sz_config():
+        nonlocal sz_factory
+        with reinit_lock:
+            sz_factory = sz_core.SzAbstractFactoryCore("ERS", SZ_CONFIG)
+            sz_config_mgr = sz_factory.create_configmanager()
+            default_config_id = sz_config_mgr.get_default_config_id()
+            sz_factory.reinitialize(default_config_id)
+        log.info(SZ_TAG + 'Re-initialized Senzing config to address SzUnknownDataSourceError.')
+
+    def redo(rcd):
+        '''Calls process_redo_record on rcd until it succeeds, retrying
+        SzRetryableError up to MAX_REDO_ATTEMPTS times. Returns the Senzing
+        response, or None if the record was given up on. Each call gets its
+        own attempts counter (and each attempt its own OTel status), so this
+        can run in several workers at once.'''
+        attempts_left = MAX_REDO_ATTEMPTS
+        while 1:
+            start = time.perf_counter()
+            success_status = otel.FAILURE # initial default value
+            try:
+                timer = start_call_timer(SZ_CALL_TIMEOUT_SECONDS)
                 try:
-                    start_alarm_timer(SZ_CALL_TIMEOUT_SECONDS)
                     log.debug('Calling process_redo_record ...')
-                    resp = sz_eng.process_redo_record(rcd, sz.SzEngineFlags.SZ_WITH_INFO)
+                    with stages.time('sz_call'):
+                        resp = sz_eng.process_redo_record(rcd, sz.SzEngineFlags.SZ_WITH_INFO)
                     log.debug('Successfully called process_redo_record.')
-                    cancel_alarm_timer()
-                    success_status = otel.SUCCESS
-                    have_rcd = 0
-                    log.debug(SZ_TAG + 'Successfully redid one record via process_redo_record().')
-
-                    # Save affected entity IDs to tracker table for exporting later.
-                    affected = util.parse_affected_entities_resp(resp)
-                    for entity_id in affected: db.add_entity_id(entity_id)
-
-                    continue
-
-                except sz.SzRetryableError as sz_ret_err:
-                    # We'll try to process this record again.
-                    log.error(SZ_TAG + fmterr(sz_ret_err))
-                    attempts_left -= 1
-                    log.debug(SZ_TAG + f'Remaining attempts for this record: {attempts_left}')
-                    if not attempts_left:
-                        have_rcd = 0
-                        log.error(SZ_TAG + f'Max redo attempts ({MAX_REDO_ATTEMPTS}) reached'
-                                  + ' for this record; dropping on the floor and moving on.')
-                    time.sleep(WAIT_SECONDS)
-                    continue
-                except sz.SzUnknownDataSourceError as sz_ds_err:
-                    # I'm not sure why this error could ever happen here, but it can.
-                    # The solution is to re-init the Sz config.
-                    log.error(SZ_TAG + fmterr(sz_ds_err))
-                    sz_factory = sz_core.SzAbstractFactoryCore("ERS", SZ_CONFIG)
-                    sz_config_mgr = sz_factory.create_configmanager()
-                    default_config_id = sz_config_mgr.get_default_config_id()
-                    sz_factory.reinitialize(default_config_id)
-                    log.info(SZ_TAG + 'Re-initialized Senzing config to address SzUnknownDataSourceError.')
-                    time.sleep(1)
-                    continue
-                except LongRunningCallTimeoutEx as lrex:
-                    # Abandon and move on.
-                    have_rcd = 0
-                    log.error(build_sz_timeout_msg(
-                        type(lrex).__module__,
-                        type(lrex).__qualname__,
-                        SZ_CALL_TIMEOUT_SECONDS,
-                        receipt_handle))
-                    time.sleep(1)
-                except sz.SzError as sz_err:
-                    log.error(SZ_TAG + fmterr(sz_err))
-                    time.sleep(1)
-
                 finally:
-                    finish = time.perf_counter()
-                    if ENABLE_OTEL_EMITS:
-                        otel_msgs_counter.add(1,
-                            {'status': success_status,
-                            'service': 'redoer',
-                            'environment': RUNTIME_ENV})
-                        otel_durations.record(finish - start,
-                            {'status':  success_status,
-                             'service': 'redoer',
-                             'environment': RUNTIME_ENV})
+                    cancel_call_timer(timer)
+                success_status = otel.SUCCESS
+                log.debug(SZ_TAG + 'Successfully redid one record via process_redo_record().')
+                return resp
 
-            else:
-                try:
-                    log.debug('Calling count_redo_records ...')
+            except sz.SzRetryableError as sz_ret_err:
+                # We'll try to process this record again.
+                log.error(SZ_TAG + fmterr(sz_ret_err))
+                attempts_left -= 1
+                log.debug(SZ_TAG + 'Remaining attempts for this record: %d', attempts_left)
+                if not attempts_left:
+                    log.error(SZ_TAG + f'Max redo attempts ({MAX_REDO_ATTEMPTS}) reached'
+                              + ' for this record; dropping on the floor and moving on.')
+                    return None
+                time.sleep(util.backoff_seconds(
+                    MAX_REDO_ATTEMPTS - attempts_left, BACKOFF_BASE_SECONDS, WAIT_SECONDS))
+            except sz.SzUnknownDataSourceError as sz_ds_err:
+                # I'm not sure why this error could ever happen here, but it can.
+                # The solution is to re-init the Sz config.
+                log.error(SZ_TAG + fmterr(sz_ds_err))
+                reinit_sz_config()
+                time.sleep(1)
+            except LongRunningCallTimeoutEx as lrex:
+                # Abandon and move on.
+                log.error(build_sz_timeout_msg(
+                    type(lrex).__module__,
+                    type(lrex).__qualname__,
+                    SZ_CALL_TIMEOUT_SECONDS,
+                    None))
+                time.sleep(1)
+                return None
+            except sz.SzError as sz_err:
+                log.error(SZ_TAG + fmterr(sz_err))
+                time.sleep(1)
+
+            finally:
+                finish = time.perf_counter()
+                otel_msgs_counter.add(1, otel_attrs[success_status])
+                otel_durations.record(finish - start, otel_attrs[success_status])
+
+    def handle_rcd(rcd):
+        resp = redo(rcd)
+        if resp is None: return
+        # Save affected entity IDs to tracker table for exporting later.
+        with stages.time('response_parse'):
+            affected = util.parse_affected_entities_resp(resp)
+        with stages.time('tracker_write'):
+            db.add_entity_ids(affected, source='redoer')
+
+    # Fetcher state (only ever touched by the main thread).
+    draining = False   # Records have been coming back; skip the count.
+    last_count = None  # When count_redo_records was last called.
+    idle_polls = 0     # Consecutive polls that came back empty (or errored).
+
+    def idle_wait(reason):
+        nonlocal idle_polls
+        wait = util.backoff_seconds(idle_polls, BACKOFF_BASE_SECONDS, WAIT_SECONDS)
+        idle_polls += 1
+        log.debug('%s Will wait %.2f seconds.', reason, wait)
+        time.sleep(wait)
+
+    def get_rcd():
+        '''Returns the next redo record, or None if there wasn't one (having
+        waited as appropriate before returning).'''
+        nonlocal draining, last_count, idle_polls
+        now = time.monotonic()
+        if not draining or now - last_count >= REDO_COUNT_INTERVAL_SECONDS:
+            try:
+                log.debug('Calling count_redo_records ...')
+                with stages.time('sz_count'):
                     tally = sz_eng.count_redo_records()
-                    if ENABLE_OTEL_EMITS:
-                        otel_queue_count_steward.send(tally)
-                    log.debug(SZ_TAG + 'Current redo count: ' + str(tally))
-                except sz.SzRetryableError as sz_ret_err:
-                    log.error(SZ_TAG + fmterr(sz_ret_err))
-                    time.sleep(WAIT_SECONDS)
-                    continue
-                except sz.SzError as sz_err:
-                    log.error(SZ_TAG + fmterr(sz_err))
+                last_count = now
+                if otel_queue_count_steward:
+                    otel_queue_count_steward.send(tally)
+                log.debug(SZ_TAG + 'Current redo count: %s', tally)
+            except sz.SzRetryableError as sz_ret_err:
+                log.error(SZ_TAG + fmterr(sz_ret_err))
+                idle_wait('count_redo_records raised SzRetryableError.')
+                return None
+            except sz.SzError as sz_err:
+                log.error(SZ_TAG + fmterr(sz_err))
+                time.sleep(1)
+                return None
+
+            if not tally and not draining:
+                idle_wait('No redo records.')
+                return None
+
+        try:
+            log.debug('Calling get_redo_record ...')
+            with stages.time('sz_fetch'):
+                rcd = sz_eng.get_redo_record()
+            if rcd:
+                log.debug(SZ_TAG + 'Retrieved 1 record via get_redo_record()')
+                if not draining: log.debug('Entering drain mode.')
+                draining = True
+                idle_polls = 0
+                return rcd
+            log.debug(SZ_TAG + 'Got nothing from get_redo_record; leaving drain mode.')
+            draining = False
+            idle_wait('Redo queue is empty.')
+        except sz.SzRetryableError as sz_ret_err:
+            log.error(SZ_TAG + fmterr(sz_ret_err))
+            idle_wait('get_redo_record raised SzRetryableError.')
+        except sz.SzError as sz_err:
+            log.error(SZ_TAG + fmterr(sz_err))
+            time.sleep(1)
+        return None
+
+    # With REDOER_WORKERS > 1, this (main) thread only fetches redo records,
+    # handing them to the workers through a bounded queue; put() blocks while
+    # the queue is full, so at most REDOER_WORKERS records wait at any time.
+    work_q = None
+    if REDOER_WORKERS > 1:
+        work_q = queue.Queue(maxsize=REDOER_WORKERS)
+
+        def worker():
+            while 1:
+                rcd = work_q.get()
+                try:
+                    handle_rcd(rcd)
+                except Exception as e:
+                    log.error(fmterr(e))
                     time.sleep(1)
 
-                if tally:
-
-                    try:
-                        log.debug('Calling get_redo_record ...')
-                        rcd = sz_eng.get_redo_record()
-                        if rcd:
-                            have_rcd = 1
-                            attempts_left = MAX_REDO_ATTEMPTS
-                            # At this point, rcd var holds a record, and have_rcd flag
-                            # raised. Will process in the next loop.
-                            log.debug(SZ_TAG + 'Retrieved 1 record via get_redo_record()')
-                        else:
-                            log.debug(SZ_TAG + 'Redo count was greater than 0, but got '
-                                      + 'nothing from get_redo_record')
-                    except sz.SzRetryableError as sz_ret_err:
-                        # No additional action needed; we'll just try getting again.
-                        log.error(SZ_TAG + fmterr(sz_ret_err))
-                        time.sleep(1)
-                    except sz.SzError as sz_err:
-                        log.error(SZ_TAG + fmterr(sz_err))
-                        time.sleep(1)
-
-                else:
-                    log.debug('No redo records. Will wait ' + str(WAIT_SECONDS) + ' seconds.')
-                    time.sleep(WAIT_SECONDS)
+        for n in range(REDOER_WORKERS):
+            threading.Thread(target=worker, name=f'worker-{n}', daemon=True).start()
+        log.info(f'Started {REDOER_WORKERS} redo worker threads.')
+
+    log.info('Starting primary loop.')
 
+    # Approach:
+    # - Fetching (count_redo_records, then get_redo_record) and processing
+    #   (process_redo_record) are separate steps, so that they can run in
+    #   separate threads.
+    # - While records keep coming, count_redo_records is only called every
+    #   REDO_COUNT_INTERVAL_SECONDS (it's one DB query per call).
+    # - Each Senzing call (3 distinct calls) is couched in its own try-except block for
+    #   robustness.
+    while 1:
+        try:
+            rcd = get_rcd()
+            if not rcd: continue
+            if work_q:
+                work_q.put(rcd)
+            else:
+                handle_rcd(rcd)
         except Exception as e:
             log.error(fmterr(e))
             time.sleep(1)
@@ -1,11 +1,19 @@
+import heapq
+import itertools
 import signal
+import threading
+import time
 
 from loglib import *
+log = retrieve_logger()
+
+import otel
 
 class LongRunningCallTimeoutEx(Exception):
     pass
 
 def alarm_handler(signum, _):
+    _record_overdue()
     raise LongRunningCallTimeoutEx()
 
 def start_alarm_timer(num_seconds):
@@ -24,3 +32,124 @@ def build_sz_timeout_msg(module_name,
         f'{SZ_TAG} {module_name}.{class_name} :: '
         + f'Long-running Senzing add_record call exceeded {num_seconds} sec.; '
         + f'abandoning and moving on; receipt_handle was: {receipt_handle}')
+
+#-------------------------------------------------------------------------------
+# Watchdog
+#
+# SIGALRM only fires in the main thread and there is one alarm per process, so
+# it can't guard calls made concurrently from worker threads. The watchdog
+# instead keeps any number of independent deadlines (one per in-flight call) in
+# a heap, serviced by a single background thread. A Senzing call blocked in C
+# code can't be interrupted from another thread; instead, when a deadline
+# passes the deadline is flagged (and its on_expire callback, if any, is run),
+# and cancel_call_timer raises LongRunningCallTimeoutEx once the call returns.
+
+class Deadline:
+    __slots__ = ('when', 'num_seconds', 'on_expire', 'expired', 'cancelled')
+
+    def __init__(self, when, num_seconds, on_expire):
+        self.when = when
+        self.num_seconds = num_seconds
+        self.on_expire = on_expire
+        self.expired = False
+        self.cancelled = False
+
+class Watchdog:
+    '''Thread-safe set of independent deadlines.'''
+
+    # Cancelled deadlines are left in the heap and discarded lazily; the heap
+    # is rebuilt once they make up more than half of it.
+    COMPACT_MIN = 64
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._num_cancelled = 0
+        self._thread = None
+
+    def add(self, num_seconds, on_expire=None):
+        d = Deadline(time.monotonic() + num_seconds, num_seconds, on_expire)
+        with self._cond:
+            heapq.heappush(self._heap, (d.when, next(self._seq), d))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='watchdog', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return d
+
+    def remove(self, d):
+        with self._cond:
+            if d.expired or d.cancelled: return
+            d.cancelled = True
+            self._num_cancelled += 1
+            if (self._num_cancelled > self.COMPACT_MIN
+                    and self._num_cancelled * 2 > len(self._heap)):
+                self._heap = [x for x in self._heap if not x[2].cancelled]
+                heapq.heapify(self._heap)
+                self._num_cancelled = 0
+
+    def _run(self):
+        while 1:
+            with self._cond:
+                while self._heap and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)
+                    self._num_cancelled -= 1
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                remaining = self._heap[0][0] - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                d = heapq.heappop(self._heap)[2]
+                d.expired = True
+            log.warning('Call still running past its %s sec. deadline.', d.num_seconds)
+            _record_overdue()
+            if d.on_expire:
+                try:
+                    d.on_expire()
+                except Exception as e:
+                    log.error(fmterr(e))
+
+_watchdog = Watchdog()
+
+def start_call_timer(num_seconds, on_expire=None):
+    '''Thread-safe counterpart to start_alarm_timer. In the main thread this is
+    just the SIGALRM timer (so a stalled call is actually interrupted);
+    elsewhere a watchdog deadline is registered and returned.'''
+    if threading.current_thread() is threading.main_thread():
+        start_alarm_timer(num_seconds)
+        return None
+    return _watchdog.add(num_seconds, on_expire)
+
+def cancel_call_timer(deadline):
+    '''Counterpart to start_call_timer. Raises LongRunningCallTimeoutEx if the
+    watchdog deadline passed before the call returned.'''
+    if deadline is None:
+        cancel_alarm_timer()
+        return
+    _watchdog.remove(deadline)
+    if deadline.expired:
+        _record_overrun(time.monotonic() - deadline.when)
+        raise LongRunningCallTimeoutEx()
+
+#-------------------------------------------------------------------------------
+# Metrics for calls that ran past their deadline (no-ops until
+# init_timeout_metrics is called).
+
+_otel_overdue_counter = otel.counter(None, None)
+_otel_overrun_durations = otel.histogram(None, None)
+_otel_attrs = {}
+
+def init_timeout_metrics(meter, service_name, runtime_env):
+    global _otel_overdue_counter, _otel_overrun_durations, _otel_attrs
+    _otel_attrs = {'service': service_name, 'environment': runtime_env}
+    _otel_overdue_counter = otel.counter(meter, service_name + '.calls.overdue')
+    _otel_overrun_durations = otel.histogram(meter, service_name + '.calls.overrun')
+
+def _record_overdue():
+    _otel_overdue_counter.add(1, _otel_attrs)
+
+def _record_overrun(seconds):
+    _otel_overrun_durations.record(seconds, _otel_attrs)
@@ -1,6 +1,12 @@
-import json
+import random
+
+import jsonlib
 
 def parse_affected_entities_resp(resp):
     '''Returns array of ints (entity IDs)'''
-    r = json.loads(resp)
-    return list(map(lambda m: m['ENTITY_ID'], r['AFFECTED_ENTITIES']))
+    return jsonlib.get_affected_entity_ids(resp)
+
+def backoff_seconds(attempt, base_seconds, max_seconds):
+    '''Exponential backoff with "full jitter": a random wait of between 0 and
+    base_seconds * 2**attempt, capped at max_seconds.'''
+    return random.uniform(0, min(max_seconds, base_seconds * (2 ** min(attempt, 32))))
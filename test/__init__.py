@@ -0,0 +1,30 @@
+import importlib
+import os
+import sys
+from unittest import mock
+
+# The middleware modules import each other as top-level modules (e.g.,
+# `import db`), as they do in their containers; the bench fakes stand in for
+# Senzing, S3 and the export tracker in unit tests.
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for _path in ('middleware', 'bench'):
+    if os.path.join(_ROOT, _path) not in sys.path:
+        sys.path.insert(0, os.path.join(_ROOT, _path))
+
+# Placeholders for the environment variables the middleware modules require.
+_ENV = {
+    'PGUSER': 'test',
+    'PGPASSWORD': 'test',
+    'PGHOST': 'localhost',
+    'Q_URL': 'http://localhost/queue',
+    'S3_BUCKET_NAME': 'test-bucket',
+    'SENZING_ENGINE_CONFIGURATION_JSON': '{}',
+    'ENABLE_OTEL_EMITS': '0'}
+
+def import_middleware(name):
+    '''Imports the middleware module name without a database (db's
+    connection is a mock); tests swap in a bench FakeDb for module.db where
+    they need the export tracker.'''
+    for k, v in _ENV.items(): os.environ.setdefault(k, v)
+    with mock.patch('psycopg2.connect'):
+        return importlib.import_module(name)
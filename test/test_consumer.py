@@ -0,0 +1,87 @@
+import unittest
+from unittest import mock
+
+import fakes
+from test import import_middleware
+
+consumer = import_middleware('consumer')
+
+class FlakySQS:
+    '''delete_message_batch fails the given entries (by receipt handle) with
+    the given SenderFault; delete_message fails for the handles in
+    single_failures.'''
+
+    def __init__(self, batch_failures=None, single_failures=(), batch_error=None):
+        self.batch_failures = batch_failures or {}
+        self.single_failures = set(single_failures)
+        self.batch_error = batch_error
+        self.batches = []
+        self.singles = []
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        self.batches.append([e['ReceiptHandle'] for e in Entries])
+        if self.batch_error: raise self.batch_error
+        return {
+            'Successful': [{'Id': e['Id']} for e in Entries
+                           if e['ReceiptHandle'] not in self.batch_failures],
+            'Failed': [{'Id': e['Id'], 'SenderFault': self.batch_failures[e['ReceiptHandle']],
+                        'Code': 'X', 'Message': 'failed'}
+                       for e in Entries if e['ReceiptHandle'] in self.batch_failures]}
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        self.singles.append(ReceiptHandle)
+        if ReceiptHandle in self.single_failures: raise IOError('boom')
+        return {}
+
+class TestDelMsgs(unittest.TestCase):
+
+    def test_batches_of_ten(s):
+        sqs = FlakySQS()
+        rhs = [f'rh{n}' for n in range(21)]
+        s.assertEqual(consumer.del_msgs(sqs, 'q', rhs), [])
+        s.assertEqual([len(b) for b in sqs.batches], [10, 10])
+        # A chunk of one is deleted on its own.
+        s.assertEqual(sqs.singles, ['rh20'])
+
+    def test_partial_failure_retried_once(s):
+        sqs = FlakySQS(batch_failures={'rh1': False, 'rh2': False, 'rh3': True},
+                       single_failures={'rh2'})
+        failed = consumer.del_msgs(sqs, 'q', ['rh0', 'rh1', 'rh2', 'rh3'])
+        # rh1 succeeds on retry; rh2 fails again; rh3 was the request's fault,
+        # so it isn't retried.
+        s.assertEqual(sqs.singles, ['rh1', 'rh2'])
+        s.assertEqual(failed, ['rh2', 'rh3'])
+
+    def test_batch_call_failure_falls_back_to_singles(s):
+        sqs = FlakySQS(batch_error=IOError('boom'), single_failures={'rh1'})
+        failed = consumer.del_msgs(sqs, 'q', ['rh0', 'rh1', 'rh2'])
+        s.assertEqual(sqs.singles, ['rh0', 'rh1', 'rh2'])
+        s.assertEqual(failed, ['rh1'])
+
+class TestGetMsgs(unittest.TestCase):
+
+    def test_before_receive_runs_before_every_receive(s):
+        calls = []
+        sqs = mock.Mock()
+        sqs.receive_message.side_effect = lambda **kwargs: (
+            calls.append('receive') or {'Messages': [{'ReceiptHandle': 'rh', 'Body': '{}'}]})
+        msgs = consumer.get_msgs(sqs, 'q', mock.MagicMock(),
+                                 before_receive=lambda: calls.append('flush'))
+        next(msgs)
+        next(msgs)
+        s.assertEqual(calls, ['flush', 'receive', 'flush', 'receive'])
+
+class TestDataSources(unittest.TestCase):
+
+    def test_registered_codes_are_upper_case(s):
+        sz_config = fakes.FakeSzConfig({'CUSTOMERS', 'Watchlist'})
+        s.assertEqual(consumer.get_registered_data_sources(sz_config), {'CUSTOMERS', 'WATCHLIST'})
+
+    def test_known_data_source_any_case(s):
+        factory = mock.Mock()
+        with mock.patch.object(consumer, '_known_data_sources', {'CUSTOMERS'}):
+            consumer.register_data_source(factory, 'customers')
+        factory.create_configmanager.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from test import import_middleware
+
+db = import_middleware('db')
+
+class TestEntityIdBuffer(unittest.TestCase):
+
+    def setUp(s):
+        s.written = []
+        s.fail = False
+        def add_entity_ids(entity_ids, source=None):
+            if s.fail: raise IOError('boom')
+            s.written.append(list(entity_ids))
+        patcher = mock.patch.object(db, 'add_entity_ids', add_entity_ids)
+        patcher.start()
+        s.addCleanup(patcher.stop)
+        s.flushed = []
+
+    def test_flush_on_size(s):
+        buf = db.EntityIdBuffer(max_ids=3, max_age_seconds=60, on_flushed=s.flushed.extend)
+        buf.add([1, 2], token='a')
+        buf.add([2], token='b')
+        s.assertEqual(s.written, [])
+        buf.add([3], token='c')
+        s.assertEqual(s.written, [[1, 2, 3]])
+        s.assertEqual(s.flushed, ['a', 'b', 'c'])
+
+    def test_flush_on_age(s):
+        done = threading.Event()
+        buf = db.EntityIdBuffer(max_ids=100, max_age_seconds=0.2,
+                                on_flushed=lambda tokens: (s.flushed.extend(tokens), done.set()))
+        buf.start()
+        start = time.monotonic()
+        buf.add([5, 4], token='a')
+        s.assertTrue(done.wait(2))
+        s.assertGreaterEqual(time.monotonic() - start, 0.2)
+        s.assertEqual(s.written, [[4, 5]])
+        s.assertEqual(s.flushed, ['a'])
+
+    def test_failed_flush_is_retried(s):
+        buf = db.EntityIdBuffer(max_ids=100, max_age_seconds=60, on_flushed=s.flushed.extend)
+        buf.add([1], token='a')
+        s.fail = True
+        buf.flush()
+        s.assertEqual(s.flushed, [])
+        buf.add([2], token='b')
+        s.fail = False
+        buf.flush()
+        s.assertEqual(s.written, [[1, 2]])
+        s.assertEqual(s.flushed, ['a', 'b'])
+
+    def test_empty_flush(s):
+        db.EntityIdBuffer(max_ids=100, max_age_seconds=60).flush()
+        s.assertEqual(s.written, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import json
+import unittest
+from unittest import mock
+
+import fakes
+import otel
+from test import import_middleware
+
+exporter = import_middleware('exporter')
+
+class TestSplitLines(unittest.TestCase):
+
+    def test_recut(s):
+        chunks = ['{"a":1}\n{"a"', ':2}\n', '', '{"a":3}\n{"a":4}']
+        s.assertEqual(list(exporter.split_lines(chunks)),
+                      ['{"a":1}\n', '{"a":2}\n', '{"a":3}\n', '{"a":4}'])
+
+    def test_blank_lines_dropped(s):
+        s.assertEqual(list(exporter.split_lines(['\n\nx\n', '\n'])), ['x\n'])
+        s.assertEqual(list(exporter.split_lines([])), [])
+
+class TestCheckpointer(unittest.TestCase):
+
+    def setUp(s):
+        s.db = fakes.FakeDb(0)
+        patcher = mock.patch.object(exporter, 'db', s.db)
+        patcher.start()
+        s.addCleanup(patcher.stop)
+        s.cp = exporter.Checkpointer('cp', 'key', 'upload')
+
+    def saved(s):
+        cp = s.db.get_export_checkpoint('cp')
+        return cp and ([p['PartNumber'] for p in cp['parts']], cp['entities_written'],
+                       cp['last_entity_id'])
+
+    def test_only_contiguous_parts(s):
+        for n in (1, 2, 3):
+            s.cp.part_cut(n, n * 100, n * 1000)
+        s.cp.part_uploaded(2, 'e2')
+        s.assertIsNone(s.saved())
+        s.cp.part_uploaded(1, 'e1')
+        s.assertEqual(s.saved(), ([1, 2], 200, 2000))
+        s.cp.part_uploaded(3, 'e3')
+        s.assertEqual(s.saved(), ([1, 2, 3], 300, 3000))
+        s.assertEqual(s.cp.parts[0], {'PartNumber': 1, 'ETag': 'e1'})
+
+    def test_uploaded_before_cut(s):
+        # A part can finish uploading before part_cut is called for it.
+        s.cp.part_uploaded(1, 'e1')
+        s.assertIsNone(s.saved())
+        s.cp.part_cut(1, 10, 11)
+        s.cp.part_cut(2, 20, 21)
+        s.cp.part_uploaded(2, 'e2')
+        s.assertEqual(s.saved(), ([1, 2], 20, 21))
+
+    def test_resumed(s):
+        cp = exporter.Checkpointer('cp', 'key', 'upload', parts=[{'PartNumber': 1, 'ETag': 'e1'}],
+                                   entities_written=10, last_entity_id=11)
+        cp.part_cut(2, 20, 21)
+        cp.part_uploaded(2, 'e2')
+        s.assertEqual(s.saved(), ([1, 2], 20, 21))
+
+class TestExportDue(unittest.TestCase):
+
+    def setUp(s):
+        patcher = mock.patch.multiple(
+            exporter, EXPORT_DAEMON_MIN_ENTITIES=1000, EXPORT_DAEMON_MAX_AGE_SECONDS=300,
+            EXPORT_DAEMON_MIN_INTERVAL_SECONDS=60, EXPORT_DAEMON_MAX_INTERVAL_SECONDS=3600)
+        patcher.start()
+        s.addCleanup(patcher.stop)
+
+    def test_nothing_todo(s):
+        s.assertIsNone(exporter.export_due(0, None, None))
+        s.assertIsNone(exporter.export_due(0, None, 10000))
+
+    def test_min_interval(s):
+        s.assertIsNone(exporter.export_due(5000, 1000, 30))
+
+    def test_triggers(s):
+        s.assertIn('TODO', exporter.export_due(1000, 1, 120))
+        s.assertIn('old', exporter.export_due(1, 300, 120))
+        s.assertIn('startup', exporter.export_due(1, 1, None))
+        s.assertIn('since the last export', exporter.export_due(1, 1, 3600))
+        s.assertIsNone(exporter.export_due(1, 1, 120))
+
+class TestWriteManifest(unittest.TestCase):
+
+    def test_totals(s):
+        s3 = fakes.FakeS3(0)
+        db = fakes.FakeDb(0)
+        db.record_export_shard('r1', 0, 2, ['k0'], 10, 12)
+        shards = db.record_export_shard('r1', 1, 2, ['k1'], 11, 10)
+        with mock.patch.multiple(exporter, EXPORT_RUN_ID='r1', EXPORT_SHARDS=2):
+            key = exporter.write_manifest(s3, shards)
+        manifest = json.loads(s3.objects[key])
+        s.assertEqual((manifest['entities_written'], manifest['entities_expected']), (21, 22))
+        s.assertEqual([x['object_keys'] for x in manifest['shards']], [['k0'], ['k1']])
+
+class TestClaimEntityIds(unittest.TestCase):
+
+    def setUp(s):
+        s.db = fakes.FakeDb(0)
+        patcher = mock.patch.multiple(exporter, db=s.db, EXPORT_CLAIM_CHUNK_SIZE=10)
+        patcher.start()
+        s.addCleanup(patcher.stop)
+        s.stages = otel.StageTimings(None, 'exporter', 'test')
+
+    def test_limit(s):
+        s.db.add_entity_ids(list(range(1, 101)))
+        claimed = list(exporter.claim_entity_ids('me', s.stages, 25))
+        s.assertEqual(claimed, list(range(1, 26)))
+        s.assertEqual(s.db.get_tallies()['IN PROGRESS'], 25)
+
+    def test_each_entity_claimed_once(s):
+        s.db.add_entity_ids(list(range(1, 31)))
+        claimed = []
+        for entity_id in exporter.claim_entity_ids('me', s.stages, 1000):
+            claimed.append(entity_id)
+            # Touched again (back to TODO) after being claimed.
+            if entity_id == 5: s.db.add_entity_ids([1, 2])
+        s.assertEqual(claimed, list(range(1, 31)))
+        s.db.shift_claimed_to_done('me')
+        s.assertEqual(s.db.get_tallies()['TODO'], 2)
+
+class TestContentHashes(unittest.TestCase):
+
+    def test_unchanged(s):
+        db = fakes.FakeDb(0)
+        with mock.patch.object(exporter, 'db', db):
+            db.add_entity_ids([1, 2, 3])
+            db.claim_chunk('me', 10, 60)
+            hashes = exporter.ContentHashes('me', otel.StageTimings(None, 'exporter', 'test'))
+            hashes.claimed([1, 2, 3])
+            s.assertFalse(hashes.unchanged(1, 'one'))
+            s.assertFalse(hashes.unchanged(2, None))
+            hashes.flush()
+            db.shift_claimed_to_done('me')
+
+            db.add_entity_ids([1, 3])
+            db.claim_chunk('you', 10, 60)
+            hashes = exporter.ContentHashes('you', otel.StageTimings(None, 'exporter', 'test'))
+            hashes.claimed([1, 3])
+            s.assertTrue(hashes.unchanged(1, 'one'))
+            s.assertFalse(hashes.unchanged(3, 'three'))
+            s.assertEqual(hashes.num_unchanged, 1)
+
+if __name__ == '__main__':
+    unittest.main()
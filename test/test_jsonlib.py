@@ -0,0 +1,62 @@
+import json
+import unittest
+
+import jsonlib
+
+class TestGetStrFields(unittest.TestCase):
+
+    def test_top_level_fields(s):
+        doc = '{"DATA_SOURCE": "CUSTOMERS", "RECORD_ID": "1001", "NAME_FULL": "Jane Doe"}'
+        s.assertEqual(jsonlib.get_str_fields(doc, ('DATA_SOURCE', 'RECORD_ID')),
+                      ('CUSTOMERS', '1001'))
+
+    def test_escaped_value(s):
+        doc = json.dumps({'DATA_SOURCE': 'D', 'RECORD_ID': 'a"b\\c'})
+        s.assertEqual(jsonlib.get_str_fields(doc, ('DATA_SOURCE', 'RECORD_ID')), ('D', 'a"b\\c'))
+
+    def test_nested_field_is_not_top_level(s):
+        doc = '{"DATA_SOURCE":"D","N":{"RECORD_ID":"X"}}'
+        with s.assertRaises(KeyError):
+            jsonlib.get_str_fields(doc, ('DATA_SOURCE', 'RECORD_ID'))
+
+    def test_brackets_inside_str_values(s):
+        # The "}" in A's value must not make the nested RECORD_ID look like a
+        # top-level one.
+        doc = '{"DATA_SOURCE":"D","A":"}","N":{"RECORD_ID":"X"}}'
+        s.assertIsNone(jsonlib._top_level_str_field(doc, 'RECORD_ID'))
+        with s.assertRaises(KeyError):
+            jsonlib.get_str_fields(doc, ('DATA_SOURCE', 'RECORD_ID'))
+        doc = '{"DATA_SOURCE":"D","A":"{[","RECORD_ID":"R"}'
+        s.assertEqual(jsonlib.get_str_fields(doc, ('DATA_SOURCE', 'RECORD_ID')), ('D', 'R'))
+
+class TestGetAffectedEntityIds(unittest.TestCase):
+
+    def test_matches_loads(s):
+        for resp in (
+                '{"DATA_SOURCE":"D","RECORD_ID":"1","AFFECTED_ENTITIES":[{"ENTITY_ID":1},{"ENTITY_ID":22}]}',
+                '{"DATA_SOURCE":"D","RECORD_ID":"1","AFFECTED_ENTITIES":[]}',
+                '{"AFFECTED_ENTITIES":[{"ENTITY_ID":5,"LENS_CODE":"X"},{"ENTITY_ID":6}]}',
+                # Nested brackets in the entries: the fast path gives up.
+                '{"AFFECTED_ENTITIES":[{"ENTITY_ID":5,"X":[{"ENTITY_ID":9}]},{"ENTITY_ID":6}]}'):
+            s.assertEqual(jsonlib.get_affected_entity_ids(resp),
+                          [x['ENTITY_ID'] for x in json.loads(resp)['AFFECTED_ENTITIES']])
+
+    def test_missing(s):
+        with s.assertRaises(KeyError):
+            jsonlib.get_affected_entity_ids('{"DATA_SOURCE":"D","RECORD_ID":"1"}')
+
+class TestGetEntityId(unittest.TestCase):
+
+    def test_fast_path(s):
+        s.assertEqual(jsonlib.get_entity_id('{"RESOLVED_ENTITY":{"ENTITY_ID":42,"ENTITY_NAME":"X"}}\n'), 42)
+
+    def test_falls_back_to_loads(s):
+        doc = json.dumps({'RELATED_ENTITIES': [{'ENTITY_ID': 7}], 'RESOLVED_ENTITY': {'ENTITY_ID': 8}})
+        s.assertEqual(jsonlib.get_entity_id(doc), 8)
+
+    def test_round_trip(s):
+        doc = {'RESOLVED_ENTITY': {'ENTITY_ID': 3, 'ENTITY_NAME': 'Jane "J" Doe'}}
+        s.assertEqual(jsonlib.loads(jsonlib.dumps(doc)), doc)
+
+if __name__ == '__main__':
+    unittest.main()
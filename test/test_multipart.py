@@ -0,0 +1,87 @@
+import io
+import time
+import unittest
+
+import fakes
+import multipart
+
+MiB = 1024 ** 2
+
+class TestPartSizer(unittest.TestCase):
+
+    def test_min_part_size(s):
+        s.assertEqual(multipart.PartSizer(MiB).size(1, 0), multipart.MIN_PART_SIZE)
+        s.assertEqual(multipart.PartSizer(10 * MiB).size(1, 0), 10 * MiB)
+        # Rounded up to whole MiB.
+        s.assertEqual(multipart.PartSizer(10 * MiB + 1).size(1, 0), 11 * MiB)
+
+    def test_small_estimate_keeps_min_size(s):
+        sizer = multipart.PartSizer(10 * MiB, lambda b: 100 * MiB)
+        s.assertEqual(sizer.size(1, 0), 10 * MiB)
+
+    def test_large_estimate_fits_planned_parts(s):
+        estimated = 200 * 1024 ** 3
+        sizer = multipart.PartSizer(10 * MiB, lambda b: estimated)
+        size = sizer.size(1, 0)
+        s.assertGreater(size, 10 * MiB)
+        s.assertEqual(size % MiB, 0)
+        s.assertGreaterEqual(size * sizer.PLANNED_PARTS, estimated)
+        # Later parts cover what's left of the estimate.
+        s.assertEqual(sizer.size(2501, estimated // 2), size)
+
+    def test_growth_past_planned_parts(s):
+        sizer = multipart.PartSizer(10 * MiB)
+        planned = sizer.PLANNED_PARTS
+        s.assertEqual(sizer.size(planned, 0), 10 * MiB)
+        s.assertEqual(sizer.size(planned + 1, 0), 20 * MiB)
+        s.assertEqual(sizer.size(planned + sizer.GROW_EVERY, 0), 20 * MiB)
+        s.assertEqual(sizer.size(planned + sizer.GROW_EVERY + 1, 0), 40 * MiB)
+        s.assertEqual(sizer.size(multipart.MAX_PARTS, 0), multipart.MAX_PART_SIZE)
+
+    def test_max_parts_hold_5_tb(s):
+        sizer = multipart.PartSizer(10 * MiB)
+        total = sum(sizer.size(n, 0) for n in range(1, multipart.MAX_PARTS + 1))
+        s.assertGreaterEqual(total, 5 * 1024 ** 4)
+
+class TestPipelinedUpload(unittest.TestCase):
+
+    def upload(s, s3, num_threads, data, part_size):
+        upload_id = s3.create_multipart_upload(Bucket='b', Key='k')['UploadId']
+        uploader = multipart.PipelinedUploader(s3, 'b', 'k', upload_id, num_threads=num_threads)
+        writer = multipart.PartWriter(uploader, part_size)
+        for chunk in data: writer.write(chunk)
+        writer.close()
+        return upload_id, uploader.finish()
+
+    def test_parts_in_order(s):
+        for num_threads in (0, 3):
+            s3 = fakes.FakeS3(0)
+            upload_id, parts = s.upload(s3, num_threads, [b'x' * 7] * 10, 20)
+            s.assertEqual([p['PartNumber'] for p in parts], [1, 2, 3, 4])
+            sizes = [s3.uploads[upload_id]['Parts'][n] for n in (1, 2, 3, 4)]
+            s.assertEqual(sizes, [21, 21, 21, 7])
+
+    def test_empty_upload_has_one_part(s):
+        _, parts = s.upload(fakes.FakeS3(0), 2, [], 20)
+        s.assertEqual([p['PartNumber'] for p in parts], [1])
+
+    def test_abort_waits_for_uploads_under_way(s):
+        uploaded = []
+        class SlowS3:
+            def upload_part(self, PartNumber, **kwargs):
+                time.sleep(0.1)
+                uploaded.append((PartNumber, time.monotonic()))
+                return {'ETag': str(PartNumber)}
+        uploader = multipart.PipelinedUploader(SlowS3(), 'b', 'k', 'u', num_threads=2, max_queued=4)
+        threads = list(uploader._threads)
+        for n in range(1, 7):
+            uploader.submit(n, io.BytesIO(b'x'))
+        uploader.abort()
+        s.assertFalse(any(t.is_alive() for t in threads))
+        aborted = time.monotonic()
+        time.sleep(0.3)
+        s.assertTrue(uploaded)
+        s.assertTrue(all(t <= aborted for _, t in uploaded))
+
+if __name__ == '__main__':
+    unittest.main()